@@ -4,3 +4,25 @@ from django.apps import AppConfig
 class ContractConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.contract'
+
+    def ready(self):
+        from celery.signals import worker_process_init
+        from django.core import checks
+
+        from .services_converter import check_document_converter
+        from .services_templates import ContractTemplateRegistry
+
+        checks.register(check_document_converter, 'converter', deploy=True)
+
+        # Веб-процесс держит в памяти байты шаблонов, компиляция - при первом рендере
+        ContractTemplateRegistry.preload(compile_templates=False)
+
+        worker_process_init.connect(preload_contract_templates, weak=False)
+
+
+def preload_contract_templates(**kwargs):
+    """ Каждый процесс Celery компилирует все шаблоны договоров при старте """
+
+    from .services_templates import ContractTemplateRegistry
+
+    ContractTemplateRegistry.preload()
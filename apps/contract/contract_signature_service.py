@@ -1,12 +1,10 @@
 # apps/contract/contract_signature_service.py
 
-import hashlib
 import base64
-import os
-import subprocess
 import json
 from datetime import datetime
 from io import BytesIO
+from pathlib import Path
 
 import qrcode
 import requests
@@ -14,13 +12,16 @@ from typing import Dict, Any, Optional
 import logging
 
 from django.conf import settings
-from django.core.files.base import ContentFile
 from django.db import transaction
-from docx import Document
-from docx.shared import Inches, Cm
 
-from .models import ContractSignature, ContractMS, ContractFileUser, ContractStatusMS, ContractDopMS, \
-    ContractDopFileUser
+from .models import ContractSignature, ContractMS, ContractDopMS, ContractRenderJob
+from .services_documents import ContractDocumentStore
+from .services_locator import ContractLocator
+from .services_pipeline import ContractRenderPipeline
+from .services_reference import ReferenceDataCache
+from .services_render_jobs import ContractRenderJobService
+from .services_render_lock import ContractRenderLock
+from .services_templates import ContractTemplateRegistry, TEMPLATES_DIR
 from django.contrib.auth.models import User
 
 logger = logging.getLogger(__name__)
@@ -29,6 +30,8 @@ logger = logging.getLogger(__name__)
 class ContractSignatureService:
     """Обновленный сервис для работы с подписями контрактов"""
 
+    DEFAULT_CONTRACT_TEMPLATE = 'Договор оказания образовательных услуг_Школа 2025-2026_за_год.docx'
+
     def __init__(self):
         # URL FastAPI сервиса для верификации подписей
         self.fastapi_verify_url = getattr(
@@ -45,42 +48,26 @@ class ContractSignatureService:
             cms_signature: str,
             signed_data: str,
             user: User,
-            is_dop_contract: bool = False
+            is_dop_contract: bool = False,
+            background: bool = False
     ) -> Dict[str, Any]:
         """
-        Верифицирует подпись через FastAPI и сохраняет в базу с обновлением PDF
+        Верифицирует подпись через FastAPI и сохраняет в базу с обновлением PDF.
+        При background=True после верификации ставится задача render_contract_job,
+        генерация PDF и сохранение подписи выполняются в воркере (complete_signature)
         """
         try:
             # Находим контракт по номеру
-            try:
-                if is_dop_contract:
-                    # Для дополнительных договоров
-                    contract_dop = ContractDopMS.objects.using('ms_sql').filter(
-                        agreement_id__ContractNum=contract_num
-                    ).first()
-                    if not contract_dop:
-                        return {
-                            'success': False,
-                            'error': 'Дополнительный договор не найден',
-                            'error_code': 'CONTRACT_NOT_FOUND'
-                        }
-                    contract = contract_dop.agreement_id
-                else:
-                    contract = ContractMS.objects.using('ms_sql').get(ContractNum=contract_num)
-            except ContractMS.DoesNotExist:
+            contract, contract_dop = self._find_contract(contract_num, is_dop_contract)
+            if contract is None:
                 return {
                     'success': False,
-                    'error': 'Контракт не найден',
+                    'error': 'Дополнительный договор не найден' if is_dop_contract else 'Контракт не найден',
                     'error_code': 'CONTRACT_NOT_FOUND'
                 }
 
             # Проверяем, нет ли уже валидной подписи для этого контракта
-            existing_signature = ContractSignature.objects.filter(
-                contract_num=contract_num,
-                is_valid=True
-            ).first()
-
-            if existing_signature and not existing_signature.is_document_modified:
+            if self._is_already_signed(contract_num):
                 return {
                     'success': False,
                     'error': 'Контракт уже подписан',
@@ -107,65 +94,31 @@ class ContractSignatureService:
             logger.info(
                 f"Signature verification successful for contract {contract_num}, IIN: {verification_result['iin']}")
 
-            # АТОМАРНАЯ ТРАНЗАКЦИЯ: Создаем файл и подпись как единое целое
-            with transaction.atomic():
-                try:
-                    # 1. Генерируем полный подписанный контракт СНАЧАЛА
-                    self._generate_complete_signed_contract_for_signature(
-                        contract=contract,
-                        user=user,
-                        is_dop_contract=is_dop_contract,
-                        signer_iin=verification_result['iin']
-                    )
-
-                    logger.info(f"Contract PDF generated successfully for {contract_num}")
-
-                    # 2. ПОСЛЕ создания файла вычисляем хэш НОВОГО документа
-                    document_hash = self._calculate_contract_hash(contract, is_dop_contract)
-
-                    logger.info(f"New document hash calculated: {document_hash[:16]}...")
-
-                    # 3. ТОЛЬКО ТЕПЕРЬ сохраняем подпись с правильным хэшем
-                    signature = ContractSignature.objects.create(
-                        contract_num=contract_num,
-                        cms_signature=cms_signature,
-                        signed_data=signed_data,
-                        document_hash=document_hash,
-                        signer_iin=verification_result['iin'],
-                        certificate_info=verification_result.get('certificate_info', {}),
-                        is_valid=True,
-                        created_by=user
-                    )
-
-                    logger.info(f"ContractSignature created with hash: {document_hash[:16]}...")
-
-                    # 4. Обновляем статус контракта
-                    if is_dop_contract:
-                        contract_dop.status_id = ContractStatusMS.objects.using('ms_sql').get(sStatusName='Подписан')
-                        contract_dop.save(using='ms_sql')
-                    else:
-                        contract.ContractStatusID = ContractStatusMS.objects.using('ms_sql').get(sStatusName='Подписан')
-                        contract.save(using='ms_sql')
-
-                    # 5. Добавляем подпись директора (автоматически) с тем же хэшем
-                    self._add_director_signature(contract_num, signature, document_hash, signed_data=signed_data)
-
-                    logger.info(f"Transaction completed successfully for contract {contract_num}")
-
-                except Exception as e:
-                    logger.error(f"Error in transaction for contract {contract_num}: {e}")
-                    # Транзакция автоматически откатится
-                    raise
-
-            logger.info(f"Signature saved successfully for contract {contract_num}, IIN: {verification_result['iin']}")
+            if background:
+                job = ContractRenderJobService.enqueue(
+                    contract_num,
+                    ContractRenderJob.SIGNATURE,
+                    is_dop_contract,
+                    user,
+                    params={
+                        'cms_signature': cms_signature,
+                        'signed_data': signed_data,
+                        'verification_result': {
+                            'iin': verification_result['iin'],
+                            'certificate_info': verification_result.get('certificate_info', {}),
+                        },
+                    }
+                )
+                return {
+                    'success': True,
+                    'job_id': str(job.id),
+                    'status': job.status,
+                    'contract_num': contract.ContractNum,
+                    'message': 'Подпись верифицирована, договор формируется'
+                }
 
-            return {
-                'success': True,
-                'signature_uid': str(signature.signature_uid),
-                'signer_iin': verification_result['iin'],
-                'contract_num': contract.ContractNum,
-                'message': 'Подпись успешно верифицирована и сохранена'
-            }
+            return self._save_signature(contract, contract_dop, contract_num, cms_signature, signed_data, user,
+                                        is_dop_contract, verification_result)
 
         except Exception as e:
             logger.error(f"Error in verify_and_save_signature: {e}")
@@ -175,6 +128,107 @@ class ContractSignatureService:
                 'error_code': 'PROCESSING_ERROR'
             }
 
+    def complete_signature(self, contract_num, cms_signature, signed_data, user, is_dop_contract,
+                           verification_result) -> Dict[str, Any]:
+        """Генерация подписанного PDF и сохранение уже верифицированной подписи (задача render_contract_job)"""
+        contract, contract_dop = self._find_contract(contract_num, is_dop_contract)
+        if contract is None:
+            raise ValueError('Контракт не найден')
+
+        if self._is_already_signed(contract_num):
+            raise ValueError('Контракт уже подписан')
+
+        return self._save_signature(contract, contract_dop, contract_num, cms_signature, signed_data, user,
+                                    is_dop_contract, verification_result)
+
+    @staticmethod
+    def _find_contract(contract_num, is_dop_contract):
+        """Договор и доп. соглашение (для основного договора - None) по номеру"""
+        if is_dop_contract:
+            contract_dop = ContractDopMS.objects.using('ms_sql').filter(
+                agreement_id__ContractNum=contract_num
+            ).first()
+            return (contract_dop.agreement_id, contract_dop) if contract_dop else (None, None)
+
+        return ContractMS.objects.using('ms_sql').filter(ContractNum=contract_num).first(), None
+
+    @staticmethod
+    def _is_already_signed(contract_num) -> bool:
+        existing_signature = ContractSignature.objects.filter(
+            contract_num=contract_num,
+            is_valid=True
+        ).first()
+
+        return bool(existing_signature and not existing_signature.is_document_modified)
+
+    def _save_signature(self, contract, contract_dop, contract_num, cms_signature, signed_data, user, is_dop_contract,
+                        verification_result) -> Dict[str, Any]:
+        """Генерация подписанного PDF, подпись с хэшем нового документа, статус договора и подписи директоров"""
+
+        # АТОМАРНАЯ ТРАНЗАКЦИЯ: Создаем файл и подпись как единое целое.
+        # Файл PDF пишется в хранилище до транзакции - при откате он удаляется (delete_on_rollback)
+        with transaction.atomic(), ContractDocumentStore.delete_on_rollback():
+            try:
+                # 1. Генерируем полный подписанный контракт СНАЧАЛА
+                self._generate_complete_signed_contract_for_signature(
+                    contract=contract,
+                    user=user,
+                    is_dop_contract=is_dop_contract,
+                    signer_iin=verification_result['iin']
+                )
+
+                logger.info(f"Contract PDF generated successfully for {contract_num}")
+
+                # 2. Обновляем статус контракта до хэша: статус входит в хэш,
+                # и is_document_modified пересчитывает его по уже подписанному договору
+                if is_dop_contract:
+                    contract_dop.status_id = ReferenceDataCache.get_by_name(ReferenceDataCache.STATUS, 'Подписан')
+                    contract_dop.save(using='ms_sql')
+                else:
+                    contract.ContractStatusID = ReferenceDataCache.get_by_name(ReferenceDataCache.STATUS, 'Подписан')
+                    contract.save(using='ms_sql')
+                ContractLocator.invalidate(contract_num)
+
+                # 3. ПОСЛЕ создания файла вычисляем хэш НОВОГО документа
+                document_hash = self._calculate_contract_hash(contract, is_dop_contract)
+
+                logger.info(f"New document hash calculated: {document_hash[:16]}...")
+
+                # 4. ТОЛЬКО ТЕПЕРЬ сохраняем подпись с правильным хэшем
+                signature = ContractSignature.objects.create(
+                    contract_num=contract_num,
+                    is_dop_contract=is_dop_contract,
+                    cms_signature=cms_signature,
+                    signed_data=signed_data,
+                    document_hash=document_hash,
+                    signer_iin=verification_result['iin'],
+                    certificate_info=verification_result.get('certificate_info', {}),
+                    is_valid=True,
+                    created_by=user
+                )
+
+                logger.info(f"ContractSignature created with hash: {document_hash[:16]}...")
+
+                # 5. Добавляем подпись директора (автоматически) с тем же хэшем
+                self._add_director_signature(contract_num, signature, document_hash, signed_data=signed_data)
+
+                logger.info(f"Transaction completed successfully for contract {contract_num}")
+
+            except Exception as e:
+                logger.error(f"Error in transaction for contract {contract_num}: {e}")
+                # Транзакция автоматически откатится
+                raise
+
+        logger.info(f"Signature saved successfully for contract {contract_num}, IIN: {verification_result['iin']}")
+
+        return {
+            'success': True,
+            'signature_uid': str(signature.signature_uid),
+            'signer_iin': verification_result['iin'],
+            'contract_num': contract.ContractNum,
+            'message': 'Подпись успешно верифицирована и сохранена'
+        }
+
     def _generate_complete_signed_contract_for_signature(self, contract, user, is_dop_contract=False, signer_iin=None):
         """Генерирует полный подписанный контракт специально для процесса подписания"""
         try:
@@ -342,116 +396,16 @@ class ContractSignatureService:
                 logger.error("Contract template not found")
                 return
 
-            # Проверяем существование файла шаблона
-            import os
-            if not os.path.exists(docx_template_path):
-                logger.error(f"Template file not found: {docx_template_path}")
-                return
-
-            # Открываем шаблон
-            doc = Document(docx_template_path)
-
-            # Заполняем ВСЕ переменные контракта И добавляем QR-коды
-            self._replace_qr_placeholders(doc, qr_signature, qr_director_omarov, qr_director_serikov, contract)
-
-            # Обрабатываем специальные таблицы оплаты если есть
-            self._process_payment_tables(doc, contract)
-
-            # Сохраняем готовый документ
-            docx_output_path = f'contracts/signed/docx/contract_{contract.ContractNum}_signed.docx'
-            pdf_directory = "contracts/signed/pdf"
-            pdf_output_path = f'{pdf_directory}/contract_{contract.ContractNum}_signed.pdf'
-
-            # Создаем директории если не существуют
-            os.makedirs(os.path.dirname(docx_output_path), exist_ok=True)
-            os.makedirs(pdf_directory, exist_ok=True)
-
-            # Сохраняем DOCX
-            doc.save(docx_output_path)
-            logger.info(f"DOCX saved: {docx_output_path}")
-
-            # Конвертируем в PDF
-            self._docx_to_pdf(docx_output_path, pdf_directory)
-            logger.info(f"PDF converted: {pdf_output_path}")
-
-            # Проверяем что PDF создался
-            if not os.path.exists(pdf_output_path):
-                logger.error(f"PDF file was not created: {pdf_output_path}")
+            # Заполняем ВСЕ переменные контракта, QR-коды и таблицы оплаты и сохраняем в базе данных
+            if self._save_signed_contract_pdf(docx_template_path, contract, qr_signature, qr_director_omarov,
+                                              qr_director_serikov, user, is_dop_contract) is None:
                 return
-
-            # Сохраняем в базе данных (создаем новую запись или обновляем существующую)
-            with open(pdf_output_path, 'rb') as pdf_file:
-                file_content = pdf_file.read()
-
-                if is_dop_contract:
-                    # Для дополнительных договоров
-                    contract_file = ContractDopFileUser.objects.filter(contractNum=contract.ContractNum).first()
-                    if contract_file:
-                        # Обновляем существующую запись
-                        contract_file.file.delete(save=False)  # Удаляем старый файл
-                        contract_file.file = ContentFile(file_content, name=f'{contract.ContractNum}_signed.pdf')
-                        contract_file.date = datetime.now()
-                        contract_file.save()
-                        logger.info(f"Updated existing dop contract file: {contract.ContractNum}")
-                    else:
-                        # Создаем новую запись
-                        ContractDopFileUser.objects.create(
-                            user=user,
-                            contractNum=contract.ContractNum,
-                            file=ContentFile(file_content, name=f'{contract.ContractNum}_signed.pdf')
-                        )
-                        logger.info(f"Created new dop contract file: {contract.ContractNum}")
-                else:
-                    # Для основных договоров
-                    contract_file = ContractFileUser.objects.filter(contractNum=contract.ContractNum).first()
-                    if contract_file:
-                        # Обновляем существующую запись
-                        contract_file.file.delete(save=False)  # Удаляем старый файл
-                        contract_file.file = ContentFile(file_content, name=f'{contract.ContractNum}_signed.pdf')
-                        contract_file.date = datetime.now()
-                        contract_file.save()
-                        logger.info(f"Updated existing contract file: {contract.ContractNum}")
-                    else:
-                        # Создаем новую запись
-                        ContractFileUser.objects.create(
-                            user=user,
-                            contractNum=contract.ContractNum,
-                            file=ContentFile(file_content, name=f'{contract.ContractNum}_signed.pdf')
-                        )
-                        logger.info(f"Created new contract file: {contract.ContractNum}")
-
-            # Удаляем временные файлы
-            try:
-                os.remove(docx_output_path)
-                os.remove(pdf_output_path)
-                logger.info("Temporary files cleaned up")
-            except Exception as e:
-                logger.warning(f"Could not remove temporary files: {e}")
+            logger.info(f"Signed contract file saved: {contract.ContractNum}")
 
         except Exception as e:
             logger.error(f"Error generating complete signed contract: {e}")
             raise
 
-    def _process_payment_tables(self, doc, contract):
-        """Обрабатывает специальные таблицы оплаты в документе"""
-        try:
-            # Ищем и обрабатываем таблицы в документе
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        for paragraph in cell.paragraphs:
-                            for run in paragraph.runs:
-                                if '{customtable_monthpay}' in run.text:
-                                    self._process_month_pay_table(cell, contract)
-                                    run.text = run.text.replace('{customtable_monthpay}', '')
-
-                                if '{customtable_quarterpay}' in run.text:
-                                    self._process_quarter_pay_table(cell, contract)
-                                    run.text = run.text.replace('{customtable_quarterpay}', '')
-
-        except Exception as e:
-            logger.error(f"Error processing payment tables: {e}")
-
     def _generate_signature_qr_data(self, signature):
         """Генерирует данные для QR-кода подписи"""
         # URL для проверки подписи на фронтенде
@@ -539,482 +493,42 @@ class ContractSignatureService:
                 logger.error("Contract template not found")
                 return
 
-            doc = Document(docx_template)
-
-            # Заменяем плейсхолдеры QR-кодов на реальные изображения
-            self._replace_qr_placeholders(doc, qr_signature, qr_director_omarov, qr_director_serikov)
-
-            # Сохраняем обновленный документ
-            docx_output_path = f'contracts/signed/docx/contract_{contract.ContractNum}.docx'
-            pdf_directory = "contracts/signed/pdf"
-            pdf_output_path = f'{pdf_directory}/contract_{contract.ContractNum}.pdf'
-
-            # Создаем директории если не существуют
-            os.makedirs(os.path.dirname(docx_output_path), exist_ok=True)
-            os.makedirs(pdf_directory, exist_ok=True)
-
-            doc.save(docx_output_path)
-
-            # Конвертируем в PDF
-            self._docx_to_pdf(docx_output_path, pdf_directory)
-
-            # Обновляем файл в базе данных
-            with open(pdf_output_path, 'rb') as pdf_file:
-                file_content = pdf_file.read()
-
-                if is_dop_contract:
-                    contract_file = ContractDopFileUser.objects.filter(contractNum=contract.ContractNum).last()
-                    if contract_file:
-                        contract_file.file = ContentFile(file_content, name=f'{contract.ContractNum}_signed.pdf')
-                        contract_file.date = datetime.now()
-                        contract_file.save()
-                    else:
-                        ContractDopFileUser.objects.create(
-                            user=user,
-                            contractNum=contract.ContractNum,
-                            file=ContentFile(file_content, name=f'{contract.ContractNum}_signed.pdf')
-                        )
-                else:
-                    contract_file = ContractFileUser.objects.filter(contractNum=contract.ContractNum).last()
-                    if contract_file:
-                        contract_file.file = ContentFile(file_content, name=f'{contract.ContractNum}_signed.pdf')
-                        contract_file.date = datetime.now()
-                        contract_file.save()
-                    else:
-                        ContractFileUser.objects.create(
-                            user=user,
-                            contractNum=contract.ContractNum,
-                            file=ContentFile(file_content, name=f'{contract.ContractNum}_signed.pdf')
-                        )
-
-            # Удаляем временные файлы
-            os.remove(docx_output_path)
-            os.remove(pdf_output_path)
+            # Заменяем плейсхолдеры QR-кодов на реальные изображения и обновляем файл в базе данных
+            self._save_signed_contract_pdf(docx_template, contract, qr_signature, qr_director_omarov,
+                                           qr_director_serikov, user, is_dop_contract)
 
         except Exception as e:
             logger.error(f"Error adding QR codes to contract: {e}")
 
-    def _replace_qr_placeholders(self, doc, qr_signature, qr_director_omarov, qr_director_serikov, contract):
-        """Заменяет все плейсхолдеры в документе: переменные контракта и QR-коды"""
-        from .models import ContractMS, ContractDopMS, DiscountMS, ContractDiscountMS
-        from .services import ChangeDocumentContentService
-        from datetime import timedelta
-        import math
-        from num2words import num2words
-        from io import BytesIO
-
-        # Получаем данные контракта
-        try:
-            if not contract:
-                logger.error("Contract not provided for template replacement")
-                return
-
-            student = contract.StudentID
-            parent = student.parent_id if student else None
-
-            if not student or not parent:
-                logger.error("Student or parent not found for contract")
-                return
-
-        except Exception as e:
-            logger.error(f"Error getting contract data: {e}")
-            return
-
-        # Подготавливаем данные для замены
-        try:
-            # Данные паспорта родителя
-            ParentPassport = f'Удостоверение личности: №{parent.num_of_doc}, Орган выдачи: {parent.issued_by}, Дата выдачи: {parent.issue_date}'
-            ParentPassportKAZ = f'Жеке куәлік: №{parent.num_of_doc}, Берген орган: {parent.issued_by}, Берілген күні: {parent.issue_date}'
-            ParentPassportENG = f'ID: No.{parent.num_of_doc}, Issued by: {parent.issued_by}, Issue date: {parent.issue_date}'
-
-            if '?' in str(parent.issued_by):
-                ParentPassport = f'Удостоверение личности: №{parent.num_of_doc}, Орган выдачи: Не указано, Дата выдачи: {parent.issue_date}'
-                ParentPassportKAZ = f'Жеке куәлік: №{parent.num_of_doc}, Берген орган: Көрсетілмеген, Берілген күні: {parent.issue_date}'
-                ParentPassportENG = f'ID: No.{parent.num_of_doc}, Issued by: Not specified, Issue date: {parent.issue_date}'
-
-            # Расчет суммы со скидкой
-            discount = DiscountMS.objects.using('ms_sql').all()
-            contract_discount = ContractDiscountMS.objects.using('ms_sql').filter(ContractID=contract)
-            contract_amount = float(contract.ContractAmount) if contract.ContractAmount else 0
-
-            if contract_discount.exists():
-                for i in contract_discount:
-                    for j in discount.filter(id=i.DiscountID.id):
-                        percent = int(j.iDiscountPercent)
-                        contract_amount -= contract_amount * percent / 100
-                contract_amount_with_discount = float(round(contract_amount, 2))
-            else:
-                contract_amount_with_discount = float(round(contract_amount, 2))
-
-            # Дополнительная сумма договора
-            try:
-                contract_dop_amount = ContractMS.objects.using('ms_sql').filter(
-                    ContractNum=contract.ContractNum).first()
-                if contract_dop_amount:
-                    contract_dop_amount = contract_dop_amount.ContractAmount
-                else:
-                    contract_dop_amount = 0
-            except:
-                contract_dop_amount = 0
-
-        except Exception as e:
-            logger.error(f"Error calculating contract amounts: {e}")
-            contract_amount_with_discount = float(contract.ContractAmount) if contract.ContractAmount else 0
-            contract_dop_amount = 0
-            ParentPassport = "Данные паспорта недоступны"
-            ParentPassportKAZ = "Паспорт деректері қолжетімсіз"
-            ParentPassportENG = "Passport data unavailable"
-
-        # Заменяем переменные в обычных параграфах (как в change_docx_document)
-        for paragraph in doc.paragraphs:
-            for run in paragraph.runs:
-                self._replace_text_variables(run, contract, student, parent, ParentPassport,
-                                             ParentPassportKAZ, ParentPassportENG, contract_amount_with_discount,
-                                             contract_dop_amount)
-                self._replace_qr_codes(run, qr_signature, qr_director_omarov, qr_director_serikov, contract)
-
-        # Заменяем переменные в таблицах (как в change_docx_document)
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for paragraph in cell.paragraphs:
-                        for run in paragraph.runs:
-                            self._replace_text_variables(run, contract, student, parent, ParentPassport,
-                                                         ParentPassportKAZ, ParentPassportENG,
-                                                         contract_amount_with_discount,
-                                                         contract_dop_amount)
-                            self._replace_qr_codes(run, qr_signature, qr_director_omarov, qr_director_serikov, contract)
-
-                            # Обработка специальных таблиц
-                            if '{customtable_monthpay}' in run.text:
-                                self._process_month_pay_table(cell, contract)
-                                run.text = run.text.replace('{customtable_monthpay}', '')
-
-                            if '{customtable_quarterpay}' in run.text:
-                                self._process_quarter_pay_table(cell, contract)
-                                run.text = run.text.replace('{customtable_quarterpay}', '')
-
-    def _replace_text_variables(self, run, contract, student, parent, ParentPassport, ParentPassportKAZ,
-                                ParentPassportENG, contract_amount_with_discount, contract_dop_amount):
-        """Заменяет все текстовые переменные в run (точно как в change_docx_document)"""
-        from .services import ChangeDocumentContentService
-        from datetime import timedelta
-        from num2words import num2words
-
-        try:
-            # Основные данные контракта
-            if '{ContractNum}' in run.text:
-                run.text = run.text.replace('{ContractNum}', str(contract.ContractNum) if contract.ContractNum else '')
-            if '{ContractYear}' in run.text:
-                run.text = run.text.replace('{ContractYear}',
-                                            str(contract.ContractDate.strftime("%Y")) if contract.ContractDate else '')
-            if '{ContractYearFinish}' in run.text and contract.ContractDate:
-                data_close = contract.ContractDate + timedelta(days=365)
-                run.text = run.text.replace('{ContractYearFinish}', str(data_close.strftime("%Y")))
-            if '{ContractDate}' in run.text:
-                run.text = run.text.replace('{ContractDate}', str(contract.ContractDate.strftime(
-                    "%d.%m.%Y")) if contract.ContractDate else '')
-            if '{ContractDay}' in run.text:
-                run.text = run.text.replace('{ContractDay}',
-                                            str(contract.ContractDate.strftime("%d")) if contract.ContractDate else '')
-
-            # Месяцы на разных языках
-            if contract.ContractDate:
-                if '{ContractMonthRUS}' in run.text:
-                    try:
-                        month_ru = ChangeDocumentContentService.translate_text(contract.ContractDate.strftime("%B"),
-                                                                               "ru")
-                        run.text = run.text.replace('{ContractMonthRUS}', month_ru)
-                    except:
-                        run.text = run.text.replace('{ContractMonthRUS}', contract.ContractDate.strftime("%B"))
-                if '{ContractMonthKAZ}' in run.text:
-                    try:
-                        month_kz = ChangeDocumentContentService.translate_text(contract.ContractDate.strftime("%B"),
-                                                                               "kk")
-                        run.text = run.text.replace('{ContractMonthKAZ}', month_kz)
-                    except:
-                        run.text = run.text.replace('{ContractMonthKAZ}', contract.ContractDate.strftime("%B"))
-                if '{ContractMonthENG}' in run.text:
-                    try:
-                        month_en = ChangeDocumentContentService.translate_text(contract.ContractDate.strftime("%B"),
-                                                                               "en")
-                        run.text = run.text.replace('{ContractMonthENG}', month_en)
-                    except:
-                        run.text = run.text.replace('{ContractMonthENG}', contract.ContractDate.strftime("%B"))
-
-            # Учебный год
-            if '{EduYear}' in run.text and contract.EduYearID:
-                run.text = run.text.replace('{EduYear}', str(contract.EduYearID.sEduYear))
-
-            # Данные студента и родителя
-            if '{ParentFullName}' in run.text:
-                run.text = run.text.replace('{ParentFullName}', str(parent.full_name) if parent.full_name else '')
-            if '{StudentFullName}' in run.text:
-                run.text = run.text.replace('{StudentFullName}', str(student.full_name) if student.full_name else '')
-            if '{StudentIIN}' in run.text:
-                run.text = run.text.replace('{StudentIIN}', str(student.iin) if student.iin else '')
-            if '{StudentAddress}' in run.text:
-                run.text = run.text.replace('{StudentAddress}', str(parent.address) if parent.address else '')
-            if '{StudentPhoneNumber}' in run.text:
-                phone_text = str(student.phone) if student.phone else '-'
-                run.text = run.text.replace('{StudentPhoneNumber}', phone_text)
-            if '{ParentAddress}' in run.text:
-                run.text = run.text.replace('{ParentAddress}', str(parent.address) if parent.address else '')
-            if '{ParentPhoneNumber}' in run.text:
-                run.text = run.text.replace('{ParentPhoneNumber}', str(parent.phone) if parent.phone else '')
-            if '{ParentIIN}' in run.text:
-                run.text = run.text.replace('{ParentIIN}', str(parent.iin) if parent.iin else '')
-
-            # Данные паспорта
-            if '{ParentPassport}' in run.text:
-                run.text = run.text.replace('{ParentPassport}', ParentPassport)
-            if '{ParentPassportKAZ}' in run.text:
-                run.text = run.text.replace('{ParentPassportKAZ}', ParentPassportKAZ)
-            if '{ParentPassportENG}' in run.text:
-                run.text = run.text.replace('{ParentPassportENG}', ParentPassportENG)
-
-            # Суммы контракта
-            if '{ContractAmount}' in run.text:
-                run.text = run.text.replace('{ContractAmount}',
-                                            str(int(contract.ContractAmount)) if contract.ContractAmount else '0')
-            if '{ContractSum}' in run.text:
-                run.text = run.text.replace('{ContractSum}',
-                                            str(int(contract.ContractSum)) if contract.ContractSum else '0')
-            if '{ContractAmountWithDiscount}' in run.text:
-                run.text = run.text.replace('{ContractAmountWithDiscount}', str(int(contract_amount_with_discount)))
-
-            # Дополнительные суммы
-            if '{ContractDopAmount}' in run.text:
-                run.text = run.text.replace('{ContractDopAmount}', str(int(contract_dop_amount)))
-
-            # Взнос
-            if '{ContractContr}' in run.text:
-                contr_sum = int(contract.ContSum) if contract.ContSum else 0
-                run.text = run.text.replace('{ContractContr}', str(contr_sum))
-
-            # Суммы прописью
-            try:
-                if '{ContractAmountWords}' in run.text:
-                    run.text = run.text.replace('{ContractAmountWords}',
-                                                num2words(int(contract.ContractAmount),
-                                                          lang="ru") if contract.ContractAmount else '')
-                if '{ContractAmountWordsKaz}' in run.text:
-                    run.text = run.text.replace('{ContractAmountWordsKaz}',
-                                                num2words(int(contract.ContractAmount),
-                                                          lang="kz") if contract.ContractAmount else '')
-                if '{ContractAmountWordsEng}' in run.text:
-                    run.text = run.text.replace('{ContractAmountWordsEng}',
-                                                num2words(int(contract.ContractAmount),
-                                                          lang="en") if contract.ContractAmount else '')
-                if '{ContractSumWords}' in run.text:
-                    run.text = run.text.replace('{ContractSumWords}',
-                                                num2words(int(contract.ContractSum),
-                                                          lang="ru") if contract.ContractSum else '')
-                if '{ContractSumWordsKaz}' in run.text:
-                    run.text = run.text.replace('{ContractSumWordsKaz}',
-                                                num2words(int(contract.ContractSum),
-                                                          lang="kz") if contract.ContractSum else '')
-                if '{ContractSumWordsEng}' in run.text:
-                    run.text = run.text.replace('{ContractSumWordsEng}',
-                                                num2words(int(contract.ContractSum),
-                                                          lang="en") if contract.ContractSum else '')
-                if '{ContractAmountWithDiscountWords}' in run.text:
-                    run.text = run.text.replace('{ContractAmountWithDiscountWords}',
-                                                num2words(int(contract_amount_with_discount), lang="ru"))
-                if '{ContractAmountWithDiscountWordsKaz}' in run.text:
-                    run.text = run.text.replace('{ContractAmountWithDiscountWordsKaz}',
-                                                num2words(int(contract_amount_with_discount), lang="kz"))
-                if '{ContractAmountWithDiscountWordsEng}' in run.text:
-                    run.text = run.text.replace('{ContractAmountWithDiscountWordsEng}',
-                                                num2words(int(contract_amount_with_discount), lang="en"))
-                if '{ContractDopAmountWords}' in run.text:
-                    run.text = run.text.replace('{ContractDopAmountWords}',
-                                                num2words(int(contract_dop_amount), lang="ru"))
-                if '{ContractDopAmountWordsKaz}' in run.text:
-                    run.text = run.text.replace('{ContractDopAmountWordsKaz}',
-                                                num2words(int(contract_dop_amount), lang="kz"))
-                if '{ContractContrWords}' in run.text:
-                    contr_sum = int(contract.ContSum) if contract.ContSum else 0
-                    if contr_sum > 0:
-                        run.text = run.text.replace('{ContractContrWords}', num2words(contr_sum, lang="ru"))
-                    else:
-                        run.text = run.text.replace('{ContractContrWords}', 'ноль')
-                if '{ContractContrWordsKaz}' in run.text:
-                    contr_sum = int(contract.ContSum) if contract.ContSum else 0
-                    if contr_sum > 0:
-                        run.text = run.text.replace('{ContractContrWordsKaz}', num2words(contr_sum, lang="kz"))
-                    else:
-                        run.text = run.text.replace('{ContractContrWordsKaz}', 'нөл')
-                if '{ContractContrWordsEng}' in run.text:
-                    contr_sum = int(contract.ContSum) if contract.ContSum else 0
-                    if contr_sum > 0:
-                        run.text = run.text.replace('{ContractContrWordsEng}', num2words(contr_sum, lang="en"))
-                    else:
-                        run.text = run.text.replace('{ContractContrWordsEng}', 'zero')
-            except:
-                pass  # Игнорируем ошибки при преобразовании в слова
-
-            # Тексты для QR-кодов и правовые тексты
-            if '{QRCodeTextRus}' in run.text:
-                run.text = run.text.replace('{QRCodeTextRus}',
-                                            'QR-код содержит данные об электронно-цифровой подписи подписанта')
-            if '{QRCodeTextKaz}' in run.text:
-                run.text = run.text.replace('{QRCodeTextKaz}',
-                                            'QR-кодта қол қоюшының электрондық-цифрлық қолтаңбасы туралы деректер қамтылады')
-            if '{police_kaz}' in run.text:
-                run.text = run.text.replace('{police_kaz}',
-                                            'Осы құжат «Электрондық құжат және электрондық цифрлық қолтаңба туралы» Қазақстан Республикасының 2003 жылғы 7 қаңтардағы N 370-II Заңы 7 бабының 1 тармағына сәйкес қағаз тасығыштағы құжатпен бірдей.')
-            if '{police_rus}' in run.text:
-                run.text = run.text.replace('{police_rus}',
-                                            'Данный документ согласно пункту 1 статьи 7 ЗРК от 7 января 2003 года «Об электронном документе и электронной цифровой подписи» равнозначен документу на бумажном носителе.')
-
-        except Exception as e:
-            logger.error(f"Error replacing text variables: {e}")
-
-    def _replace_qr_codes(self, run, qr_signature, qr_director_omarov, qr_director_serikov, contract):
-        """Заменяет QR-коды в run"""
-        from io import BytesIO
-        from docx.shared import Inches
-
-        try:
-            # Основные QR-коды подписи
-            if '{QRCode}' in run.text or '{QRCodeSignature}' in run.text:
-                run.text = run.text.replace('{QRCode}', '').replace('{QRCodeSignature}', '')
-                if qr_signature:
-                    image_stream = BytesIO(qr_signature)
-                    run.add_picture(image_stream, width=Inches(1.5), height=Inches(1.5))
-
-            # QR-код директора Омарова
-            if '{QRCodeDirectorOmarov}' in run.text or '{QRcodeDirector}' in run.text:
-                run.text = run.text.replace('{QRCodeDirectorOmarov}', '').replace('{QRcodeDirector}', '')
-                if qr_director_omarov:
-                    image_stream = BytesIO(qr_director_omarov)
-                    run.add_picture(image_stream, width=Inches(1.5), height=Inches(1.5))
-
-            # QR-код директора Серикова
-            if '{QRCodeDirectorSerikov}' in run.text or '{QRCodeDirector2}' in run.text:
-                run.text = run.text.replace('{QRCodeDirectorSerikov}', '').replace('{QRCodeDirector2}', '')
-                if qr_director_serikov:
-                    image_stream = BytesIO(qr_director_serikov)
-                    run.add_picture(image_stream, width=Inches(1.5), height=Inches(1.5))
-
-            # Специальные QR-коды
-            if 'QRCodeDataSigned' in run.text:
-                # Генерируем QR-код с подписанными данными
-                qr_code_data_signed = self._generate_signed_data_qr_code(contract.ContractNum)
-                if qr_code_data_signed:
-                    qr_code_image = BytesIO(qr_code_data_signed)
-                    run.add_picture(qr_code_image, width=Inches(1.3), height=Inches(1.3))
-                    run.text = run.text.replace('QRCodeDataSigned', '')
-
-        except Exception as e:
-            logger.error(f"Error replacing QR codes: {e}")
-
-    def _process_month_pay_table(self, cell, contract):
-        """Обрабатывает таблицу помесячной оплаты"""
-        try:
-            from .models import ContractMonthPayMS, ContractDiscountMS, DiscountMS
-            from docx.shared import Cm
-            import math
-
-            # Расчет суммы со скидкой
-            discount = DiscountMS.objects.using('ms_sql').all()
-            contract_discount = ContractDiscountMS.objects.using('ms_sql').filter(ContractID=contract)
-            contract_amount = float(contract.ContractAmount)
-
-            if contract_discount.exists():
-                for i in contract_discount:
-                    for j in discount.filter(id=i.DiscountID.id):
-                        percent = int(j.iDiscountPercent)
-                        contract_amount -= contract_amount * percent / 100
-                contract_amount_with_discount = float(round(contract_amount, 2))
-            else:
-                contract_amount_with_discount = float(round(contract_amount, 2))
-
-            # Создаем таблицу
-            main_table = cell.add_table(rows=1, cols=3)
-            main_table.columns[0].width = Cm(1.0)
-            main_table.columns[1].width = Cm(3.0)
-            main_table.columns[2].width = Cm(3.0)
-
-            # Заголовки
-            header_row = main_table.rows[0]
-            header_row.cells[0].text = '№'
-            header_row.cells[1].text = 'Сумма'
-            header_row.cells[2].text = 'Дата оплаты'
-
-            # Получаем данные о платежах
-            contract_month_pays = ContractMonthPayMS.objects.using('ms_sql').filter(ContractID=contract.id)
-            count_month = 9
-            sum_for_month = math.ceil(contract_amount_with_discount / count_month)
-
-            # Добавляем строки
-            for j, pay in enumerate(contract_month_pays):
-                row_cells = main_table.add_row().cells
-                row_cells[0].text = str(j + 1)
-                row_cells[1].text = f"{sum_for_month:,}".replace(',', ' ')
-                row_cells[2].text = str(pay.PayDateM) if pay.PayDateM else ''
-
-        except Exception as e:
-            logger.error(f"Error processing month pay table: {e}")
+    def _save_signed_contract_pdf(self, template_path, contract, qr_signature, qr_director_omarov,
+                                  qr_director_serikov, user, is_dop_contract):
+        """Рендерит подписанный PDF и добавляет его версией документа договора; параллельные вызовы по договору ждут один рендер"""
+        pipeline = ContractRenderPipeline(
+            contract, is_dop_contract, ContractTemplateRegistry.SIGNED, template_path, whole_amount=False
+        )
 
-    def _process_quarter_pay_table(self, cell, contract):
-        """Обрабатывает таблицу квартальной оплаты"""
-        try:
-            from .models import ContractMonthPayMS, ContractDiscountMS, DiscountMS
-            from docx.shared import Cm
-            from django.db.models import Sum, Min
-            import math
-
-            # Расчет суммы со скидкой
-            discount = DiscountMS.objects.using('ms_sql').all()
-            contract_discount = ContractDiscountMS.objects.using('ms_sql').filter(ContractID=contract)
-            contract_amount = float(contract.ContractAmount)
-
-            if contract_discount.exists():
-                for i in contract_discount:
-                    for j in discount.filter(id=i.DiscountID.id):
-                        percent = int(j.iDiscountPercent)
-                        contract_amount -= contract_amount * percent / 100
-                contract_amount_with_discount = float(round(contract_amount, 2))
-            else:
-                contract_amount_with_discount = float(round(contract_amount, 2))
-
-            # Создаем таблицу
-            main_table = cell.add_table(rows=1, cols=3)
-            main_table.columns[0].width = Cm(1.0)
-            main_table.columns[1].width = Cm(3.0)
-            main_table.columns[2].width = Cm(3.0)
-
-            # Заголовки
-            header_row = main_table.rows[0]
-            header_row.cells[0].text = '№'
-            header_row.cells[1].text = 'Сумма'
-            header_row.cells[2].text = 'Дата оплаты'
-
-            # Получаем квартальные платежи
-            contract_quarter_pays = ContractMonthPayMS.objects.using('ms_sql').filter(ContractID=contract.id)
-            count_month = 9
-            sum_for_month = math.ceil(contract_amount_with_discount / count_month)
-
-            group_by_quarter = contract_quarter_pays.values('QuarterDig').annotate(
-                MonthSum=Sum('MonthSum'), PayDateM=Min('PayDateM'))
-
-            count_quarterdig = {}
-            for quarter in group_by_quarter:
-                count_quarterdig[quarter['QuarterDig']] = contract_quarter_pays.filter(
-                    QuarterDig=quarter['QuarterDig']).count()
-
-            # Добавляем строки
-            for j, quarter in enumerate(group_by_quarter):
-                quarter['MonthSum'] = round(sum_for_month * count_quarterdig[quarter['QuarterDig']], 2)
-                row_cells = main_table.add_row().cells
-                row_cells[0].text = str(j + 1)
-                row_cells[1].text = str(quarter['MonthSum'])
-                row_cells[2].text = str(quarter['PayDateM']) if quarter['PayDateM'] else ''
+        def render():
+            # QR-коды накладываются на готовую основу, готовый PDF может быть взят из кэша
+            return pipeline.run(
+                user, contract.ContractNum,
+                self._get_qr_images(contract, qr_signature, qr_director_omarov, qr_director_serikov),
+                stamp=True, file_name=f'{contract.ContractNum}_signed.pdf'
+            )
 
-        except Exception as e:
-            logger.error(f"Error processing quarter pay table: {e}")
+        variant = ContractRenderJob.SIGNATURE + ('_dop' if is_dop_contract else '')
+        return ContractRenderLock.run(contract.ContractNum, variant, render)
+
+    def _get_qr_images(self, contract, qr_signature, qr_director_omarov, qr_director_serikov):
+        """Картинки QR-кодов подписанного договора: {плейсхолдер: (байты или функция, размер в дюймах)}"""
+        return {
+            'QRCode': (qr_signature, 1.5),
+            'QRCodeSignature': (qr_signature, 1.5),
+            'QRCodeDirectorOmarov': (qr_director_omarov, 1.5),
+            'QRcodeDirector': (qr_director_omarov, 1.5),
+            'QRCodeDirectorSerikov': (qr_director_serikov, 1.5),
+            'QRCodeDirector2': (qr_director_serikov, 1.5),
+            'QRCodeDataSigned': (lambda: self._generate_signed_data_qr_code(contract.ContractNum), 1.3),
+        }
 
     def _generate_signed_data_qr_code(self, contract_num):
         """Генерирует QR-код с данными подписанного договора"""
@@ -1034,41 +548,37 @@ class ContractSignatureService:
             logger.error(f"Error generating signed data QR code: {e}")
             return b''
 
+    def prepare_stamp_base(self, contract, is_dop_contract=False):
+        """Рендерит основу подписанного договора для штампа QR-кодов заранее, чтобы подписание не ждало LibreOffice"""
+        template_path = self._get_contract_template(contract, is_dop_contract)
+        if not template_path:
+            return False
+
+        pipeline = ContractRenderPipeline(
+            contract, is_dop_contract, ContractTemplateRegistry.SIGNED, template_path, whole_amount=False
+        )
+        try:
+            pipeline.render_stamped_pdf(self._get_qr_images(contract, b'', b'', b''))
+        finally:
+            pipeline.report()
+        return True
+
     def _get_contract_template(self, contract, is_dop_contract=False):
         """Получает шаблон контракта"""
         try:
-            contract_payment_type = contract.PaymentTypeID.sPaymentType
-            contract_school_language = getattr(contract.SchoolID, 'sSchool_language', '')
-            contract_school_direct = getattr(contract.SchoolID, 'sSchool_direct', '')
-
-            # Логика выбора шаблона из старого кода
-            if contract_payment_type == 'Оплата по месячно':
-                if contract_school_language == 'Казахское отделение':
-                    if is_dop_contract:
-                        return 'apps/contract/templates/contract/signed/Договор_оказания_дополнительных_образовательных_услуг_КАЗ_ОТД_ТОО_по_месячно.docx'
-                    else:
-                        return 'apps/contract/templates/contract/signed/Договор_оказания_образовательных_услуг_КАЗ_ОТД_ТОО_по_месячно.docx'
-                else:
-                    if contract_school_direct == 'Кембридж':
-                        return 'apps/contract/templates/contract/signed/Договор оказания образовательных услуг Кэмбридж 2025-2026 УО_по_месячно.docx'
-                    elif is_dop_contract:
-                        if contract_school_direct == 'Лингвинистический':
-                            return 'apps/contract/templates/contract/signed/Договор_оказания_дополнительных_образовательных_услуг_Лингво_2023_по_месячно.docx'
-                        elif contract_school_direct in ['Физико-математический', 'Физико-Математическая']:
-                            return 'apps/contract/templates/contract/signed/Договор_оказания_дополнительных_образовательных_услуг_Физмат_Нур_по_месячно.docx'
-                        elif contract_school_direct == 'Американская школа Advanced Placement':
-                            return 'apps/contract/templates/contract/signed/Договор_оказания_дополнительных_образовательных_услуг_AP_2023_2024_по_месячно.docx'
-                        elif contract_school_direct == 'IT-школа на Кекилбайулы':
-                            return 'apps/contract/templates/contract/signed/Договор_оказания_дополнительных_образовательных_услуг_IT_отделение_по_месячно.docx'
-                        else:
-                            return 'apps/contract/templates/contract/signed/Договор_оказания_образовательных_услуг_Школа_2023_2024_оплата_по_месячно.docx'
-                    else:
-                        return 'apps/contract/templates/contract/signed/Договор_оказания_образовательных_услуг_Школа_2023_2024_оплата_по_месячно.docx'
-
-            # Добавьте другие варианты оплаты по необходимости
-            print("Default contract template used")
-            logger.info("Default contract template used")
-            return 'apps/contract/templates/contract/Договор оказания образовательных услуг_Школа 2025-2026_за_год.docx'
+            template_path = ContractTemplateRegistry.resolve(
+                contract, is_dop_contract, ContractTemplateRegistry.SIGNED
+            )
+            if template_path is None:
+                logger.info("Default contract template used")
+                template_path = TEMPLATES_DIR / self.DEFAULT_CONTRACT_TEMPLATE
+
+            # Проверяем существование файла шаблона
+            if not Path(template_path).is_file():
+                logger.error(f"Template file not found: {template_path}")
+                return None
+
+            return str(template_path)
 
         except Exception as e:
             logger.error(f"Error getting contract template: {e}")
@@ -1084,7 +594,7 @@ class ContractSignatureService:
         parent = student.parent_id
 
         change_doc_service.change_content(
-            request=None,  # Можно передать None если не используется
+            user=user,
             contract_num=contract.ContractNum,
             contract=contract,
             student=student,
@@ -1092,42 +602,9 @@ class ContractSignatureService:
             is_dop_contract=is_dop_contract
         )
 
-    def _docx_to_pdf(self, input_path, output_path):
-        """Конвертация файла из формата DOCX в PDF"""
-        command_strings = ['libreoffice', '--headless', '--convert-to', 'pdf', '--outdir', output_path, input_path]
-        try:
-            subprocess.call(command_strings)
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Error converting DOCX to PDF: {e}")
-
     def _calculate_contract_hash(self, contract, is_dop_contract=False) -> str:
-        """Вычисляет хэш контракта на основе его ключевых данных"""
-        contract_data = (
-            f"{contract.ContractNum}:"
-            f"{contract.ContractAmount}:"
-            f"{contract.ContractDate}:"
-            f"{getattr(contract, 'StudentID_id', '')}:"
-            f"{getattr(contract, 'ContractStatusID_id', '')}"
-        )
-
-        try:
-            if is_dop_contract:
-                file_obj = ContractDopFileUser.objects.filter(contractNum=contract.ContractNum).first()
-            else:
-                file_obj = ContractFileUser.objects.filter(contractNum=contract.ContractNum).first()
-
-            if file_obj and file_obj.file:
-                hasher = hashlib.sha256()
-                file_obj.file.seek(0)
-                for chunk in file_obj.file.chunks():
-                    hasher.update(chunk)
-                file_hash = hasher.hexdigest()
-                contract_data += f":{file_hash}"
-        except Exception as e:
-            logger.warning(f"Could not include file hash for contract {contract.ContractNum}: {e}")
-            pass
-
-        return hashlib.sha256(contract_data.encode()).hexdigest()
+        """Хэш контракта: ключевые поля и sha256 текущей версии документа"""
+        return ContractDocumentStore.get_contract_hash(contract, is_dop_contract)
 
     def _add_director_signature(self, contract_num: str, parent_signature: ContractSignature, document_hash: str, signed_data):
         """Добавляет автоматическую подпись директора с правильным хэшем"""
@@ -1214,6 +691,7 @@ class ContractSignatureService:
             # Создаем подпись директора с ТЕМ ЖЕ хэшем что и у родителя
             director_signature = ContractSignature.objects.create(
                 contract_num=contract_num,
+                is_dop_contract=parent_signature.is_dop_contract,
                 cms_signature=director_omarov_cms_signature,
                 signed_data=signed_data,
                 document_hash=document_hash,
@@ -1225,6 +703,7 @@ class ContractSignatureService:
 
             director_signature = ContractSignature.objects.create(
                 contract_num=contract_num,
+                is_dop_contract=parent_signature.is_dop_contract,
                 cms_signature=director_serikov_cms_signature,
                 signed_data=signed_data,
                 document_hash=document_hash,
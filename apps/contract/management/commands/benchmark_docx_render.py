@@ -0,0 +1,76 @@
+import glob
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand, CommandError
+from docx import Document
+
+from apps.contract import ContractVariable
+from apps.contract.services_docx import CompiledDocxTemplate
+from apps.contract.services_templates import TEMPLATES_DIR
+
+TEMPLATES_GLOB = str(TEMPLATES_DIR / '*.docx')
+
+
+class Command(BaseCommand):
+    help = 'Сравнение времени заполнения шаблонов DOCX: обход всех run (старый способ) и скомпилированный шаблон'
+
+    def add_arguments(self, parser):
+        parser.add_argument('templates', nargs='*', help=f'Пути к шаблонам (по умолчанию {TEMPLATES_GLOB})')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    @staticmethod
+    def get_values() -> dict:
+        return {variable.strip('{}'): f'value {index}' for index, variable in enumerate(ContractVariable.values)}
+
+    @staticmethod
+    def render_legacy(docx_bytes, values):
+        """ Как до компиляции: разбор шаблона и проверка каждого плейсхолдера в каждом run таблиц """
+
+        doc = Document(BytesIO(docx_bytes))
+        for table in doc.tables:
+            for row in table.rows:
+                for cell in row.cells:
+                    for paragraph in cell.paragraphs:
+                        for run in paragraph.runs:
+                            for name, value in values.items():
+                                if f'{{{name}}}' in run.text:
+                                    run.text = run.text.replace(f'{{{name}}}', value)
+        return doc
+
+    @staticmethod
+    def measure(func, repeat) -> float:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - started) * 1000 / repeat
+
+    def handle(self, *args, **options):
+        paths = options['templates'] or sorted(glob.glob(TEMPLATES_GLOB))
+        if not paths:
+            raise CommandError('No templates found')
+
+        values = self.get_values()
+        repeat = options['repeat']
+        total_legacy = total_compiled = 0
+
+        self.stdout.write(f'{"legacy, ms":>12} {"compiled, ms":>13} {"compile, ms":>12} {"slots":>6}  template')
+        for path in paths:
+            with open(path, 'rb') as docx_file:
+                docx_bytes = docx_file.read()
+
+            started = time.perf_counter()
+            template = CompiledDocxTemplate(docx_bytes)
+            compile_ms = (time.perf_counter() - started) * 1000
+
+            legacy_ms = self.measure(lambda: self.render_legacy(docx_bytes, values), repeat)
+            compiled_ms = self.measure(lambda: template.render(values), repeat)
+            total_legacy += legacy_ms
+            total_compiled += compiled_ms
+
+            self.stdout.write(f'{legacy_ms:12.1f} {compiled_ms:13.1f} {compile_ms:12.1f} {len(template.slots):6}  {path}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Total per render: legacy {total_legacy:.1f}ms, compiled {total_compiled:.1f}ms '
+            f'({total_legacy / max(total_compiled, 0.001):.1f}x)'
+        ))
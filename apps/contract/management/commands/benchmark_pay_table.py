@@ -0,0 +1,72 @@
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from docx import Document
+from docx.shared import Cm
+
+from apps.contract.services_pay_table import PayTableBuilder
+
+
+class Command(BaseCommand):
+    help = 'Сравнение времени построения таблицы графика платежей: построчный add_row() и PayTableBuilder'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='*', default=[4, 9, 12, 36])
+        parser.add_argument('--repeat', type=int, default=50)
+
+    @staticmethod
+    def get_rows(count) -> list:
+        return [('150 000', date(2025, 9, 1) + timedelta(days=30 * index)) for index in range(count)]
+
+    @staticmethod
+    def build_legacy(cell, rows):
+        """ Как до PayTableBuilder: add_table() и add_row() с заполнением ячеек python-docx """
+
+        main_table = cell.add_table(rows=1, cols=3)
+        main_table.columns[0].width = Cm(1.0)
+        main_table.columns[1].width = Cm(3.0)
+        main_table.columns[2].width = Cm(3.0)
+
+        header_row = main_table.rows[0]
+        header_row.cells[0].text = '№'
+        header_row.cells[1].text = 'Сумма'
+        header_row.cells[2].text = 'Дата оплаты'
+
+        for j, (pay_sum, pay_date) in enumerate(rows):
+            row_cells = main_table.add_row().cells
+            row_cells[0].text = str(j + 1)
+            row_cells[1].text = pay_sum
+            row_cells[2].text = str(pay_date)
+
+        return main_table._tbl
+
+    @staticmethod
+    def measure(func, repeat) -> float:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - started) * 1000 / repeat
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        cell = Document().add_table(rows=1, cols=1).cell(0, 0)
+        body = cell._tc
+
+        PayTableBuilder.get_prototype()
+
+        def legacy(rows):
+            body.remove(self.build_legacy(cell, rows))
+
+        def builder(rows):
+            table = PayTableBuilder.build(rows)
+            body.append(table)
+            body.remove(table)
+
+        self.stdout.write(f'{"rows":>6} {"add_row, ms":>12} {"builder, ms":>12} {"speedup":>8}')
+        for count in options['rows']:
+            rows = self.get_rows(count)
+            legacy_ms = self.measure(lambda: legacy(rows), repeat)
+            builder_ms = self.measure(lambda: builder(rows), repeat)
+            self.stdout.write(f'{count:6} {legacy_ms:12.2f} {builder_ms:12.2f} '
+                              f'{legacy_ms / max(builder_ms, 0.001):7.1f}x')
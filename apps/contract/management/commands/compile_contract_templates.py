@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from apps.contract.models import CompiledContractTemplate
+from apps.contract.services_template_compile import ContractTemplateCompiler
+
+
+class Command(BaseCommand):
+    help = 'Компиляция загруженных шаблонов договоров (по умолчанию - еще не скомпилированных и с ошибкой)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Перекомпилировать все шаблоны')
+
+    def handle(self, *args, **options):
+        compiled = failed = 0
+
+        for model in ContractTemplateCompiler.MODELS.values():
+            templates = model.objects.all()
+            if not options['all']:
+                templates = templates.exclude(compile_status=CompiledContractTemplate.SUCCESS)
+
+            for template in templates.iterator():
+                template = ContractTemplateCompiler.compile(template)
+                if template.compile_status == CompiledContractTemplate.SUCCESS:
+                    compiled += 1
+                    unknown = ', '.join(template.unknown_placeholders)
+                    self.stdout.write(f'{model.__name__} {template.pk}: {len(template.placeholders)} placeholders'
+                                      + (f', unknown: {unknown}' if unknown else ''))
+                else:
+                    failed += 1
+                    self.stderr.write(f'{model.__name__} {template.pk}: {template.compile_error}')
+
+        self.stdout.write(self.style.SUCCESS(f'Compiled {compiled}, failed {failed}'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.contract.services_reference import ReferenceDataCache
+
+
+class Command(BaseCommand):
+    help = 'Сброс кэша справочников MS SQL (spr_*). Без аргументов сбрасываются все справочники'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tables', nargs='*', help=', '.join(ReferenceDataCache.TABLES.keys()))
+
+    def handle(self, *args, **options):
+        tables = options['tables']
+        unknown = [table for table in tables if table not in ReferenceDataCache.TABLES]
+        if unknown:
+            raise CommandError(f'Unknown reference tables: {", ".join(unknown)}')
+
+        ReferenceDataCache.invalidate(*tables)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Reference cache invalidated: {", ".join(tables or ReferenceDataCache.TABLES.keys())}'
+        ))
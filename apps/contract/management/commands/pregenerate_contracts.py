@@ -0,0 +1,104 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.util import Finalize
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from apps.contract.models import EduYearMS
+from apps.contract.services_converter import DocumentConverterPool
+from apps.contract.services_pregeneration import ContractPregenerationService
+from apps.contract.services_templates import ContractTemplateRegistry
+
+
+def init_worker():
+    """ Процесс пула: один soffice на процесс, все шаблоны скомпилированы заранее """
+
+    DocumentConverterPool.configure(size=1)
+    ContractTemplateRegistry.preload()
+    Finalize(None, DocumentConverterPool.close, exitpriority=10)
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерация PDF договоров на обучение учебного года, для которых еще нет документа (ContractDocument). '
+        'После прерывания достаточно запустить повторно - готовые договоры пропускаются'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('edu_year', type=int, help='id учебного года (EduYearMS)')
+        parser.add_argument('--school', type=int, default=None, help='id школы (SchoolMS)')
+        parser.add_argument('--concurrency', type=int, default=2, help='Число процессов рендера')
+        parser.add_argument('--limit', type=int, default=None, help='Не больше N договоров за запуск')
+        parser.add_argument('--progress-every', type=int, default=25)
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать договоры без PDF')
+        parser.add_argument('--celery', action='store_true', help='Поставить chord pregenerate_contracts в Celery')
+        parser.add_argument('--batch-size', type=int, default=50, help='Договоров в одной задаче chord')
+        parser.add_argument('--queue', default=None, help='Очередь Celery для задач chord')
+
+    def handle(self, *args, **options):
+        edu_year_id, school_id = options['edu_year'], options['school']
+        if not EduYearMS.objects.using('ms_sql').filter(id=edu_year_id).exists():
+            raise CommandError(f'Edu year {edu_year_id} not found')
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be positive')
+        if options['progress_every'] < 1:
+            raise CommandError('--progress-every must be positive')
+
+        if options['celery']:
+            from apps.contract.tasks import pregenerate_contracts
+
+            result = pregenerate_contracts.delay(edu_year_id, school_id, options['batch_size'], options['queue'])
+            self.stdout.write(self.style.SUCCESS(f'Queued pregenerate_contracts task {result.id}'))
+            return
+
+        pending = ContractPregenerationService.get_pending(edu_year_id, school_id)
+        if options['limit'] is not None:
+            pending = pending[:options['limit']]
+
+        self.stdout.write(f'Contracts without PDF: {len(pending)}')
+        if options['dry_run'] or not pending:
+            return
+
+        self.render(pending, options['concurrency'], options['progress_every'])
+
+    def render(self, pending, concurrency, progress_every):
+        total = len(pending)
+        done = failed = 0
+        started = time.time()
+
+        # Дочерние процессы не должны наследовать открытые соединения с базами
+        connections.close_all()
+
+        executor = ProcessPoolExecutor(
+            max_workers=concurrency, mp_context=multiprocessing.get_context('fork'), initializer=init_worker
+        )
+        futures = [executor.submit(ContractPregenerationService.render, contract_id) for contract_id, _ in pending]
+
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                done += 1
+                if result['error']:
+                    failed += 1
+                    self.stderr.write(f'{result["contract_num"] or result["contract_id"]}: {result["error"]}')
+
+                if done % progress_every == 0 or done == total:
+                    elapsed = max(time.time() - started, 0.001)
+                    rate = done / elapsed
+                    self.stdout.write(
+                        f'{done}/{total} ({done * 100 / total:.1f}%), failed {failed}, '
+                        f'{rate:.2f} contracts/s, eta {(total - done) / rate:.0f}s'
+                    )
+        except KeyboardInterrupt:
+            self.stderr.write(f'Interrupted after {done}/{total}, waiting for running renders. Run again to resume')
+            executor.shutdown(wait=True, cancel_futures=True)
+            return
+
+        executor.shutdown(wait=True)
+
+        elapsed = max(time.time() - started, 0.001)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {done - failed}, failed {failed} in {elapsed:.1f}s ({done / elapsed:.2f} contracts/s)'
+        ))
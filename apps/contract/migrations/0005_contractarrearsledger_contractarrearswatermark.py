@@ -0,0 +1,51 @@
+# Generated by Django 3.2.25 on 2026-10-17 10:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contract', '0004_auto_20250910_1538'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContractArrearsLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('contract_type', models.CharField(choices=[('study', 'Обучение'), ('food', 'Питание'), ('driver', 'Развозка')], max_length=10, verbose_name='Тип договора')),
+                ('contract_id', models.IntegerField(verbose_name='ID договора в MS SQL')),
+                ('planned_total', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Сумма по графику')),
+                ('paid_total', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Оплачено')),
+                ('contribution_total', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Взносы')),
+                ('transactions_count', models.IntegerField(default=0, verbose_name='Количество транзакций')),
+                ('arrears', models.IntegerField(default=0, verbose_name='Задолженность')),
+                ('synced_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время пересчета')),
+            ],
+            options={
+                'verbose_name': 'Задолженность по договору',
+                'verbose_name_plural': 'Задолженность по договорам',
+                'db_table': 'contract_arrears_ledger',
+            },
+        ),
+        migrations.CreateModel(
+            name='ContractArrearsWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('contract_type', models.CharField(choices=[('study', 'Обучение'), ('food', 'Питание'), ('driver', 'Развозка')], max_length=10, unique=True, verbose_name='Тип договора')),
+                ('transaction_last_id', models.BigIntegerField(default=0, verbose_name='Последний id транзакции')),
+                ('transaction_last_date', models.DateTimeField(blank=True, null=True, verbose_name='Последняя дата транзакции')),
+                ('month_pay_last_id', models.BigIntegerField(default=0, verbose_name='Последний id графика платежей')),
+                ('synced_at', models.DateTimeField(blank=True, null=True, verbose_name='Время последней синхронизации')),
+            ],
+            options={
+                'db_table': 'contract_arrears_watermark',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='contractarrearsledger',
+            constraint=models.UniqueConstraint(fields=('contract_type', 'contract_id'), name='contract_arrears_ledger_unique'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.25 on 2026-10-17 11:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contract', '0005_contractarrearsledger_contractarrearswatermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContractIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('contract_num', models.CharField(max_length=255, verbose_name='Номер договора')),
+                ('contract_type', models.CharField(choices=[('study', 'Обучение'), ('food', 'Питание'), ('driver', 'Развозка')], max_length=10, verbose_name='Тип договора')),
+                ('contract_id', models.IntegerField(verbose_name='ID договора в MS SQL')),
+                ('school_bin', models.CharField(blank=True, max_length=255, null=True, verbose_name='БИН школы')),
+                ('status_id', models.IntegerField(blank=True, null=True, verbose_name='ID статуса договора')),
+                ('has_dop_agreement', models.BooleanField(default=False, verbose_name='Есть доп. соглашение')),
+                ('synced_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время синхронизации')),
+            ],
+            options={
+                'verbose_name': 'Индекс договора',
+                'verbose_name_plural': 'Индекс договоров',
+                'db_table': 'contract_index',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='contractindex',
+            index=models.Index(fields=['contract_num'], name='contract_in_contrac_3c08d8_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='contractindex',
+            constraint=models.UniqueConstraint(fields=('contract_type', 'contract_id'), name='contract_index_unique'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-17 14:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contract', '0006_contractindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContractRenderJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('contract_num', models.CharField(max_length=255, verbose_name='Номер договора')),
+                ('variant', models.CharField(choices=[('unsigned', 'Договор для скачивания'), ('qr_signed', 'Договор с QR-кодами ЭЦП'), ('signature', 'Подписание договора')], max_length=20, verbose_name='Вариант')),
+                ('is_dop_contract', models.BooleanField(default=False, verbose_name='Доп. соглашение')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('success', 'Готово'), ('failure', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус')),
+                ('params', models.JSONField(blank=True, default=dict, verbose_name='Параметры')),
+                ('result', models.JSONField(blank=True, default=dict, verbose_name='Результат')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начата')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершена')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Генерация договора',
+                'verbose_name_plural': 'Генерация договоров',
+                'db_table': 'contract_render_job',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='contractrenderjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ('pending', 'running'))), fields=('contract_num', 'variant', 'is_dop_contract'), name='contract_render_job_active_unique'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 3.2.25 on 2026-10-17 16:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contract', '0007_contractrenderjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='markedupcontracttemplate',
+            name='compiled_file',
+            field=models.FileField(blank=True, null=True, upload_to='templates/contracts/compiled/', verbose_name='Скомпилированный DOCX'),
+        ),
+        migrations.AddField(
+            model_name='markedupcontracttemplate',
+            name='placeholders',
+            field=models.JSONField(blank=True, default=list, verbose_name='Найденные переменные'),
+        ),
+        migrations.AddField(
+            model_name='markedupcontracttemplate',
+            name='unknown_placeholders',
+            field=models.JSONField(blank=True, default=list, verbose_name='Неизвестные переменные'),
+        ),
+        migrations.AddField(
+            model_name='markedupcontracttemplate',
+            name='compile_status',
+            field=models.CharField(choices=[('pending', 'Ожидает компиляции'), ('success', 'Скомпилирован'), ('failure', 'Ошибка компиляции')], default='pending', max_length=10, verbose_name='Статус компиляции'),
+        ),
+        migrations.AddField(
+            model_name='markedupcontracttemplate',
+            name='compile_error',
+            field=models.TextField(blank=True, null=True, verbose_name='Ошибка компиляции'),
+        ),
+        migrations.AddField(
+            model_name='markedupcontracttemplate',
+            name='compiled_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Время компиляции'),
+        ),
+        migrations.AddField(
+            model_name='rawcontracttemplate',
+            name='compiled_file',
+            field=models.FileField(blank=True, null=True, upload_to='templates/contracts/compiled/', verbose_name='Скомпилированный DOCX'),
+        ),
+        migrations.AddField(
+            model_name='rawcontracttemplate',
+            name='placeholders',
+            field=models.JSONField(blank=True, default=list, verbose_name='Найденные переменные'),
+        ),
+        migrations.AddField(
+            model_name='rawcontracttemplate',
+            name='unknown_placeholders',
+            field=models.JSONField(blank=True, default=list, verbose_name='Неизвестные переменные'),
+        ),
+        migrations.AddField(
+            model_name='rawcontracttemplate',
+            name='compile_status',
+            field=models.CharField(choices=[('pending', 'Ожидает компиляции'), ('success', 'Скомпилирован'), ('failure', 'Ошибка компиляции')], default='pending', max_length=10, verbose_name='Статус компиляции'),
+        ),
+        migrations.AddField(
+            model_name='rawcontracttemplate',
+            name='compile_error',
+            field=models.TextField(blank=True, null=True, verbose_name='Ошибка компиляции'),
+        ),
+        migrations.AddField(
+            model_name='rawcontracttemplate',
+            name='compiled_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Время компиляции'),
+        ),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 3.2.25 on 2026-10-17 18:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+BATCH_SIZE = 2000
+
+
+def copy_contract_files(apps, schema_editor):
+    """
+        Существующие файлы ContractFileUser / ContractDopFileUser становятся версиями ContractDocument:
+        строки одного договора по порядку id, последняя - текущая. Размер и хэш считаются при первом обращении.
+    """
+
+    ContractDocument = apps.get_model('contract', 'ContractDocument')
+    legacy_models = (
+        (apps.get_model('contract', 'ContractFileUser'), 'contract'),
+        (apps.get_model('contract', 'ContractDopFileUser'), 'dop'),
+    )
+
+    for model, kind in legacy_models:
+        rows = model.objects.exclude(contractNum__isnull=True).exclude(file='') \
+            .order_by('contractNum', 'id').values_list('contractNum', 'file', 'user_id')
+
+        documents = []
+        previous = None
+        version = 0
+        for contract_num, file_name, user_id in rows.iterator():
+            if contract_num != previous:
+                previous, version = contract_num, 0
+            elif documents:
+                documents[-1].is_current = False
+
+            version += 1
+            documents.append(ContractDocument(
+                contract_num=contract_num, kind=kind, version=version, is_current=True,
+                file=file_name, user_id=user_id,
+            ))
+
+            # Последнюю строку не сбрасываем: она может быть текущей, следующая строка того же договора ее сменит
+            if len(documents) > BATCH_SIZE:
+                ContractDocument.objects.bulk_create(documents[:-1])
+                documents = documents[-1:]
+
+        ContractDocument.objects.bulk_create(documents)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contract', '0008_compiled_contract_templates'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contractfileuser',
+            name='contractNum',
+            field=models.CharField(db_index=True, max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='contractdopfileuser',
+            name='contractNum',
+            field=models.CharField(db_index=True, max_length=255, null=True),
+        ),
+        migrations.CreateModel(
+            name='ContractDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('contract_num', models.CharField(max_length=255, verbose_name='Номер договора')),
+                ('kind', models.CharField(choices=[('contract', 'Договор'), ('dop', 'Доп. соглашение')], default='contract', max_length=10, verbose_name='Вид')),
+                ('version', models.PositiveIntegerField(verbose_name='Версия')),
+                ('is_current', models.BooleanField(default=True, verbose_name='Текущая версия')),
+                ('file', models.FileField(upload_to='contract/documents/', verbose_name='Файл')),
+                ('size', models.PositiveIntegerField(blank=True, null=True, verbose_name='Размер, байт')),
+                ('sha256', models.CharField(blank=True, max_length=64, null=True, verbose_name='SHA-256')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Версия документа договора',
+                'verbose_name_plural': 'Версии документов договоров',
+                'db_table': 'contract_document',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='contractdocument',
+            constraint=models.UniqueConstraint(fields=('contract_num', 'kind', 'version'), name='contract_document_version_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='contractdocument',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_current', True)), fields=('contract_num', 'kind'), name='contract_document_current_unique'),
+        ),
+        migrations.RunPython(copy_contract_files, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contract', '0009_contractdocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contractsignature',
+            name='is_dop_contract',
+            field=models.BooleanField(default=False, help_text='Подписано доп. соглашение к контракту', verbose_name='Доп. соглашение'),
+        ),
+    ]
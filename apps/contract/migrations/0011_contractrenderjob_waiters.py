@@ -0,0 +1,20 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contract', '0010_contractsignature_is_dop_contract'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contractrenderjob',
+            name='waiters',
+            field=models.ManyToManyField(blank=True, related_name='awaited_render_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Ожидающие'),
+        ),
+    ]
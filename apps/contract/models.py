@@ -1,8 +1,8 @@
-import hashlib
 import uuid
 
 from django.core.validators import FileExtensionValidator
 from django.db import models
+from django.utils import timezone
 
 from ..school.models import SchoolMS, School
 from ..user.models import UserMS, User
@@ -439,7 +439,7 @@ class TransactionDriverMS(models.Model):
 class ContractFileUser(models.Model):
 
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, db_column='user')
-    contractNum = models.CharField(max_length=255, null=True)
+    contractNum = models.CharField(max_length=255, null=True, db_index=True)
     file = models.FileField(upload_to='contract/files/', null=False)
     date = models.DateTimeField(auto_now_add=True, null=True)
 
@@ -452,7 +452,7 @@ class ContractFileUser(models.Model):
 
 class ContractDopFileUser(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, db_column='user')
-    contractNum = models.CharField(max_length=255, null=True)
+    contractNum = models.CharField(max_length=255, null=True, db_index=True)
     file = models.FileField(upload_to='contract_dop/files/', null=False)
     date = models.DateTimeField(auto_now_add=True, null=True)
 
@@ -463,7 +463,82 @@ class ContractDopFileUser(models.Model):
         db_table = 'ContractDopFileUser'
 
 
-class RawContractTemplate(models.Model):
+class ContractDocument(models.Model):
+    """
+        Версии PDF договоров и доп. соглашений (ContractDocumentStore).
+        Каждая генерация или подписание добавляет версию, текущая у договора одна (частичный уникальный индекс),
+        старые версии удаляются сверх CONTRACT_DOCUMENT_KEEP_VERSIONS.
+        ContractFileUser / ContractDopFileUser указывают на файл текущей версии.
+    """
+
+    CONTRACT = 'contract'
+    DOP = 'dop'
+    KINDS = (
+        (CONTRACT, 'Договор'),
+        (DOP, 'Доп. соглашение'),
+    )
+
+    contract_num = models.CharField(max_length=255, verbose_name='Номер договора')
+    kind = models.CharField(max_length=10, choices=KINDS, default=CONTRACT, verbose_name='Вид')
+    version = models.PositiveIntegerField(verbose_name='Версия')
+    is_current = models.BooleanField(default=True, verbose_name='Текущая версия')
+    file = models.FileField(upload_to='contract/documents/', verbose_name='Файл')
+    size = models.PositiveIntegerField(null=True, blank=True, verbose_name='Размер, байт')
+    sha256 = models.CharField(max_length=64, null=True, blank=True, verbose_name='SHA-256')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Пользователь')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создана')
+
+    def __str__(self):
+        return f'{self.contract_num} {self.kind} v{self.version}'
+
+    class Meta:
+        db_table = 'contract_document'
+        verbose_name = 'Версия документа договора'
+        verbose_name_plural = 'Версии документов договоров'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['contract_num', 'kind', 'version'],
+                name='contract_document_version_unique',
+            ),
+            models.UniqueConstraint(
+                fields=['contract_num', 'kind'],
+                condition=models.Q(is_current=True),
+                name='contract_document_current_unique',
+            ),
+        ]
+
+
+class CompiledContractTemplate(models.Model):
+    """
+        Результат компиляции загруженного шаблона (задача compile_contract_template):
+        DOCX с собранными в один run плейсхолдерами (.doc конвертируется один раз) и найденные переменные.
+    """
+
+    PENDING = 'pending'
+    SUCCESS = 'success'
+    FAILURE = 'failure'
+    COMPILE_STATUSES = (
+        (PENDING, 'Ожидает компиляции'),
+        (SUCCESS, 'Скомпилирован'),
+        (FAILURE, 'Ошибка компиляции'),
+    )
+
+    compiled_file = models.FileField(
+        upload_to='templates/contracts/compiled/', null=True, blank=True, verbose_name='Скомпилированный DOCX'
+    )
+    placeholders = models.JSONField(default=list, blank=True, verbose_name='Найденные переменные')
+    unknown_placeholders = models.JSONField(default=list, blank=True, verbose_name='Неизвестные переменные')
+    compile_status = models.CharField(
+        max_length=10, choices=COMPILE_STATUSES, default=PENDING, verbose_name='Статус компиляции'
+    )
+    compile_error = models.TextField(null=True, blank=True, verbose_name='Ошибка компиляции')
+    compiled_at = models.DateTimeField(null=True, blank=True, verbose_name='Время компиляции')
+
+    class Meta:
+        abstract = True
+
+
+class RawContractTemplate(CompiledContractTemplate):
     """Шаблон контракта, в который нужно вставить переменные."""
 
     school = models.ForeignKey(
@@ -486,7 +561,7 @@ class RawContractTemplate(models.Model):
         db_table = 'raw_contract_template'
 
 
-class MarkedUpContractTemplate(models.Model):
+class MarkedUpContractTemplate(CompiledContractTemplate):
     """Размеченный шаблон контракта, готовый для использования."""
 
     raw_contract_template = models.ForeignKey(
@@ -522,6 +597,13 @@ class ContractSignature(models.Model):
         help_text='Номер контракта из ContractMS.ContractNum'
     )
 
+    # Подпись доп. соглашения: хэш считается по документу доп. соглашения
+    is_dop_contract = models.BooleanField(
+        default=False,
+        verbose_name='Доп. соглашение',
+        help_text='Подписано доп. соглашение к контракту'
+    )
+
     # Данные подписи
     cms_signature = models.TextField(
         verbose_name='CMS подпись',
@@ -624,35 +706,15 @@ class ContractSignature(models.Model):
         if not contract:
             return True
 
-        current_hash = self._calculate_contract_hash(contract)
+        current_hash = self._calculate_contract_hash(contract, self.is_dop_contract)
         return current_hash != self.document_hash
 
     @staticmethod
-    def _calculate_contract_hash(contract):
-        """Вычисляет хэш контракта на основе его ключевых данных"""
-        # Используем ключевые поля контракта для хэша
-        contract_data = (
-            f"{contract.ContractNum}:"
-            f"{contract.ContractAmount}:"
-            f"{contract.ContractDate}:"
-            f"{contract.StudentID_id}:"
-            f"{contract.ContractStatusID_id}"
-        )
-
-        # Если есть связанный файл, добавляем его хэш
-        try:
-            file_obj = ContractFileUser.objects.filter(contractNum=contract.ContractNum).first()
-            if file_obj and file_obj.file:
-                hasher = hashlib.sha256()
-                file_obj.file.seek(0)
-                for chunk in file_obj.file.chunks():
-                    hasher.update(chunk)
-                file_hash = hasher.hexdigest()
-                contract_data += f":{file_hash}"
-        except Exception:
-            pass
-
-        return hashlib.sha256(contract_data.encode()).hexdigest()
+    def _calculate_contract_hash(contract, is_dop_contract=False):
+        """Хэш контракта: ключевые поля и sha256 текущей версии документа (ContractDocumentStore)"""
+        from .services_documents import ContractDocumentStore
+
+        return ContractDocumentStore.get_contract_hash(contract, is_dop_contract)
 
     @classmethod
     def get_contract_signatures(cls, contract_num):
@@ -692,4 +754,160 @@ class ContractSignature(models.Model):
                 signature.save()
                 return "document_modified"
 
-        return "signed"
\ No newline at end of file
+        return "signed"
+
+
+class ContractArrearsLedger(models.Model):
+    """
+        Витрина задолженности по договорам в Postgres.
+        Одна строка на (тип договора, id договора), пересчитывается задачей sync_arrears_ledger
+        по новым транзакциям и графикам платежей из MS SQL.
+    """
+
+    STUDY = 'study'
+    FOOD = 'food'
+    DRIVER = 'driver'
+
+    CONTRACT_TYPES = (
+        (STUDY, 'Обучение'),
+        (FOOD, 'Питание'),
+        (DRIVER, 'Развозка'),
+    )
+
+    contract_type = models.CharField(max_length=10, choices=CONTRACT_TYPES, verbose_name='Тип договора')
+    contract_id = models.IntegerField(verbose_name='ID договора в MS SQL')
+    planned_total = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Сумма по графику')
+    paid_total = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Оплачено')
+    contribution_total = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Взносы')
+    transactions_count = models.IntegerField(default=0, verbose_name='Количество транзакций')
+    arrears = models.IntegerField(default=0, verbose_name='Задолженность')
+    synced_at = models.DateTimeField(default=timezone.now, verbose_name='Время пересчета')
+
+    def __str__(self):
+        return f'{self.contract_type} - {self.contract_id} - {self.arrears}'
+
+    class Meta:
+        db_table = 'contract_arrears_ledger'
+        verbose_name = 'Задолженность по договору'
+        verbose_name_plural = 'Задолженность по договорам'
+        constraints = [
+            models.UniqueConstraint(fields=['contract_type', 'contract_id'], name='contract_arrears_ledger_unique'),
+        ]
+
+
+class ContractArrearsWatermark(models.Model):
+    """ Отметка синхронизации витрины задолженности: до какой строки MS SQL данные уже учтены """
+
+    contract_type = models.CharField(
+        max_length=10, choices=ContractArrearsLedger.CONTRACT_TYPES, unique=True, verbose_name='Тип договора'
+    )
+    transaction_last_id = models.BigIntegerField(default=0, verbose_name='Последний id транзакции')
+    transaction_last_date = models.DateTimeField(null=True, blank=True, verbose_name='Последняя дата транзакции')
+    month_pay_last_id = models.BigIntegerField(default=0, verbose_name='Последний id графика платежей')
+    synced_at = models.DateTimeField(null=True, blank=True, verbose_name='Время последней синхронизации')
+
+    def __str__(self):
+        return f'{self.contract_type} - {self.synced_at}'
+
+    class Meta:
+        db_table = 'contract_arrears_watermark'
+
+
+class ContractIndex(models.Model):
+    """
+        Индекс номеров договоров: ContractNum -> тип и id договора в MS SQL.
+        Заполняется задачей sync_contract_index и при чтении, если номера еще нет в индексе.
+    """
+
+    contract_num = models.CharField(max_length=255, verbose_name='Номер договора')
+    contract_type = models.CharField(
+        max_length=10, choices=ContractArrearsLedger.CONTRACT_TYPES, verbose_name='Тип договора'
+    )
+    contract_id = models.IntegerField(verbose_name='ID договора в MS SQL')
+    school_bin = models.CharField(max_length=255, null=True, blank=True, verbose_name='БИН школы')
+    status_id = models.IntegerField(null=True, blank=True, verbose_name='ID статуса договора')
+    has_dop_agreement = models.BooleanField(default=False, verbose_name='Есть доп. соглашение')
+    synced_at = models.DateTimeField(default=timezone.now, verbose_name='Время синхронизации')
+
+    def __str__(self):
+        return f'{self.contract_num} - {self.contract_type} - {self.contract_id}'
+
+    class Meta:
+        db_table = 'contract_index'
+        verbose_name = 'Индекс договора'
+        verbose_name_plural = 'Индекс договоров'
+        indexes = [
+            models.Index(fields=['contract_num']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['contract_type', 'contract_id'], name='contract_index_unique'),
+        ]
+
+
+class ContractRenderJob(models.Model):
+    """
+        Фоновая генерация PDF договора (задача render_contract_job).
+        Пока задача по договору и варианту в очереди или выполняется, повторный запрос получает ее же.
+        waiters - все пользователи, получившие задачу (автор и повторные запросы), им доступен ее статус и результат.
+    """
+
+    UNSIGNED = 'unsigned'
+    QR_SIGNED = 'qr_signed'
+    SIGNATURE = 'signature'
+    VARIANTS = (
+        (UNSIGNED, 'Договор для скачивания'),
+        (QR_SIGNED, 'Договор с QR-кодами ЭЦП'),
+        (SIGNATURE, 'Подписание договора'),
+    )
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCESS = 'success'
+    FAILURE = 'failure'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (SUCCESS, 'Готово'),
+        (FAILURE, 'Ошибка'),
+    )
+    ACTIVE_STATUSES = (PENDING, RUNNING)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    contract_num = models.CharField(max_length=255, verbose_name='Номер договора')
+    variant = models.CharField(max_length=20, choices=VARIANTS, verbose_name='Вариант')
+    is_dop_contract = models.BooleanField(default=False, verbose_name='Доп. соглашение')
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING, verbose_name='Статус')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Пользователь')
+    waiters = models.ManyToManyField(User, blank=True, related_name='awaited_render_jobs', verbose_name='Ожидающие')
+    params = models.JSONField(default=dict, blank=True, verbose_name='Параметры')
+    result = models.JSONField(default=dict, blank=True, verbose_name='Результат')
+    error = models.TextField(null=True, blank=True, verbose_name='Ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создана')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='Начата')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Завершена')
+
+    def __str__(self):
+        return f'{self.contract_num} - {self.variant} - {self.status}'
+
+    @property
+    def is_finished(self):
+        return self.status not in self.ACTIVE_STATUSES
+
+    def is_available_to(self, user):
+        """ Статус задачи виден ее автору, всем, кто ждет тот же договор, и сотрудникам """
+
+        if user.is_staff or self.user_id == user.id:
+            return True
+        return self.waiters.filter(id=user.id).exists()
+
+    class Meta:
+        db_table = 'contract_render_job'
+        verbose_name = 'Генерация договора'
+        verbose_name_plural = 'Генерация договоров'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['contract_num', 'variant', 'is_dop_contract'],
+                condition=models.Q(status__in=('pending', 'running')),
+                name='contract_render_job_active_unique',
+            ),
+        ]
@@ -4,9 +4,9 @@ from rest_framework.serializers import ModelSerializer
 from ..models import ContractMS, ClassMS, PaymentTypeMS, ContractStatusMS, \
     CompanyMS, EduYearMS, DiscountMS, DiscountTypeMS, ContractDiscountMS, ContractMonthPayMS, ContractDopMS
 from ..serializers.student import StudentMSSerializer
+from ..services_schedule import ContractScheduleService
 from ...school.models import SchoolMS
 from ...user.models import UserMS
-from django.db.models import Sum
 
 
 class SchoolMSSerializer(ModelSerializer):
@@ -143,35 +143,20 @@ class ContractSerializer(ModelSerializer):
         return ContractDopMSSerializer(contract_dop, many=True).data
 
     def get_DetailContract(self, obj):
-        discount = DiscountMS.objects.using('ms_sql').all()
-        contract_discount = ContractDiscountMS.objects.using('ms_sql').filter(ContractID=obj)
-        contract_dop_sum = ContractDopMS.objects.using('ms_sql').filter(agreement_id=obj.id).aggregate(
-            Sum('amount')).get('amount__sum')
-        if contract_dop_sum is None:
-            contract_dop_sum = 0
-
-        contract_amount = float(obj.ContractAmount)
-
-        for i in contract_discount:
-            for j in discount.filter(id=i.DiscountID.id):
-                percent = int(j.iDiscountPercent)
-                contract_amount -= contract_amount * percent / 100
-
-        contract_amount_with_discount = float(round(contract_amount, 2)) + float(contract_dop_sum)
-
-        month_sum = contract_amount_with_discount / 9
-
-        contract_month_pay = ContractMonthPayMS.objects.using('ms_sql').filter(ContractID=obj)
-        month_pays = []
-
-        for i in contract_month_pay:
-            month_pays.append({
-                'MonthAmount': str(round(month_sum, 2)),
-                'MonthSum': str(round(month_sum, 2)),
-                'PayDateM': i.PayDateM,
-            })
-
-        return month_pays
+        schedule = self.context.get('schedules', {}).get(obj.id)
+        if schedule is None:
+            schedule = ContractScheduleService().get_schedule(obj)
+
+        month_sum = str(round(schedule['month_sum'], 2))
+
+        return [
+            {
+                'MonthAmount': month_sum,
+                'MonthSum': month_sum,
+                'PayDateM': month['PayDateM'],
+            }
+            for month in schedule['months']
+        ]
 
     class Meta:
         model = ContractMS
@@ -0,0 +1,41 @@
+from rest_framework import serializers
+
+from ..models import ContractMS, ContractFoodMS, ContractDriverMS, StudentMS
+
+
+class FamilyContractSerializer(serializers.ModelSerializer):
+    """ Краткие данные договора на обучение для сводки по семье """
+
+    ContractStatus = serializers.CharField(source='ContractStatusID.sStatusName', default=None, read_only=True)
+    PaymentType = serializers.CharField(source='PaymentTypeID.sPaymentType', default=None, read_only=True)
+    EduYear = serializers.CharField(source='EduYearID.sEduYear', default=None, read_only=True)
+
+    class Meta:
+        model = ContractMS
+        fields = ['id', 'ContractNum', 'ContractDate', 'ContractDateClose', 'ContractAmount', 'ContractSum',
+                  'ContractStatus', 'PaymentType', 'EduYear']
+
+
+class FamilyContractFoodSerializer(FamilyContractSerializer):
+    """ Краткие данные договора на питание для сводки по семье """
+
+    class Meta:
+        model = ContractFoodMS
+        fields = FamilyContractSerializer.Meta.fields
+
+
+class FamilyContractDriverSerializer(FamilyContractSerializer):
+    """ Краткие данные договора на развозку для сводки по семье """
+
+    class Meta:
+        model = ContractDriverMS
+        fields = ['id', 'ContractNum', 'ContractDate', 'ContractDateClose', 'ContractAmount', 'ContractAmountDis',
+                  'ContractStatus', 'PaymentType', 'EduYear']
+
+
+class FamilyStudentSerializer(serializers.ModelSerializer):
+    """ Ребенок родителя в сводке по семье """
+
+    class Meta:
+        model = StudentMS
+        fields = ['id', 'full_name', 'iin']
@@ -1,5 +1,9 @@
+from decimal import Decimal
+
 from rest_framework import serializers
-from apps.contract.models import ContractMS, ContractMonthPayMS, TransactionMS, DiscountMS
+from apps.contract.models import ContractMS, DiscountMS
+from apps.contract.services_arrears import ContractArrearsLedgerService
+from apps.contract.services_reference import ReferenceDataCache
 
 
 class DiscountMSSerializer(serializers.ModelSerializer):
@@ -117,14 +121,12 @@ class ContractListReportSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_DiscountID(obj):
-        try:
-            discounts = DiscountMS.objects.using('ms_sql').filter(id=obj.DiscountID.id)
-            return DiscountMSSerializer(discounts, many=True).data
-        except AttributeError:
-            return None
-        except DiscountMS.DoesNotExist:
+        if obj.DiscountID_id is None:
             return None
 
+        discount = ReferenceDataCache.get(ReferenceDataCache.DISCOUNT, obj.DiscountID_id)
+        return DiscountMSSerializer([discount] if discount else [], many=True).data
+
     @staticmethod
     def get_ContributionSum(obj):
         try:
@@ -132,28 +134,14 @@ class ContractListReportSerializer(serializers.ModelSerializer):
         except AttributeError:
             return None
 
-    @staticmethod
-    def get_ArrearsSum(obj):
-        pays = ContractMonthPayMS.objects.using('ms_sql').filter(ContractID=obj.id)
-        transactions = TransactionMS.objects.using('ms_sql').filter(agreement_id=obj.id)
-
-        pays_sum = 0
-        transactions_sum = 0
-        for pay in pays:
-            try:
-                pays_sum += pay.MonthSum
-            except TypeError:
-                pays_sum += int(pay.MonthSum)
-        for transaction in transactions:
-            try:
-                transactions_sum += transaction.amount
-            except TypeError:
-                transactions_sum += int(transaction.amount)
+    def get_ArrearsSum(self, obj):
+        totals = self.context.get('arrears_totals', {}).get(obj.id)
+        if totals is None:
+            totals = ContractArrearsLedgerService(ContractArrearsLedgerService.STUDY).get_totals([obj.id])[obj.id]
 
-        try:
-            result = int(pays_sum) - int(transactions_sum)
-        except TypeError:
-            result = pays_sum - transactions_sum
+        pays_sum = Decimal(str(totals['planned']))
+        transactions_sum = Decimal(str(totals['paid'])) + Decimal(str(totals['contribution']))
+        result = int(pays_sum) - int(transactions_sum)
 
         return result if result > 0 else 0
 
@@ -3,9 +3,21 @@ from rest_framework.serializers import ModelSerializer
 
 from apps.contract.models import MarkedUpContractTemplate, RawContractTemplate
 from apps.contract import ContractVariable
+from apps.contract.services_template_compile import ContractTemplateCompiler
 
 
-class RawContractTemplateSerializer(ModelSerializer):
+class CompiledTemplateFileMixin:
+    """Синхронная проверка загружаемого файла шаблона, компиляция - в задаче compile_contract_template."""
+
+    def validate_file(self, value):
+        try:
+            ContractTemplateCompiler.validate(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+
+class RawContractTemplateSerializer(CompiledTemplateFileMixin, ModelSerializer):
 
     class Meta:
         model = RawContractTemplate
@@ -14,10 +26,16 @@ class RawContractTemplateSerializer(ModelSerializer):
             'file',
             'school',
             'name',
+            'compile_status',
+            'placeholders',
+            'unknown_placeholders',
             'created_at',
             'changed_at',
         )
         read_only_fields = (
+            'compile_status',
+            'placeholders',
+            'unknown_placeholders',
             'created_at',
             'changed_at',
         )
@@ -25,6 +43,7 @@ class RawContractTemplateSerializer(ModelSerializer):
 
 class RawContractTemplateForMarkUpSerializer(ModelSerializer):
     variables_list = serializers.SerializerMethodField()
+    found_variables = serializers.SerializerMethodField()
 
     class Meta:
         model = RawContractTemplate
@@ -34,19 +53,30 @@ class RawContractTemplateForMarkUpSerializer(ModelSerializer):
             'name',
             'created_at',
             'changed_at',
+            'compile_status',
             'variables_list',
+            'found_variables',
+            'unknown_placeholders',
         )
         read_only_fields = (
             'created_at',
             'changed_at',
+            'compile_status',
             'variables_list',
+            'found_variables',
+            'unknown_placeholders',
         )
 
     def get_variables_list(self, obj: RawContractTemplate) -> list:
         return ContractVariable.choices
 
+    def get_found_variables(self, obj: RawContractTemplate) -> list:
+        """Переменные, уже найденные в документе при компиляции, с описаниями из ContractVariable."""
+        variables = ContractTemplateCompiler.get_variables()
+        return [(f'{{{name}}}', variables[name]) for name in obj.placeholders if name in variables]
+
 
-class MarkedUpContractTemplateSerializer(ModelSerializer):
+class MarkedUpContractTemplateSerializer(CompiledTemplateFileMixin, ModelSerializer):
 
     class Meta:
         model = MarkedUpContractTemplate
@@ -55,10 +85,16 @@ class MarkedUpContractTemplateSerializer(ModelSerializer):
             'file',
             'name',
             'school',
+            'compile_status',
+            'placeholders',
+            'unknown_placeholders',
             'created_at',
             'changed_at',
         )
         read_only_fields = (
+            'compile_status',
+            'placeholders',
+            'unknown_placeholders',
             'created_at',
             'changed_at',
         )
@@ -0,0 +1,350 @@
+import logging
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum, Count, Q
+from django.utils import timezone
+
+from .models import ContractMonthPayMS, TransactionMS, ContractFoodMonthPayMS, TransactionFoodMS, \
+    ContractDriverMonthPayMS, TransactionDriverMS, ContractArrearsLedger, ContractArrearsWatermark
+
+logger = logging.getLogger(__name__)
+
+
+class ContractArrearsService:
+    """
+        Сервис расчета задолженности по договорам.
+        План и оплаты считаются одним сгруппированным запросом на таблицу
+        для любого набора договоров. Результат - словарь {id договора: задолженность}.
+    """
+
+    STUDY = 'study'
+    FOOD = 'food'
+    DRIVER = 'driver'
+
+    # MS SQL ограничивает количество параметров в запросе (2100)
+    CHUNK_SIZE = 2000
+
+    SOURCES = {
+        STUDY: {
+            'month_pay_model': ContractMonthPayMS,
+            'month_pay_contract_field': 'ContractID',
+            'month_pay_amount_field': 'MonthSum',
+            'transaction_model': TransactionMS,
+            'transaction_contract_field': 'agreement_id',
+            'transaction_amount_field': 'amount',
+            'transaction_date_field': 'trans_date',
+            'transaction_paid_filter': Q(contribution=False),
+            'transaction_contribution_filter': Q(contribution=True),
+        },
+        FOOD: {
+            'month_pay_model': ContractFoodMonthPayMS,
+            'month_pay_contract_field': 'ContractID',
+            'month_pay_amount_field': 'MonthSum',
+            'transaction_model': TransactionFoodMS,
+            'transaction_contract_field': 'contract_id',
+            'transaction_amount_field': 'amount',
+            'transaction_date_field': 'trans_date',
+            'transaction_paid_filter': None,
+            'transaction_contribution_filter': None,
+        },
+        DRIVER: {
+            'month_pay_model': ContractDriverMonthPayMS,
+            'month_pay_contract_field': 'ContractID',
+            'month_pay_amount_field': 'MonthAmount',
+            'transaction_model': TransactionDriverMS,
+            'transaction_contract_field': 'ContractID',
+            'transaction_amount_field': 'Amount',
+            'transaction_date_field': 'TransactionDate',
+            'transaction_paid_filter': None,
+            'transaction_contribution_filter': None,
+        },
+    }
+
+    def __init__(self, contract_type=STUDY) -> None:
+        self.contract_type = contract_type
+        self.source = self.SOURCES[contract_type]
+
+    def _chunks(self, contract_ids):
+        contract_ids = list(dict.fromkeys(contract_ids))
+        for i in range(0, len(contract_ids), self.CHUNK_SIZE):
+            yield contract_ids[i:i + self.CHUNK_SIZE]
+
+    def sum_month_pays(self, contract_ids) -> dict:
+        """ Плановая сумма по графику платежей: {id договора: сумма} """
+
+        model = self.source['month_pay_model']
+        contract_field = self.source['month_pay_contract_field']
+        amount_field = self.source['month_pay_amount_field']
+
+        result = {}
+        for chunk in self._chunks(contract_ids):
+            rows = model.objects.using('ms_sql').filter(**{f'{contract_field}__in': chunk}) \
+                .values(contract_field).annotate(total=Sum(amount_field))
+            for row in rows:
+                result[row[contract_field]] = float(row['total'] or 0)
+
+        return result
+
+    def aggregate_transactions(self, contract_ids) -> dict:
+        """
+            Итоги по транзакциям: {id договора: {'count', 'paid', 'contribution'}}.
+            Для договоров на обучение взносы (contribution) в оплаченную сумму не входят
+            и считаются отдельно.
+        """
+
+        model = self.source['transaction_model']
+        contract_field = self.source['transaction_contract_field']
+        amount_field = self.source['transaction_amount_field']
+        paid_filter = self.source['transaction_paid_filter']
+        contribution_filter = self.source['transaction_contribution_filter']
+
+        aggregates = {'count': Count('id'), 'paid': Sum(amount_field, filter=paid_filter)}
+        if contribution_filter is not None:
+            aggregates['contribution'] = Sum(amount_field, filter=contribution_filter)
+
+        result = {}
+        for chunk in self._chunks(contract_ids):
+            rows = model.objects.using('ms_sql').filter(**{f'{contract_field}__in': chunk}) \
+                .values(contract_field).annotate(**aggregates)
+            for row in rows:
+                result[row[contract_field]] = {
+                    'count': row['count'],
+                    'paid': float(row['paid'] or 0),
+                    'contribution': float(row.get('contribution') or 0),
+                }
+
+        return result
+
+    def sum_transactions(self, contract_ids) -> dict:
+        """ Оплаты по договорам: {id договора: (количество транзакций, оплаченная сумма)} """
+
+        return {
+            contract_id: (totals['count'], totals['paid'])
+            for contract_id, totals in self.aggregate_transactions(contract_ids).items()
+        }
+
+    @staticmethod
+    def calculate(planned, paid) -> int:
+        """ Задолженность: округление до копеек, меньше 1 тенге - 0, затем округление вверх """
+
+        if planned > 0:
+            arrears_value = round(float(planned) - float(paid), 2)
+
+            if arrears_value < 1:
+                arrears_value = 0
+            return math.ceil(arrears_value)
+
+        return 0
+
+    def get_arrears(self, contract_ids) -> dict:
+        """
+            Задолженность по набору договоров.
+            Договоры без единой транзакции в результат не попадают.
+        """
+
+        contract_ids = list(contract_ids)
+        if not contract_ids:
+            return {}
+
+        transactions = self.sum_transactions(contract_ids)
+        if not transactions:
+            return {}
+
+        month_pays = self.sum_month_pays(transactions.keys())
+
+        return {
+            contract_id: self.calculate(month_pays.get(contract_id, 0), paid)
+            for contract_id, (count, paid) in transactions.items()
+        }
+
+    def get_totals(self, contract_ids) -> dict:
+        """
+            Полные итоги по каждому из переданных договоров:
+            {id договора: {'planned', 'paid', 'contribution', 'count', 'arrears'}}.
+            Договоры без транзакций тоже попадают в результат (count = 0).
+        """
+
+        contract_ids = list(contract_ids)
+        if not contract_ids:
+            return {}
+
+        transactions = self.aggregate_transactions(contract_ids)
+        month_pays = self.sum_month_pays(contract_ids)
+
+        result = {}
+        for contract_id in contract_ids:
+            planned = month_pays.get(contract_id, 0.0)
+            contract_transactions = transactions.get(contract_id, {})
+            paid = contract_transactions.get('paid', 0.0)
+            result[contract_id] = {
+                'planned': planned,
+                'paid': paid,
+                'contribution': contract_transactions.get('contribution', 0.0),
+                'count': contract_transactions.get('count', 0),
+                'arrears': self.calculate(planned, paid),
+            }
+
+        return result
+
+
+class ContractArrearsLedgerService(ContractArrearsService):
+    """
+        Задолженность из витрины ContractArrearsLedger.
+        Витрине доверяем, только если синхронизация по типу договора проходила не раньше
+        ARREARS_LEDGER_MAX_AGE секунд назад, иначе считаем напрямую по MS SQL.
+        Договоры, которых еще нет в витрине, пересчитываются и дописываются при чтении.
+    """
+
+    LEDGER_FIELDS = ('planned_total', 'paid_total', 'contribution_total', 'transactions_count', 'arrears', 'synced_at')
+
+    def is_fresh(self) -> bool:
+        max_age = timedelta(seconds=settings.ARREARS_LEDGER_MAX_AGE)
+        return ContractArrearsWatermark.objects.filter(
+            contract_type=self.contract_type, synced_at__gte=timezone.now() - max_age
+        ).exists()
+
+    @staticmethod
+    def row_to_totals(row) -> dict:
+        return {
+            'planned': float(row.planned_total),
+            'paid': float(row.paid_total),
+            'contribution': float(row.contribution_total),
+            'count': row.transactions_count,
+            'arrears': row.arrears,
+        }
+
+    def refresh(self, contract_ids) -> dict:
+        """ Пересчет строк витрины по MS SQL. Возвращает итоги в формате get_totals """
+
+        totals = super().get_totals(contract_ids)
+        now = timezone.now()
+
+        for chunk in self._chunks(totals.keys()):
+            with transaction.atomic():
+                existing = {
+                    row.contract_id: row for row in ContractArrearsLedger.objects.select_for_update().filter(
+                        contract_type=self.contract_type, contract_id__in=chunk
+                    )
+                }
+                rows_to_create = []
+                rows_to_update = []
+
+                for contract_id in chunk:
+                    contract_totals = totals[contract_id]
+                    row = existing.get(contract_id)
+                    if row is None:
+                        row = ContractArrearsLedger(contract_type=self.contract_type, contract_id=contract_id)
+                        rows_to_create.append(row)
+                    else:
+                        rows_to_update.append(row)
+
+                    row.planned_total = round(contract_totals['planned'], 2)
+                    row.paid_total = round(contract_totals['paid'], 2)
+                    row.contribution_total = round(contract_totals['contribution'], 2)
+                    row.transactions_count = contract_totals['count']
+                    row.arrears = contract_totals['arrears']
+                    row.synced_at = now
+
+                # Строку мог успеть создать параллельный запрос - она будет актуальной
+                ContractArrearsLedger.objects.bulk_create(rows_to_create, ignore_conflicts=True)
+                ContractArrearsLedger.objects.bulk_update(rows_to_update, self.LEDGER_FIELDS)
+
+        return totals
+
+    def get_totals(self, contract_ids) -> dict:
+        contract_ids = list(dict.fromkeys(contract_ids))
+        if not contract_ids:
+            return {}
+
+        if not self.is_fresh():
+            return super().get_totals(contract_ids)
+
+        result = {}
+        for chunk in self._chunks(contract_ids):
+            rows = ContractArrearsLedger.objects.filter(contract_type=self.contract_type, contract_id__in=chunk)
+            for row in rows:
+                result[row.contract_id] = self.row_to_totals(row)
+
+        missing = [contract_id for contract_id in contract_ids if contract_id not in result]
+        if missing:
+            result.update(self.refresh(missing))
+
+        return result
+
+    def get_arrears(self, contract_ids) -> dict:
+        return {
+            contract_id: totals['arrears']
+            for contract_id, totals in self.get_totals(contract_ids).items()
+            if totals['count']
+        }
+
+    def get_watermark(self):
+        watermark, _ = ContractArrearsWatermark.objects.get_or_create(contract_type=self.contract_type)
+        return watermark
+
+    def collect_changed_contracts(self, watermark, full=False) -> set:
+        """ Договоры, у которых появились транзакции или строки графика после отметки """
+
+        contract_ids = set()
+
+        transaction_model = self.source['transaction_model']
+        transaction_contract_field = self.source['transaction_contract_field']
+        date_field = self.source['transaction_date_field']
+
+        transactions = transaction_model.objects.using('ms_sql').all()
+        if not full:
+            changed = Q(id__gt=watermark.transaction_last_id)
+            if watermark.transaction_last_date:
+                changed |= Q(**{f'{date_field}__gt': watermark.transaction_last_date})
+            transactions = transactions.filter(changed)
+
+        for row_id, contract_id, row_date in transactions.values_list(
+                'id', transaction_contract_field, date_field).iterator():
+            if contract_id is not None:
+                contract_ids.add(contract_id)
+            watermark.transaction_last_id = max(watermark.transaction_last_id, row_id)
+            if row_date and (watermark.transaction_last_date is None or row_date > watermark.transaction_last_date):
+                watermark.transaction_last_date = row_date
+
+        month_pay_model = self.source['month_pay_model']
+        month_pay_contract_field = self.source['month_pay_contract_field']
+
+        month_pays = month_pay_model.objects.using('ms_sql').all()
+        if not full:
+            month_pays = month_pays.filter(id__gt=watermark.month_pay_last_id)
+
+        for row_id, contract_id in month_pays.values_list('id', month_pay_contract_field).iterator():
+            if contract_id is not None:
+                contract_ids.add(contract_id)
+            watermark.month_pay_last_id = max(watermark.month_pay_last_id, row_id)
+
+        if full:
+            # Договоры, строки которых удалили в MS SQL, тоже нужно пересчитать
+            contract_ids.update(
+                ContractArrearsLedger.objects.filter(contract_type=self.contract_type)
+                .values_list('contract_id', flat=True)
+            )
+
+        return contract_ids
+
+    def sync(self, full=False) -> int:
+        """
+            Инкрементальная синхронизация витрины: пересчитываются только договоры
+            с новыми строками. full=True - полный пересчет (исправленные и удаленные строки).
+        """
+
+        watermark = self.get_watermark()
+        contract_ids = self.collect_changed_contracts(watermark, full=full)
+
+        if contract_ids:
+            self.refresh(contract_ids)
+
+        watermark.synced_at = timezone.now()
+        watermark.save()
+
+        logger.info(f'Arrears ledger {self.contract_type}: {len(contract_ids)} contracts refreshed (full={full})')
+
+        return len(contract_ids)
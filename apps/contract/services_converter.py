@@ -0,0 +1,338 @@
+import json
+import logging
+import os
+import queue
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.core import checks
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentConversionError(Exception):
+    """ Ошибка конвертации документа """
+
+
+class DocumentConversionTimeout(DocumentConversionError):
+    """ Конвертация не уложилась в DOCUMENT_CONVERTER_TIMEOUT """
+
+
+class SofficeListener:
+    """
+        Долгоживущий процесс soffice, принимающий UNO-соединения на своем порту.
+        У каждого процесса свой каталог профиля, поэтому параллельные конвертации не мешают друг другу.
+        Интерпретатор приложения (python:3.10) не импортирует uno из python3-uno, поэтому к soffice подключается
+        мост utils/uno_bridge.py под системным python3 (DOCUMENT_CONVERTER_UNO_PYTHON): один процесс на listener,
+        задания передаются строками JSON через stdin/stdout.
+        Без uno (use_uno=False, только при DOCUMENT_CONVERTER_CLI_FALLBACK) - soffice --convert-to на каждый документ.
+    """
+
+    # Фильтры экспорта LibreOffice по формату результата
+    FILTERS = {
+        'pdf': 'writer_pdf_Export',
+        'docx': 'MS Word 2007 XML',
+    }
+
+    BRIDGE_SCRIPT = Path(__file__).resolve().parent / 'utils' / 'uno_bridge.py'
+
+    _uno_available = None
+
+    def __init__(self, index, port, profile_dir, use_uno=True) -> None:
+        self.index = index
+        self.port = port
+        self.profile_dir = Path(profile_dir).resolve()
+        self.jobs_dir = self.profile_dir / 'jobs'
+        self.use_uno = use_uno
+        self.process = None
+        self.bridge = None
+
+    @property
+    def profile_url(self) -> str:
+        return self.profile_dir.as_uri()
+
+    @property
+    def is_alive(self) -> bool:
+        return all(process is not None and process.poll() is None for process in (self.process, self.bridge))
+
+    @classmethod
+    def has_uno(cls) -> bool:
+        """ Импортирует ли uno системный python (DOCUMENT_CONVERTER_UNO_PYTHON). Проверяется один раз на процесс """
+
+        if cls._uno_available is None:
+            try:
+                result = subprocess.run(
+                    [settings.DOCUMENT_CONVERTER_UNO_PYTHON, '-c', 'import uno'],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    timeout=30,
+                )
+                cls._uno_available = result.returncode == 0
+            except (OSError, subprocess.TimeoutExpired):
+                cls._uno_available = False
+        return cls._uno_available
+
+    def start(self) -> None:
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        if not self.use_uno:
+            return
+
+        self.process = subprocess.Popen(
+            [
+                settings.DOCUMENT_CONVERTER_BINARY,
+                '--headless', '--invisible', '--nologo', '--norestore', '--nodefault', '--nolockcheck',
+                f'-env:UserInstallation={self.profile_url}',
+                f'--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext',
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        self.bridge = subprocess.Popen(
+            [
+                settings.DOCUMENT_CONVERTER_UNO_PYTHON, str(self.BRIDGE_SCRIPT),
+                str(self.port), str(settings.DOCUMENT_CONVERTER_START_TIMEOUT),
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+
+        try:
+            # Мост сам ждет soffice START_TIMEOUT секунд, запас - на запуск интерпретатора
+            self.run_with_timeout(self.read_reply, settings.DOCUMENT_CONVERTER_START_TIMEOUT + 10)
+        except DocumentConversionError as e:
+            self.stop()
+            raise DocumentConversionError(f'soffice listener #{self.index} did not start on port {self.port}: {e}')
+
+        logger.info(f'soffice listener #{self.index} started on port {self.port} '
+                    f'(pid {self.process.pid}, UNO bridge pid {self.bridge.pid})')
+
+    def read_reply(self) -> None:
+        line = self.bridge.stdout.readline()
+        if not line:
+            raise DocumentConversionError(f'UNO bridge of listener #{self.index} exited')
+
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise DocumentConversionError(reply['error'])
+
+    def stop(self) -> None:
+        for name in ('bridge', 'process'):
+            process = getattr(self, name)
+            setattr(self, name, None)
+            if process is None or process.poll() is not None:
+                continue
+
+            process.kill()
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                logger.error(f'soffice listener #{self.index} {name} (pid {process.pid}) did not exit')
+
+    def restart(self) -> None:
+        logger.warning(f'Restarting soffice listener #{self.index}')
+        self.stop()
+        # Профиль мог остаться в неконсистентном состоянии после падения
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+        self.start()
+
+    def _convert_uno(self, input_path, output_path, target_format) -> None:
+        job = {'input': str(input_path), 'output': str(output_path), 'filter': self.FILTERS[target_format]}
+        self.bridge.stdin.write(json.dumps(job) + '\n')
+        self.bridge.stdin.flush()
+        self.read_reply()
+
+    def _convert_cli(self, input_path, output_path, timeout, target_format) -> None:
+        subprocess.run(
+            [
+                settings.DOCUMENT_CONVERTER_BINARY, '--headless', '--norestore', '--nolockcheck',
+                f'-env:UserInstallation={self.profile_url}',
+                '--convert-to', target_format, '--outdir', str(output_path.parent), str(input_path),
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=timeout,
+            check=True,
+        )
+
+    def convert(self, docx_bytes, timeout, source_format='docx', target_format='pdf') -> bytes:
+        job_dir = self.jobs_dir / uuid.uuid4().hex
+        job_dir.mkdir(parents=True)
+        input_path = job_dir / f'document.{source_format}'
+        output_path = job_dir / f'output/document.{target_format}'
+        output_path.parent.mkdir()
+        input_path.write_bytes(docx_bytes)
+
+        try:
+            if not self.use_uno:
+                try:
+                    self._convert_cli(input_path, output_path, timeout, target_format)
+                except subprocess.TimeoutExpired:
+                    raise DocumentConversionTimeout(f'Conversion took more than {timeout}s')
+                except subprocess.CalledProcessError as e:
+                    raise DocumentConversionError(str(e))
+            else:
+                self.run_with_timeout(self._convert_uno, timeout, input_path, output_path, target_format)
+
+            if not output_path.exists():
+                raise DocumentConversionError(f'soffice did not produce a {target_format.upper()}')
+
+            return output_path.read_bytes()
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    def run_with_timeout(self, func, timeout, *args) -> None:
+        """ UNO-вызов блокирующий: выполняется в отдельном потоке, по таймауту процесс soffice убивается """
+
+        result = {}
+
+        def target():
+            try:
+                func(*args)
+            except Exception as e:
+                result['error'] = e
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        thread.join(timeout)
+
+        if thread.is_alive():
+            self.stop()
+            raise DocumentConversionTimeout(f'Conversion took more than {timeout}s')
+        if 'error' in result:
+            raise DocumentConversionError(str(result['error']))
+
+
+class DocumentConverterPool:
+    """
+        Пул из DOCUMENT_CONVERTER_POOL_SIZE процессов soffice на процесс приложения.
+        convert() занимает свободный процесс, при падении или таймауте процесс перезапускается.
+        Пул создается лениво при первой конвертации. Если uno недоступен, пул не создается (ошибка в лог и
+        DocumentConversionError), холодный soffice --convert-to - только при явном DOCUMENT_CONVERTER_CLI_FALLBACK.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+    # Размер пула процесса вместо DOCUMENT_CONVERTER_POOL_SIZE (configure)
+    _size = None
+
+    def __init__(self, size, base_port, root_dir) -> None:
+        self.size = size
+        self.listeners = queue.Queue()
+
+        use_uno = SofficeListener.has_uno()
+        if not use_uno:
+            message = f'soffice pool not started: {get_uno_error()}'
+            if not settings.DOCUMENT_CONVERTER_CLI_FALLBACK:
+                logger.error(message)
+                raise DocumentConversionError(message)
+            logger.error(f'{message}. DOCUMENT_CONVERTER_CLI_FALLBACK: cold soffice --convert-to per document')
+
+        for index in range(size):
+            port = self.find_free_port(base_port + index)
+            listener = SofficeListener(index, port, Path(root_dir) / f'profile_{index}', use_uno)
+            listener.start()
+            self.listeners.put(listener)
+
+    @staticmethod
+    def find_free_port(port) -> int:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            if sock.connect_ex(('127.0.0.1', port)) != 0:
+                return port
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    @classmethod
+    def configure(cls, size) -> None:
+        """ Размер пула текущего процесса, если пул еще не создан (например, один soffice на процесс рендера) """
+
+        with cls._instance_lock:
+            if cls._instance is not None:
+                raise DocumentConversionError('soffice pool is already started')
+            cls._size = size
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    root_dir = settings.DOCUMENT_CONVERTER_PROFILE_DIR or tempfile.mkdtemp(prefix='soffice_')
+                    # Порты и профили разводятся по pid, чтобы несколько воркеров на хосте не пересекались
+                    cls._instance = cls(
+                        size=cls._size or settings.DOCUMENT_CONVERTER_POOL_SIZE,
+                        base_port=settings.DOCUMENT_CONVERTER_BASE_PORT + (os.getpid() % 1000) * 10,
+                        root_dir=Path(root_dir) / str(os.getpid()),
+                    )
+        return cls._instance
+
+    def convert(self, docx_bytes, timeout=None, source_format='docx', target_format='pdf') -> bytes:
+        timeout = timeout or settings.DOCUMENT_CONVERTER_TIMEOUT
+        listener = self.listeners.get()
+        try:
+            started = time.perf_counter()
+            try:
+                if listener.use_uno and not listener.is_alive:
+                    listener.restart()
+                pdf_bytes = listener.convert(docx_bytes, timeout, source_format, target_format)
+            except DocumentConversionTimeout:
+                listener.restart()
+                raise
+            except DocumentConversionError as e:
+                # Процесс мог упасть посреди конвертации: перезапуск и одна повторная попытка
+                logger.warning(f'soffice listener #{listener.index} failed: {e}')
+                listener.restart()
+                pdf_bytes = listener.convert(docx_bytes, timeout, source_format, target_format)
+
+            logger.info(f'{source_format.upper()} converted to {target_format.upper()} by listener #{listener.index} '
+                        f'in {(time.perf_counter() - started) * 1000:.0f}ms')
+            return pdf_bytes
+        finally:
+            self.listeners.put(listener)
+
+    def shutdown(self) -> None:
+        while not self.listeners.empty():
+            self.listeners.get_nowait().stop()
+
+    @classmethod
+    def close(cls) -> None:
+        """ Остановка пула текущего процесса (если он запускался) """
+
+        with cls._instance_lock:
+            if cls._instance is not None:
+                cls._instance.shutdown()
+                cls._instance = None
+
+
+def get_uno_error() -> str:
+    return (f'{settings.DOCUMENT_CONVERTER_UNO_PYTHON} cannot import uno '
+            f'(install python3-uno or set DOCUMENT_CONVERTER_UNO_PYTHON)')
+
+
+def check_document_converter(app_configs, **kwargs) -> list:
+    """ Проверка при запуске (manage.py check --deploy --tag converter): пул конвертации сможет подключиться по UNO """
+
+    if SofficeListener.has_uno() or settings.DOCUMENT_CONVERTER_CLI_FALLBACK:
+        return []
+    return [checks.Error(get_uno_error(), hint='See docker/dev/Dockerfile-dev', id='contract.E001')]
+
+
+def convert_docx_to_pdf(docx_bytes, timeout=None) -> bytes:
+    """ DOCX (байты) -> PDF (байты) через пул процессов soffice """
+
+    return DocumentConverterPool.get_instance().convert(docx_bytes, timeout=timeout)
+
+
+def convert_doc_to_docx(doc_bytes, timeout=None) -> bytes:
+    """ DOC (байты) -> DOCX (байты) через пул процессов soffice """
+
+    return DocumentConverterPool.get_instance().convert(doc_bytes, timeout=timeout, source_format='doc',
+                                                        target_format='docx')
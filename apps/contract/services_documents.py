@@ -0,0 +1,206 @@
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import ContractDocument, ContractDopFileUser, ContractFileUser
+
+logger = logging.getLogger(__name__)
+
+
+class ContractDocumentStore:
+    """
+        Версионное хранилище PDF договоров (ContractDocument).
+        Текущая версия договора ищется одним запросом по частичному уникальному индексу (contract_num, kind, is_current).
+        Запись не перезаписывает файл: добавляется версия с размером и sha256, прежняя перестает быть текущей,
+        версии сверх CONTRACT_DOCUMENT_KEEP_VERSIONS удаляются вместе с файлами после фиксации транзакции.
+        ContractFileUser / ContractDopFileUser (отчеты, предгенерация) переводятся на файл текущей версии.
+    """
+
+    # Повтор при одновременной записи первой версии договора (уникальность contract_num, kind, version)
+    SAVE_ATTEMPTS = 3
+
+    # Файлы, записанные внутри delete_on_rollback текущего потока
+    _local = threading.local()
+
+    @staticmethod
+    def get_kind(is_dop_contract) -> str:
+        return ContractDocument.DOP if is_dop_contract else ContractDocument.CONTRACT
+
+    @classmethod
+    def get_current(cls, contract_num, is_dop_contract=False):
+        return ContractDocument.objects.filter(
+            contract_num=contract_num, kind=cls.get_kind(is_dop_contract), is_current=True
+        ).first()
+
+    @staticmethod
+    def digest(content) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    @classmethod
+    def get_sha256(cls, document) -> str:
+        """ Хэш файла версии; для версий, перенесенных из ContractFileUser, считается один раз и сохраняется """
+
+        if document.sha256 is None:
+            hasher = hashlib.sha256()
+            size = 0
+            with document.file.open('rb') as document_file:
+                for chunk in document_file.chunks():
+                    hasher.update(chunk)
+                    size += len(chunk)
+
+            document.sha256, document.size = hasher.hexdigest(), size
+            ContractDocument.objects.filter(pk=document.pk).update(sha256=document.sha256, size=size)
+
+        return document.sha256
+
+    @classmethod
+    def get_contract_hash(cls, contract, is_dop_contract=False) -> str:
+        """
+            Хэш подписываемого договора: ключевые поля договора и sha256 текущей версии документа.
+            Один для подписания (ContractSignatureService) и проверки подписи (ContractSignature.is_document_modified)
+        """
+
+        contract_data = (
+            f"{contract.ContractNum}:"
+            f"{contract.ContractAmount}:"
+            f"{contract.ContractDate}:"
+            f"{getattr(contract, 'StudentID_id', '')}:"
+            f"{getattr(contract, 'ContractStatusID_id', '')}"
+        )
+
+        try:
+            document = cls.get_current(contract.ContractNum, is_dop_contract)
+            if document and document.file:
+                contract_data += f":{cls.get_sha256(document)}"
+        except Exception as e:
+            logger.warning(f'Could not include file hash for contract {contract.ContractNum}: {e}')
+
+        return hashlib.sha256(contract_data.encode()).hexdigest()
+
+    @classmethod
+    @contextmanager
+    def delete_on_rollback(cls):
+        """
+            Для внешней транзакции вокруг save (подписание договора): save пишет файл до транзакции,
+            поэтому при ошибке в блоке (транзакция откатывается, строк версий не остается)
+            записанные в блоке файлы удаляются из хранилища.
+        """
+
+        guards = cls._local.__dict__.setdefault('guards', [])
+        written = []
+        guards.append(written)
+        try:
+            yield
+        except Exception:
+            storage = ContractDocument._meta.get_field('file').storage
+            for name in written:
+                storage.delete(name)
+            logger.info(f'Contract document files removed after rollback: {written}')
+            raise
+        finally:
+            guards.pop()
+
+    @classmethod
+    def save(cls, user, contract_num, pdf_content, is_dop_contract=False, file_name=None) -> ContractDocument:
+        """ Новая текущая версия документа договора. Файл пишется в хранилище до транзакции, чтобы не держать блокировку """
+
+        name = ContractDocument._meta.get_field('file').generate_filename(None, file_name or f'{contract_num}.pdf')
+        storage = ContractDocument._meta.get_field('file').storage
+        name = storage.save(name, ContentFile(pdf_content))
+
+        for attempt in range(1, cls.SAVE_ATTEMPTS + 1):
+            try:
+                document = cls._save_version(user, contract_num, is_dop_contract, name, pdf_content)
+            except IntegrityError:
+                if attempt == cls.SAVE_ATTEMPTS:
+                    storage.delete(name)
+                    raise
+                logger.warning(f'Contract document {contract_num} version conflict, retry {attempt}')
+            else:
+                for written in getattr(cls._local, 'guards', ()):
+                    written.append(name)
+                return document
+
+    @classmethod
+    def _save_version(cls, user, contract_num, is_dop_contract, name, pdf_content) -> ContractDocument:
+        kind = cls.get_kind(is_dop_contract)
+        user = user if getattr(user, 'is_authenticated', False) else None
+
+        with transaction.atomic():
+            # Версий договора немного (ограничены retention): блокируются все, номер следующей - по ним
+            versions = ContractDocument.objects.select_for_update().filter(contract_num=contract_num, kind=kind)
+            last_version = max(versions.values_list('version', flat=True), default=0)
+            versions.filter(is_current=True).update(is_current=False)
+
+            document = ContractDocument.objects.create(
+                contract_num=contract_num,
+                kind=kind,
+                version=last_version + 1,
+                is_current=True,
+                file=name,
+                size=len(pdf_content),
+                sha256=cls.digest(pdf_content),
+                user=user,
+            )
+
+            cls.sync_legacy(document, is_dop_contract)
+            cls.apply_retention(contract_num, kind)
+
+        return document
+
+    @staticmethod
+    def sync_legacy(document, is_dop_contract) -> None:
+        """ Последняя запись ContractFileUser / ContractDopFileUser указывает на файл текущей версии """
+
+        model = ContractDopFileUser if is_dop_contract else ContractFileUser
+        legacy = model.objects.select_for_update().filter(contractNum=document.contract_num).last()
+        if legacy is None:
+            model.objects.create(user=document.user, contractNum=document.contract_num, file=document.file.name)
+            return
+
+        legacy.file = document.file.name
+        legacy.date = timezone.now()
+        legacy.save(update_fields=['file', 'date'])
+
+    @staticmethod
+    def apply_retention(contract_num, kind, keep=None) -> int:
+        """ Удаление версий сверх keep (по умолчанию CONTRACT_DOCUMENT_KEEP_VERSIONS), текущая остается всегда """
+
+        keep = settings.CONTRACT_DOCUMENT_KEEP_VERSIONS if keep is None else keep
+
+        expired = list(
+            ContractDocument.objects.filter(contract_num=contract_num, kind=kind, is_current=False)
+            .order_by('-version').values_list('id', 'file')[max(keep - 1, 0):]
+        )
+        if not expired:
+            return 0
+
+        kept_files = set(
+            ContractDocument.objects.filter(contract_num=contract_num, kind=kind)
+            .exclude(id__in=[document_id for document_id, file_name in expired]).values_list('file', flat=True)
+        )
+        ContractDocument.objects.filter(id__in=[document_id for document_id, file_name in expired]).delete()
+
+        storage = ContractDocument._meta.get_field('file').storage
+        file_names = {file_name for document_id, file_name in expired if file_name and file_name not in kept_files}
+
+        def delete_files():
+            for file_name in file_names:
+                storage.delete(file_name)
+
+        transaction.on_commit(delete_files)
+
+        logger.info(f'Contract document {contract_num} {kind}: {len(expired)} old versions removed')
+        return len(expired)
+
+    @classmethod
+    def get_versions(cls, contract_num, is_dop_contract=False):
+        return ContractDocument.objects.filter(
+            contract_num=contract_num, kind=cls.get_kind(is_dop_contract)
+        ).order_by('-version')
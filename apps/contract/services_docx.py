@@ -0,0 +1,413 @@
+import copy
+import hashlib
+import os
+import re
+import threading
+from datetime import timedelta
+from functools import lru_cache
+from io import BytesIO
+
+from docx import Document
+from docx.oxml.ns import qn
+from docx.shared import Inches
+from docx.table import _Cell
+from docx.text.paragraph import Paragraph
+from docx.text.run import Run
+from num2words import num2words
+
+from . import ContractVariable
+
+# {Имя} и исторический маркер QRCodeDataSigned без скобок
+PLACEHOLDER_PATTERN = re.compile(r'\{(?P<name>\w+)\}|(?P<bare>QRCodeDataSigned)')
+
+QR_CODE_TEXT_RUS = 'QR-код содержит данные об электронно-цифровой подписи подписанта'
+QR_CODE_TEXT_KAZ = 'QR-кодта қол қоюшының электрондық-цифрлық қолтаңбасы туралы деректер қамтылады'
+POLICE_KAZ = 'Осы құжат «Электрондық құжат және электрондық цифрлық қолтаңба туралы» Қазақстан Республикасының 2003 жылғы 7 қаңтардағы N 370-II Заңы 7 бабының 1 тармағына сәйкес қағаз тасығыштағы құжатпен бірдей.'
+POLICE_RUS = 'Данный документ согласно пункту 1 статьи 7 ЗРК от 7 января 2003 года «Об электронном документе и электронной цифровой подписи» равнозначен документу на бумажном носителе.'
+
+
+# Названия месяцев: язык -> 12 названий (январь..декабрь)
+MONTH_NAMES = {
+    'ru': ('Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь',
+           'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь'),
+    'kk': ('Қаңтар', 'Ақпан', 'Наурыз', 'Сәуір', 'Мамыр', 'Маусым',
+           'Шілде', 'Тамыз', 'Қыркүйек', 'Қазан', 'Қараша', 'Желтоқсан'),
+    'en': ('January', 'February', 'March', 'April', 'May', 'June',
+           'July', 'August', 'September', 'October', 'November', 'December'),
+}
+
+# В шаблонах казахский обозначается и как kk (ISO 639-1), и как kz (num2words)
+LANGUAGE_ALIASES = {
+    'kz': 'kk',
+    'rus': 'ru',
+    'kaz': 'kk',
+    'eng': 'en',
+}
+
+ENGLISH_MONTHS = {name.lower(): index for index, name in enumerate(MONTH_NAMES['en'], start=1)}
+
+
+def translate_month(month, lang):
+    """
+        Название месяца на нужном языке по встроенной таблице, без обращения к сети.
+        month - номер месяца (1-12) или английское название (как из strftime('%B')).
+    """
+
+    if isinstance(month, str):
+        month_num = ENGLISH_MONTHS.get(month.strip().lower())
+        if month_num is None:
+            return month
+    else:
+        month_num = int(month)
+
+    names = MONTH_NAMES.get(LANGUAGE_ALIASES.get(lang, lang), MONTH_NAMES['en'])
+    return names[month_num - 1]
+
+
+@lru_cache(maxsize=4096)
+def _amount_to_words(amount, lang):
+    return num2words(amount, lang=lang)
+
+
+def amount_to_words(amount, lang):
+    """ Сумма прописью. Результат кэшируется по (сумма, язык): в договоре одни и те же суммы повторяются """
+
+    return _amount_to_words(int(amount or 0), lang)
+
+
+class DocxSlot:
+    """ Место подстановки при рендеринге: run с плейсхолдером, его абзац и ячейка таблицы (если есть) """
+
+    def __init__(self, document, run, paragraph, cell) -> None:
+        self.document = document
+        self.run = run
+        self.paragraph = paragraph
+        self.cell = cell
+
+
+class CompiledDocxTemplate:
+    """
+        Шаблон DOCX, разобранный один раз.
+        При компиляции плейсхолдеры, разбитые Word на несколько run, сливаются в один run,
+        и запоминаются позиции run с плейсхолдерами. Рендеринг - копия готового дерева
+        и замены только в запомненных run, без обхода всего документа.
+    """
+
+    def __init__(self, docx_bytes) -> None:
+        self.document = Document(BytesIO(docx_bytes))
+        self.slots = []
+        self._lock = threading.Lock()
+        self.compile()
+
+    @property
+    def placeholders(self) -> set:
+        return {name for run_index, tokens in self.slots for name, token in tokens}
+
+    def to_bytes(self) -> bytes:
+        """ Нормализованный DOCX (плейсхолдеры собраны в один run) """
+
+        buffer = BytesIO()
+        with self._lock:
+            self.document.save(buffer)
+        return buffer.getvalue()
+
+    @staticmethod
+    def iter_runs(document):
+        return document.element.body.iter(qn('w:r'))
+
+    @staticmethod
+    def merge_split_placeholders(paragraph) -> None:
+        """ Плейсхолдер, разбитый на несколько run, переносится целиком в первый из них """
+
+        runs = [run for run in paragraph.iterchildren(qn('w:r'))]
+        if len(runs) < 2:
+            return
+
+        texts = [run.text for run in runs]
+        full_text = ''.join(texts)
+        if '{' not in full_text and 'QRCodeDataSigned' not in full_text:
+            return
+
+        bounds = []
+        position = 0
+        for text in texts:
+            bounds.append((position, position + len(text)))
+            position += len(text)
+
+        def run_at(offset):
+            for index, (start, end) in enumerate(bounds):
+                if start <= offset < end:
+                    return index
+            return len(bounds) - 1
+
+        for match in reversed(list(PLACEHOLDER_PATTERN.finditer(full_text))):
+            first = run_at(match.start())
+            last = run_at(match.end() - 1)
+            if first == last:
+                continue
+
+            first_start = bounds[first][0]
+            last_end = bounds[last][1]
+            texts[first] = texts[first][:match.start() - first_start] + match.group(0)
+            texts[last] = full_text[match.end():last_end]
+            for index in range(first + 1, last):
+                texts[index] = ''
+            for index in range(first, last + 1):
+                runs[index].text = texts[index]
+
+            # Общий текст абзаца не меняется, сдвигаются только границы run
+            bounds = []
+            position = 0
+            for text in texts:
+                bounds.append((position, position + len(text)))
+                position += len(text)
+
+    def compile(self) -> None:
+        body = self.document.element.body
+        for paragraph in body.iter(qn('w:p')):
+            self.merge_split_placeholders(paragraph)
+
+        for run_index, run in enumerate(self.iter_runs(self.document)):
+            text = run.text
+            if '{' not in text and 'QRCodeDataSigned' not in text:
+                continue
+
+            tokens = []
+            for match in PLACEHOLDER_PATTERN.finditer(text):
+                name = match.group('name') or match.group('bare')
+                if (name, match.group(0)) not in tokens:
+                    tokens.append((name, match.group(0)))
+            if tokens:
+                self.slots.append((run_index, tokens))
+
+    def copy_document(self):
+        with self._lock:
+            return copy.deepcopy(self.document)
+
+    @staticmethod
+    def build_slot(document, run_element) -> DocxSlot:
+        paragraph_element = run_element.getparent()
+        paragraph = Paragraph(paragraph_element, document._body)
+
+        cell = None
+        ancestor = paragraph_element.getparent()
+        while ancestor is not None and ancestor.tag != qn('w:body'):
+            if ancestor.tag == qn('w:tc'):
+                cell = _Cell(ancestor, document._body)
+                break
+            ancestor = ancestor.getparent()
+
+        return DocxSlot(document, Run(run_element, paragraph), paragraph, cell)
+
+    def render(self, values, callbacks=None):
+        """
+            Готовый документ: копия шаблона с подстановками.
+            values - {имя плейсхолдера: текст} (или объект с методом get), отсутствующие остаются как есть.
+            callbacks - {имя плейсхолдера: функция(slot)} для картинок и таблиц; вызываются после удаления плейсхолдера.
+        """
+
+        callbacks = callbacks or {}
+        document = self.copy_document()
+        runs = list(self.iter_runs(document))
+
+        deferred = []
+        for run_index, tokens in self.slots:
+            run_element = runs[run_index]
+            text = run_element.text
+            changed = False
+            for name, token in tokens:
+                if name in callbacks:
+                    text = text.replace(token, '')
+                    deferred.append((name, run_element))
+                    changed = True
+                    continue
+
+                value = values.get(name)
+                if value is not None:
+                    text = text.replace(token, str(value))
+                    changed = True
+            if changed:
+                run_element.text = text
+
+        for name, run_element in deferred:
+            callbacks[name](self.build_slot(document, run_element))
+
+        return document
+
+
+def picture_callback(image, size):
+    """ Обработчик плейсхолдера картинки (QR-кода) для CompiledDocxTemplate.render, size - сторона в дюймах """
+
+    def callback(slot):
+        if image:
+            slot.run.add_picture(BytesIO(image), width=Inches(size), height=Inches(size))
+    return callback
+
+
+class DocxTemplateCache:
+    """
+        Шаблоны в памяти процесса, ключ - абсолютный путь к файлу.
+        Байты и скомпилированный шаблон читаются с диска один раз, после замены файла нужен invalidate(path).
+    """
+
+    _bytes = {}
+    _digests = {}
+    _templates = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def load_bytes(cls, path) -> bytes:
+        key = os.path.abspath(path)
+        docx_bytes = cls._bytes.get(key)
+        if docx_bytes is None:
+            with open(key, 'rb') as docx_file:
+                docx_bytes = docx_file.read()
+            cls._bytes[key] = docx_bytes
+        return docx_bytes
+
+    @classmethod
+    def get_digest(cls, path) -> str:
+        """ sha256 байтов шаблона - версия шаблона для ключей кэша готовых документов """
+
+        key = os.path.abspath(path)
+        digest = cls._digests.get(key)
+        if digest is None:
+            digest = hashlib.sha256(cls.load_bytes(key)).hexdigest()
+            cls._digests[key] = digest
+        return digest
+
+    @classmethod
+    def get(cls, path) -> CompiledDocxTemplate:
+        key = os.path.abspath(path)
+        template = cls._templates.get(key)
+        if template is None:
+            with cls._lock:
+                template = cls._templates.get(key)
+                if template is None:
+                    template = CompiledDocxTemplate(cls.load_bytes(key))
+                    cls._templates[key] = template
+        return template
+
+    @classmethod
+    def invalidate(cls, path) -> None:
+        key = os.path.abspath(path)
+        with cls._lock:
+            cls._bytes.pop(key, None)
+            cls._digests.pop(key, None)
+            cls._templates.pop(key, None)
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._bytes = {}
+            cls._digests = {}
+            cls._templates = {}
+
+
+class ContractDocumentValues:
+    """
+        Значения переменных договора (ContractVariable и служебные тексты).
+        Считаются лениво: только для плейсхолдеров, которые есть в шаблоне.
+    """
+
+    def __init__(self, contract, student, parent, amount_with_discount=0, dop_amount=0) -> None:
+        self.contract = contract
+        self.student = student
+        self.parent = parent
+        self.amount_with_discount = amount_with_discount or 0
+        self.dop_amount = dop_amount or 0
+        self._factories = None
+        self._values = {}
+
+    @property
+    def month(self):
+        return self.contract.ContractDate.month if self.contract.ContractDate else None
+
+    def month_in(self, lang):
+        if self.month is None:
+            return ''
+        return translate_month(self.month, lang)
+
+    def passport(self, lang):
+        parent = self.parent
+        issued_by = parent.issued_by
+        if lang == 'ru':
+            issued_by = 'Не указано' if '?' in str(issued_by) else issued_by
+            return f'Удостоверение личности: №{parent.num_of_doc}, Орган выдачи: {issued_by}, Дата выдачи: {parent.issue_date}'
+        if lang == 'kz':
+            issued_by = 'Көрсетілмеген' if '?' in str(issued_by) else issued_by
+            return f'Жеке куәлік: №{parent.num_of_doc}, Берген орган: {issued_by}, Берілген күні: {parent.issue_date}'
+        issued_by = 'Not specified' if '?' in str(issued_by) else issued_by
+        return f'ID: No.{parent.num_of_doc}, Issued by: {issued_by}, Issue date: {parent.issue_date}'
+
+    def date(self, date_format, days=0):
+        if not self.contract.ContractDate:
+            return ''
+        return (self.contract.ContractDate + timedelta(days=days)).strftime(date_format)
+
+    def get_factories(self) -> dict:
+        contract, student, parent = self.contract, self.student, self.parent
+
+        amount = int(contract.ContractAmount or 0)
+        contract_sum = int(getattr(contract, 'ContractSum', 0) or 0)
+        contr_sum = int(getattr(contract, 'ContSum', 0) or 0)
+        amount_with_discount = int(self.amount_with_discount)
+        dop_amount = int(self.dop_amount)
+
+        return {
+            'ContractNum': lambda: str(contract.ContractNum or ''),
+            'ContractYear': lambda: self.date('%Y'),
+            'ContractYearFinish': lambda: self.date('%Y', days=365),
+            'ContractDate': lambda: self.date('%d.%m.%Y'),
+            'ContractDay': lambda: self.date('%d'),
+            'ContractMonthRUS': lambda: self.month_in('ru'),
+            'ContractMonthKAZ': lambda: self.month_in('kk'),
+            'ContractMonthENG': lambda: self.month_in('en'),
+            'EduYear': lambda: str(contract.EduYearID.sEduYear) if contract.EduYearID else '',
+            'ParentFullName': lambda: str(parent.full_name or ''),
+            'StudentFullName': lambda: str(student.full_name or ''),
+            'StudentIIN': lambda: str(student.iin or ''),
+            'StudentAddress': lambda: str(parent.address or ''),
+            'StudentPhoneNumber': lambda: str(student.phone) if student.phone else '-',
+            'ParentAddress': lambda: str(parent.address or ''),
+            'ParentPhoneNumber': lambda: str(parent.phone or ''),
+            'ParentIIN': lambda: str(parent.iin or ''),
+            'ParentPassport': lambda: self.passport('ru'),
+            'ParentPassportKAZ': lambda: self.passport('kz'),
+            'ParentPassportENG': lambda: self.passport('en'),
+            'ContractAmount': lambda: str(amount),
+            'ContractAmountWords': lambda: amount_to_words(amount, 'ru'),
+            'ContractAmountWordsKaz': lambda: amount_to_words(amount, 'kz'),
+            'ContractAmountWordsEng': lambda: amount_to_words(amount, 'en'),
+            'ContractSum': lambda: str(contract_sum),
+            'ContractSumWords': lambda: amount_to_words(contract_sum, 'ru'),
+            'ContractSumWordsKaz': lambda: amount_to_words(contract_sum, 'kz'),
+            'ContractSumWordsEng': lambda: amount_to_words(contract_sum, 'en'),
+            'ContractAmountWithDiscount': lambda: str(amount_with_discount),
+            'ContractAmountWithDiscountWords': lambda: amount_to_words(amount_with_discount, 'ru'),
+            'ContractAmountWithDiscountWordsKaz': lambda: amount_to_words(amount_with_discount, 'kz'),
+            'ContractAmountWithDiscountWordsEng': lambda: amount_to_words(amount_with_discount, 'en'),
+            'ContractDopAmount': lambda: str(dop_amount),
+            'ContractDopAmountWords': lambda: amount_to_words(dop_amount, 'ru'),
+            'ContractDopAmountWordsKaz': lambda: amount_to_words(dop_amount, 'kz'),
+            'ContractContr': lambda: str(contr_sum),
+            'ContractContrWords': lambda: amount_to_words(contr_sum, 'ru'),
+            'ContractContrWordsKaz': lambda: amount_to_words(contr_sum, 'kz'),
+            'ContractContrWordsEng': lambda: amount_to_words(contr_sum, 'en'),
+            'QRCodeTextRus': lambda: QR_CODE_TEXT_RUS,
+            'QRCodeTextKaz': lambda: QR_CODE_TEXT_KAZ,
+            'police_kaz': lambda: POLICE_KAZ,
+            'police_rus': lambda: POLICE_RUS,
+        }
+
+    def get(self, name):
+        if name not in self._values:
+            if self._factories is None:
+                self._factories = self.get_factories()
+            factory = self._factories.get(name)
+            self._values[name] = factory() if factory else None
+        return self._values[name]
+
+    def to_dict(self, names=None) -> dict:
+        names = names or [variable.strip('{}') for variable in ContractVariable.values]
+        return {name: self.get(name) for name in names}
@@ -3,7 +3,6 @@ import datetime
 from cryptography.hazmat._oid import NameOID
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import padding
-from django.core.files import File
 from django.http import HttpResponse, JsonResponse
 import qrcode
 from xml.etree import ElementTree as ET
@@ -15,9 +14,11 @@ import base64
 from rest_framework import status
 from rest_framework.response import Response
 
-from apps.contract.models import ContractFileUser, ContractMS, ContractStatusMS, ContractFoodMS, ContractDriverMS, \
-    ContractDopMS, ContractDopFileUser
+from apps.contract.models import ContractDopMS, ContractRenderJob
 from apps.contract.services import ContractDownloadService
+from apps.contract.services_locator import ContractLocator
+from apps.contract.services_reference import ReferenceDataCache
+from apps.contract.services_render_jobs import ContractRenderJobService
 from project_sis import settings
 
 
@@ -173,8 +174,8 @@ class SignContractWithEDSService:
 
     def generate_qr_code(self, request, data, is_dop_contract):
         """
-            Генерация QR-кода с данными подписи
-            Изображение QR-кода сохраняется в формате SVG
+            Генерация QR-кода с данными подписи и постановка в очередь генерации договора с QR-кодами.
+            Возвращает задачу ContractRenderJob
         """
 
         qr_code = qrcode.QRCode(
@@ -198,16 +199,16 @@ class SignContractWithEDSService:
 
         try:
             contract_download_service = ContractDownloadService(contract_student=self.contract)
-            contract_download_service.generate_contract_with_qr_code(request,
-                                                                     contract_num=f'{self.contract}',
-                                                                     qr_code=buffered.getvalue(),
-                                                                     qr_code_director_omarov=qr_code_director_omarov,
-                                                                     qr_code_director_serikov=qr_code_director_serikov,
-                                                                     is_dop_contract=is_dop_contract)
+            job = contract_download_service.generate_contract_with_qr_code(request,
+                                                                           contract_num=f'{self.contract}',
+                                                                           qr_code=buffered.getvalue(),
+                                                                           qr_code_director_omarov=qr_code_director_omarov,
+                                                                           qr_code_director_serikov=qr_code_director_serikov,
+                                                                           is_dop_contract=is_dop_contract)
         except Exception as e:
             raise ValueError(f'{e}')
 
-        return HttpResponse(buffered.getvalue(), content_type="image/svg+xml")
+        return job
 
     def generate_qr_code_data_signed(self, contract_num):
         """ Генерация QR-кода с данными подписанного договора """
@@ -297,6 +298,27 @@ class SignContractWithEDSService:
 
         return JsonResponse(data, status=status.HTTP_200_OK, safe=False)
 
+    @staticmethod
+    def mark_signed(contract_num, is_dop_contract) -> None:
+        """ Статус «Подписан» договору или доп. соглашению в статусе «На рассмотрении» (после формирования PDF) """
+
+        signed = ReferenceDataCache.get_by_name(ReferenceDataCache.STATUS, 'Подписан')
+
+        if is_dop_contract:
+            contract_dop = ContractDopMS.objects.using('ms_sql').get(agreement_id__ContractNum=contract_num)
+            if getattr(contract_dop.status_id, 'sStatusName', None) != 'На рассмотрении':
+                raise ValueError('Текущий статус договора должен быть - «На рассмотрении»')
+            contract_dop.status_id = signed
+            contract_dop.save()
+        else:
+            contract = ContractLocator.get_contract_or_raise(contract_num)
+            if contract.ContractStatusID.sStatusName != 'На рассмотрении':
+                raise ValueError('Текущий статус договора должен быть - «На рассмотрении»')
+            contract.ContractStatusID = signed
+            contract.save()
+
+        ContractLocator.invalidate(contract_num)
+
     def sign_contract_document(self, request, contract_num, is_dop_contract) -> HttpResponse | Response:
         """ Подпись договора """
 
@@ -325,16 +347,9 @@ class SignContractWithEDSService:
             except ContractDopMS.DoesNotExist:
                 return Response({'error': 'Договор не найден!'}, status=status.HTTP_403_FORBIDDEN)
         else:
-            try:
-                contract = ContractMS.objects.using('ms_sql').get(ContractNum=contract_num)
-            except ContractMS.DoesNotExist:
-                try:
-                    contract = ContractFoodMS.objects.using('ms_sql').get(ContractNum=contract_num)
-                except ContractFoodMS.DoesNotExist:
-                    try:
-                        contract = ContractDriverMS.objects.using('ms_sql').get(ContractNum=contract_num)
-                    except ContractDriverMS.DoesNotExist:
-                        contract = None
+            contract = ContractLocator.get_contract(contract_num)
+            if contract is None:
+                return Response({'error': 'Договор не найден!'}, status=status.HTTP_403_FORBIDDEN)
 
         if is_dop_contract:
             contract_dop = ContractDopMS.objects.using('ms_sql').get(agreement_id__ContractNum=contract_num)
@@ -345,8 +360,8 @@ class SignContractWithEDSService:
 
             if contract_dop_status is not None and contract_dop_status == 'На рассмотрении':
                 try:
-                    qr_code = self.generate_qr_code(request, {"data": xml_data},
-                                                    is_dop_contract=is_dop_contract)
+                    render_job = self.generate_qr_code(request, {"data": xml_data},
+                                                       is_dop_contract=is_dop_contract)
                 except Exception as e:
                     return Response({"error": str(e)}, status=status.HTTP_403_FORBIDDEN)
             else:
@@ -355,40 +370,23 @@ class SignContractWithEDSService:
         else:
             if contract.ContractStatusID.sStatusName == 'На рассмотрении' and contract is not None:
                 try:
-                    qr_code = self.generate_qr_code(request, {xml_data}, is_dop_contract=is_dop_contract)
+                    render_job = self.generate_qr_code(request, {xml_data}, is_dop_contract=is_dop_contract)
                 except Exception as e:
                     return Response({"error": str(e)}, status=status.HTTP_403_FORBIDDEN)
             else:
                 print('Текущий статус договора должен быть - «На рассмотрении»')
                 return Response({'error': 'Текущий статус договора должен быть - «На рассмотрении»'}, status=status.HTTP_403_FORBIDDEN)
 
-        if not qr_code:
+        if not render_job:
             print('Ошибка при генерации QR-кода')
             return Response({"error": "Ошибка при генерации QR-кода"}, status=status.HTTP_403_FORBIDDEN)
 
-        if is_dop_contract:
-            contract_dop = ContractDopMS.objects.using('ms_sql').get(agreement_id__ContractNum=contract_num)
-            contract_dop_status = contract_dop.status_id.sStatusName
-            if contract_dop_status is not None and contract_dop_status == 'На рассмотрении':
-                contract_dop.status_id = ContractStatusMS.objects.using('ms_sql').get(sStatusName='Подписан')
-                contract_dop.save()
-        else:
-            if contract is not None:
-                if contract.ContractStatusID.sStatusName != 'На рассмотрении':
-                    print('Текущий статус договора должен быть - «На рассмотрении»')
-                    return Response({'error': 'Текущий статус договора должен быть - «На рассмотрении»'}, status=status.HTTP_403_FORBIDDEN)
-                contract.ContractStatusID = ContractStatusMS.objects.using('ms_sql').get(sStatusName='Подписан')
-                contract.save()
-            else:
-                print('Договор не найден!')
-                return Response({'error': 'Договор не найден!'}, status=status.HTTP_403_FORBIDDEN)
-
-        if is_dop_contract:
-            signed_contract = ContractDopFileUser.objects.filter(contractNum=contract_num).last().file.path
-        else:
-            signed_contract = ContractFileUser.objects.filter(contractNum=contract_num).last().file.path
+        # PDF с QR-кодами формируется в фоне: файл отдается, если готов за ?wait= секунд, иначе 202 с id задачи.
+        # Статус «Подписан» ставит сама задача после формирования PDF (mark_signed)
+        job = ContractRenderJobService.wait(render_job, ContractRenderJobService.get_wait(request))
+        if job.status != ContractRenderJob.SUCCESS:
+            return ContractDownloadService.job_response(job)
 
-        with open(signed_contract, 'rb') as file:
-            response = HttpResponse(File(file), content_type='application/pdf')
-            response['Content-Disposition'] = f'attachment; filename="{contract_num}.pdf"'
-            return response
+        # Файл отдается потоком из хранилища, без чтения целиком в память
+        contract_file = ContractDownloadService.get_contract_file(contract_num, is_dop_contract)
+        return ContractDownloadService.file_response(contract_file, contract_num)
@@ -0,0 +1,146 @@
+from collections import defaultdict
+
+from .models import ContractDiscountMS, TransactionMS, ContractFoodDiscountMS, TransactionFoodMS, \
+    ContractFoodMonthPayMS, TransactionDriverMS
+
+
+class ContractEnrichmentService:
+    """
+        Пакетное обогащение данных договоров: скидки, история оплат, график платежей.
+        Каждая таблица читается одним запросом на весь набор договоров,
+        результат группируется по id договора и раскладывается по serializer.data за один проход.
+    """
+
+    STUDY = 'study'
+    FOOD = 'food'
+    DRIVER = 'driver'
+
+    # MS SQL ограничивает количество параметров в запросе (2100)
+    CHUNK_SIZE = 2000
+
+    SOURCES = {
+        STUDY: {
+            'discount_model': ContractDiscountMS,
+            'transaction_model': TransactionMS,
+            'transaction_contract_field': 'agreement_id',
+            'transaction_related': ('payment_type', 'bank_id'),
+            'month_pay_model': None,
+        },
+        FOOD: {
+            'discount_model': ContractFoodDiscountMS,
+            'transaction_model': TransactionFoodMS,
+            'transaction_contract_field': 'contract_id',
+            'transaction_related': ('bank_id',),
+            'month_pay_model': ContractFoodMonthPayMS,
+        },
+        DRIVER: {
+            'discount_model': None,
+            'transaction_model': TransactionDriverMS,
+            'transaction_contract_field': 'ContractID',
+            'transaction_related': ('BankID',),
+            'month_pay_model': None,
+        },
+    }
+
+    def __init__(self, contract_type=STUDY) -> None:
+        self.contract_type = contract_type
+        self.source = self.SOURCES[contract_type]
+
+    def _chunks(self, contract_ids):
+        contract_ids = list(dict.fromkeys(contract_ids))
+        for i in range(0, len(contract_ids), self.CHUNK_SIZE):
+            yield contract_ids[i:i + self.CHUNK_SIZE]
+
+    def group_by_contract(self, model, contract_field, contract_ids, related=()) -> dict:
+        """ Строки таблицы по набору договоров: {id договора: [строки в порядке id]} """
+
+        grouped = defaultdict(list)
+        for chunk in self._chunks(contract_ids):
+            queryset = model.objects.using('ms_sql').filter(**{f'{contract_field}__in': chunk}).order_by('id')
+            if related:
+                queryset = queryset.select_related(*related)
+
+            for row in queryset:
+                grouped[getattr(row, f'{contract_field}_id')].append(row)
+
+        return grouped
+
+    @staticmethod
+    def discount_to_dict(discount) -> dict:
+        return {
+            "DiscountID": str(discount.DiscountID),
+            "DiscountName": str(discount.DiscountID.sDiscountName),
+            "DiscountPercent": str(discount.DiscountID.iDiscountPercent),
+            "DiscountType": str(discount.DiscountID.iDiscountType.sDiscountType),
+            "DiscountSum": str(discount.DiscountSum)
+        }
+
+    def transaction_to_dict(self, pay) -> dict:
+        if self.contract_type == self.DRIVER:
+            return {
+                "Amount": str(pay.Amount),
+                "Description": str(pay.Description),
+                "Date": str(pay.TransactionDate.strftime("%d.%m.%Y")),
+                "Bank": str(pay.BankID)
+            }
+
+        transaction = {
+            "Amount": str(pay.amount),
+            "Description": str(pay.description),
+            "Date": str(pay.trans_date.strftime("%d.%m.%Y")),
+            "Bank": str(pay.bank_id)
+        }
+        if self.contract_type == self.STUDY:
+            transaction["PaymentType"] = str(pay.payment_type.sPaymentType)
+
+        return transaction
+
+    @staticmethod
+    def month_pay_to_dict(pay) -> dict:
+        return {
+            "MonthAmount": str(pay.MonthAmount),
+            "MonthSum": str(pay.MonthSum),
+            "PayDateM": str(pay.PayDateM.strftime("%d.%m.%Y"))
+        }
+
+    def set_discounts(self, serializer_data, contract_ids) -> None:
+        """ Скидка договора. Если скидок несколько - берется последняя """
+
+        discounts = self.group_by_contract(
+            self.source['discount_model'], 'ContractID', contract_ids,
+            related=('DiscountID__iDiscountType',)
+        )
+
+        for ser in serializer_data:
+            contract_discounts = discounts.get(ser['id'])
+            ser['Discount'] = self.discount_to_dict(contract_discounts[-1]) if contract_discounts else None
+
+    def set_history_transactions(self, serializer_data, contract_ids) -> None:
+        transactions = self.group_by_contract(
+            self.source['transaction_model'], self.source['transaction_contract_field'], contract_ids,
+            related=self.source['transaction_related']
+        )
+
+        for ser in serializer_data:
+            ser['HistoryTransactions'] = [self.transaction_to_dict(pay) for pay in transactions.get(ser['id'], [])]
+
+    def set_detail_contract(self, serializer_data, contract_ids) -> None:
+        month_pays = self.group_by_contract(self.source['month_pay_model'], 'ContractID', contract_ids)
+
+        for ser in serializer_data:
+            ser['DetailContract'] = [self.month_pay_to_dict(pay) for pay in month_pays.get(ser['id'], [])]
+
+    def enrich(self, serializer_data) -> None:
+        """ Дополнение serializer.data всеми доступными для типа договора данными """
+
+        contract_ids = [ser['id'] for ser in serializer_data]
+        if not contract_ids:
+            return
+
+        if self.source['discount_model'] is not None:
+            self.set_discounts(serializer_data, contract_ids)
+
+        self.set_history_transactions(serializer_data, contract_ids)
+
+        if self.source['month_pay_model'] is not None:
+            self.set_detail_contract(serializer_data, contract_ids)
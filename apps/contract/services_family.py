@@ -0,0 +1,130 @@
+from datetime import date
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import ContractMS, ContractFoodMS, ContractDriverMS, StudentMS
+from .serializers.contract_family import FamilyContractSerializer, FamilyContractFoodSerializer, \
+    FamilyContractDriverSerializer, FamilyStudentSerializer
+from .services_arrears import ContractArrearsLedgerService
+from .services_enrichment import ContractEnrichmentService
+from .services_reference import ReferenceDataCache
+
+
+class FamilyDashboardService:
+    """
+        Сводка по всем договорам (обучение, питание, развозка) всех детей родителя.
+        Каждая таблица читается одним запросом на всю семью,
+        поэтому количество запросов не зависит от количества детей и договоров.
+    """
+
+    STUDY = ContractArrearsLedgerService.STUDY
+    FOOD = ContractArrearsLedgerService.FOOD
+    DRIVER = ContractArrearsLedgerService.DRIVER
+
+    # Договоры те же, что отдают API study/food/driver
+    CONTRACT_SOURCES = {
+        STUDY: {
+            'model': ContractMS,
+            'min_year': 2019,
+            'serializer': FamilyContractSerializer,
+        },
+        FOOD: {
+            'model': ContractFoodMS,
+            'min_year': 2021,
+            'serializer': FamilyContractFoodSerializer,
+        },
+        DRIVER: {
+            'model': ContractDriverMS,
+            'min_year': 2021,
+            'serializer': FamilyContractDriverSerializer,
+        },
+    }
+
+    REFERENCE_FIELDS = {
+        'ContractStatusID': ReferenceDataCache.STATUS,
+        'PaymentTypeID': ReferenceDataCache.PAYMENT_TYPE,
+        'EduYearID': ReferenceDataCache.EDU_YEAR,
+    }
+
+    @staticmethod
+    def get_login_format(user):
+        login = str(user.login)
+        return login.split('+7')[1] if login.startswith('+7') else login
+
+    def get_students(self, user):
+        return list(StudentMS.objects.using('ms_sql').filter(parent_id__phone=self.get_login_format(user)))
+
+    @staticmethod
+    def get_next_payments(contract_type, contract_ids) -> dict:
+        """ Ближайший платеж по графику: {id договора: {PayDateM, MonthSum}} """
+
+        source = ContractArrearsLedgerService.SOURCES[contract_type]
+        contract_field = source['month_pay_contract_field']
+        amount_field = source['month_pay_amount_field']
+
+        rows = source['month_pay_model'].objects.using('ms_sql') \
+            .filter(**{f'{contract_field}__in': contract_ids}, PayDateM__gte=date.today()) \
+            .order_by(contract_field, 'PayDateM') \
+            .values_list(contract_field, 'PayDateM', amount_field)
+
+        next_payments = {}
+        for contract_id, pay_date, amount in rows:
+            if contract_id not in next_payments:
+                next_payments[contract_id] = {
+                    "PayDateM": str(pay_date.strftime("%d.%m.%Y")),
+                    "MonthSum": str(amount)
+                }
+
+        return next_payments
+
+    def get_contracts(self, contract_type, student_ids) -> list:
+        """ Договоры одного типа для всех детей с задолженностью, ближайшим платежом и историей оплат """
+
+        source = self.CONTRACT_SOURCES[contract_type]
+        contracts = list(source['model'].objects.using('ms_sql')
+                         .filter(StudentID__in=student_ids, ContractDate__year__gt=source['min_year']))
+        ReferenceDataCache.attach_many(contracts, self.REFERENCE_FIELDS)
+
+        serializer_data = []
+        for contract in contracts:
+            contract_data = dict(source['serializer'](contract).data)
+            contract_data['StudentID'] = contract.StudentID_id
+            serializer_data.append(contract_data)
+
+        if not serializer_data:
+            return serializer_data
+
+        contract_ids = [contract_data['id'] for contract_data in serializer_data]
+        arrears = ContractArrearsLedgerService(contract_type).get_arrears(contract_ids)
+        next_payments = self.get_next_payments(contract_type, contract_ids)
+
+        for contract_data in serializer_data:
+            contract_data['Arrears'] = arrears.get(contract_data['id'], 0)
+            contract_data['NextPayment'] = next_payments.get(contract_data['id'])
+
+        ContractEnrichmentService(contract_type).enrich(serializer_data)
+
+        return serializer_data
+
+    def get_family_dashboard(self, user) -> Response:
+        students = self.get_students(user)
+        if not students:
+            return Response({'error': 'Students not found'}, status=status.HTTP_403_FORBIDDEN)
+
+        student_ids = [student.id for student in students]
+        students_data = {student.id: dict(FamilyStudentSerializer(student).data) for student in students}
+        for student_data in students_data.values():
+            for contract_type in self.CONTRACT_SOURCES:
+                student_data[contract_type] = []
+
+        total_arrears = 0
+        for contract_type in self.CONTRACT_SOURCES:
+            for contract_data in self.get_contracts(contract_type, student_ids):
+                students_data[contract_data['StudentID']][contract_type].append(contract_data)
+                total_arrears += contract_data['Arrears']
+
+        return Response({
+            'students': list(students_data.values()),
+            'TotalArrears': total_arrears
+        })
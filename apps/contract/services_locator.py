@@ -0,0 +1,291 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Value, CharField, BooleanField, Exists, OuterRef
+from django.utils import timezone
+
+from .models import ContractMS, ContractFoodMS, ContractDriverMS, ContractDopMS, ContractIndex, ContractArrearsLedger
+
+logger = logging.getLogger(__name__)
+
+
+class ContractLocation:
+    """ Результат поиска договора по номеру: тип, id и основные атрибуты без загрузки самого договора """
+
+    def __init__(self, contract_num, contract_type, contract_id, school_bin=None, status_id=None,
+                 has_dop_agreement=False) -> None:
+        self.contract_num = contract_num
+        self.contract_type = contract_type
+        self.contract_id = contract_id
+        self.school_bin = school_bin
+        self.status_id = status_id
+        self.has_dop_agreement = has_dop_agreement
+
+    @property
+    def model(self):
+        return ContractLocator.MODELS[self.contract_type]
+
+    def get_contract(self):
+        """ Сам договор из MS SQL - один запрос по первичному ключу """
+
+        return self.model.objects.using('ms_sql').filter(id=self.contract_id).first()
+
+    def to_dict(self) -> dict:
+        return {
+            'contract_num': self.contract_num,
+            'contract_type': self.contract_type,
+            'contract_id': self.contract_id,
+            'school_bin': self.school_bin,
+            'status_id': self.status_id,
+            'has_dop_agreement': self.has_dop_agreement,
+        }
+
+
+class ContractLocator:
+    """
+        Поиск договора по номеру во всех трех таблицах (обучение, питание, развозка).
+        Порядок чтения: Redis -> индекс ContractIndex в Postgres -> один UNION-запрос в MS SQL.
+        Индекс обновляется задачей sync_contract_index и дописывается при промахе.
+        Статус и БИН школы в индексе могут устареть: строки старше CONTRACT_INDEX_TTL не используются,
+        такой номер перечитывается из MS SQL и строки индекса обновляются.
+    """
+
+    STUDY = ContractArrearsLedger.STUDY
+    FOOD = ContractArrearsLedger.FOOD
+    DRIVER = ContractArrearsLedger.DRIVER
+
+    MODELS = {
+        STUDY: ContractMS,
+        FOOD: ContractFoodMS,
+        DRIVER: ContractDriverMS,
+    }
+
+    CACHE_PREFIX = 'contract_locator'
+    CACHE_TIMEOUT = 10 * 60
+    # Отсутствующий номер кэшируется ненадолго, чтобы повторные запросы не шли в MS SQL
+    MISS_TIMEOUT = 60
+    MISS = 'missing'
+
+    @classmethod
+    def get_cache_key(cls, contract_num) -> str:
+        return f'{cls.CACHE_PREFIX}_{contract_num}'
+
+    @classmethod
+    def get_priority(cls, contract_num) -> tuple:
+        """ Буква в номере подсказывает таблицу: Д - обучение, П - питание, Р - развозка """
+
+        if 'Д' in contract_num:
+            return cls.STUDY, cls.FOOD, cls.DRIVER
+        if 'П' in contract_num:
+            return cls.FOOD, cls.STUDY, cls.DRIVER
+        if 'Р' in contract_num:
+            return cls.DRIVER, cls.STUDY, cls.FOOD
+        return cls.STUDY, cls.FOOD, cls.DRIVER
+
+    @classmethod
+    def choose(cls, contract_num, locations):
+        """ Из совпадений во всех таблицах выбирается одно по приоритету типа, затем по наибольшему id """
+
+        if not locations:
+            return None
+
+        priority = cls.get_priority(contract_num)
+        return sorted(locations, key=lambda location: (priority.index(location.contract_type), -location.contract_id))[0]
+
+    @classmethod
+    def get_source_queryset(cls, contract_type):
+        """ Поля индекса из таблицы договоров одного типа """
+
+        model = cls.MODELS[contract_type]
+        if contract_type == cls.STUDY:
+            has_dop_agreement = Exists(ContractDopMS.objects.using('ms_sql').filter(agreement_id=OuterRef('pk')))
+        else:
+            has_dop_agreement = Value(False, output_field=BooleanField())
+
+        return model.objects.using('ms_sql').annotate(
+            contract_type=Value(contract_type, output_field=CharField()),
+            has_dop_agreement=has_dop_agreement,
+        ).values('contract_type', 'id', 'ContractNum', 'SchoolID__sBin', 'ContractStatusID', 'has_dop_agreement')
+
+    @staticmethod
+    def row_to_location(row) -> ContractLocation:
+        return ContractLocation(
+            contract_num=row['ContractNum'],
+            contract_type=row['contract_type'],
+            contract_id=row['id'],
+            school_bin=row['SchoolID__sBin'],
+            status_id=row['ContractStatusID'],
+            has_dop_agreement=bool(row['has_dop_agreement']),
+        )
+
+    @classmethod
+    def query_ms_sql(cls, contract_num) -> list:
+        """ Все совпадения номера в трех таблицах одним запросом """
+
+        querysets = [
+            cls.get_source_queryset(contract_type).filter(ContractNum=contract_num)
+            for contract_type in (cls.STUDY, cls.FOOD, cls.DRIVER)
+        ]
+        rows = querysets[0].union(*querysets[1:], all=True)
+
+        return [cls.row_to_location(row) for row in rows]
+
+    @staticmethod
+    def query_index(contract_num) -> list:
+        """ Строки индекса номера, синхронизированные не раньше CONTRACT_INDEX_TTL назад """
+
+        fresh_since = timezone.now() - timedelta(seconds=settings.CONTRACT_INDEX_TTL)
+        return [
+            ContractLocation(
+                contract_num=row.contract_num,
+                contract_type=row.contract_type,
+                contract_id=row.contract_id,
+                school_bin=row.school_bin,
+                status_id=row.status_id,
+                has_dop_agreement=row.has_dop_agreement,
+            )
+            for row in ContractIndex.objects.filter(contract_num=contract_num, synced_at__gte=fresh_since)
+        ]
+
+    @classmethod
+    def save_to_index(cls, locations) -> None:
+        """ Запись найденных договоров в индекс (добавление или обновление по типу и id) """
+
+        now = timezone.now()
+        with transaction.atomic():
+            for location in locations:
+                ContractIndex.objects.update_or_create(
+                    contract_type=location.contract_type,
+                    contract_id=location.contract_id,
+                    defaults={
+                        'contract_num': location.contract_num,
+                        'school_bin': location.school_bin,
+                        'status_id': location.status_id,
+                        'has_dop_agreement': location.has_dop_agreement,
+                        'synced_at': now,
+                    }
+                )
+
+    @classmethod
+    def locate(cls, contract_num):
+        """ Тип и id договора по номеру или None. Не больше одного запроса в MS SQL """
+
+        if not contract_num:
+            return None
+        contract_num = str(contract_num)
+
+        cached = cache.get(cls.get_cache_key(contract_num))
+        if cached == cls.MISS:
+            return None
+        if cached is not None:
+            return ContractLocation(**cached)
+
+        location = cls.choose(contract_num, cls.query_index(contract_num))
+        if location is None:
+            locations = cls.query_ms_sql(contract_num)
+            if locations:
+                cls.save_to_index(locations)
+            else:
+                # Устаревшие строки номера, которого больше нет в MS SQL
+                ContractIndex.objects.filter(contract_num=contract_num).delete()
+            location = cls.choose(contract_num, locations)
+
+        if location is None:
+            cache.set(cls.get_cache_key(contract_num), cls.MISS, timeout=cls.MISS_TIMEOUT)
+        else:
+            cache.set(cls.get_cache_key(contract_num), location.to_dict(), timeout=cls.CACHE_TIMEOUT)
+
+        return location
+
+    @classmethod
+    def get_contract(cls, contract_num):
+        """ Договор любого типа по номеру или None """
+
+        location = cls.locate(contract_num)
+        if location is None:
+            return None
+
+        return location.get_contract()
+
+    @classmethod
+    def get_contract_or_raise(cls, contract_num):
+        """ Договор любого типа по номеру. Если не найден - ObjectDoesNotExist, как у .get() """
+
+        contract = cls.get_contract(contract_num)
+        if contract is None:
+            raise ObjectDoesNotExist(f'Contract {contract_num} does not exist')
+
+        return contract
+
+    @classmethod
+    def invalidate(cls, contract_num) -> None:
+        """ Сброс кэша и строки индекса номера, например после смены статуса договора """
+
+        cache.delete(cls.get_cache_key(contract_num))
+        ContractIndex.objects.filter(contract_num=contract_num).delete()
+
+    @classmethod
+    def sync(cls) -> int:
+        """ Полная синхронизация индекса со всеми тремя таблицами MS SQL """
+
+        existing = {(row.contract_type, row.contract_id): row for row in ContractIndex.objects.all()}
+        now = timezone.now()
+        rows_to_create = []
+        rows_to_update = []
+        unchanged_ids = []
+        changed_nums = set()
+        seen = set()
+
+        for contract_type in (cls.STUDY, cls.FOOD, cls.DRIVER):
+            for row in cls.get_source_queryset(contract_type).iterator():
+                if not row['ContractNum']:
+                    continue
+
+                location = cls.row_to_location(row)
+                key = (location.contract_type, location.contract_id)
+                seen.add(key)
+
+                index_row = existing.get(key)
+                if index_row is None:
+                    index_row = ContractIndex(contract_type=location.contract_type, contract_id=location.contract_id)
+                    rows_to_create.append(index_row)
+                elif (index_row.contract_num, index_row.school_bin, index_row.status_id,
+                      index_row.has_dop_agreement) == (location.contract_num, location.school_bin,
+                                                       location.status_id, location.has_dop_agreement):
+                    # Строка актуальна: обновляется только время синхронизации, чтобы она не устарела по TTL
+                    unchanged_ids.append(index_row.id)
+                    continue
+                else:
+                    changed_nums.add(index_row.contract_num)
+                    rows_to_update.append(index_row)
+
+                index_row.contract_num = location.contract_num
+                index_row.school_bin = location.school_bin
+                index_row.status_id = location.status_id
+                index_row.has_dop_agreement = location.has_dop_agreement
+                index_row.synced_at = now
+                changed_nums.add(location.contract_num)
+
+        removed = [row for key, row in existing.items() if key not in seen]
+        changed_nums.update(row.contract_num for row in removed)
+
+        with transaction.atomic():
+            ContractIndex.objects.bulk_create(rows_to_create, batch_size=1000, ignore_conflicts=True)
+            ContractIndex.objects.bulk_update(
+                rows_to_update, ['contract_num', 'school_bin', 'status_id', 'has_dop_agreement', 'synced_at'],
+                batch_size=1000
+            )
+            ContractIndex.objects.filter(id__in=[row.id for row in removed]).delete()
+            for start in range(0, len(unchanged_ids), 1000):
+                ContractIndex.objects.filter(id__in=unchanged_ids[start:start + 1000]).update(synced_at=now)
+
+        cache.delete_many([cls.get_cache_key(contract_num) for contract_num in changed_nums])
+
+        logger.info(f'Contract index synced: {len(rows_to_create)} added, {len(rows_to_update)} updated, '
+                    f'{len(removed)} removed')
+
+        return len(rows_to_create) + len(rows_to_update) + len(removed)
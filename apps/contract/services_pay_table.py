@@ -0,0 +1,83 @@
+import copy
+import threading
+
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from docx.oxml.table import CT_Tbl
+from docx.shared import Cm
+from docx.table import _Cell
+
+
+class PayTableBuilder:
+    """
+        Таблица графика платежей (w:tbl) одним XML-фрагментом вместо построчного add_row() python-docx.
+        add_row() на каждой строке заново собирает список ячеек всей таблицы, поэтому время растет квадратично.
+        Здесь прототип таблицы с заголовком и прототип строки строятся один раз на процесс,
+        при рендере - копия прототипа, строки копируются из прототипа строки с заменой текста,
+        готовый элемент вставляется на место плейсхолдера.
+    """
+
+    HEADERS = ('№', 'Сумма', 'Дата оплаты')
+    WIDTHS = (Cm(1.0), Cm(3.0), Cm(3.0))
+
+    _prototype = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def build_prototype(cls) -> tuple:
+        """ (w:tbl с заголовком, w:tr для строк данных) - та же разметка, что давал add_table() """
+
+        table = CT_Tbl.new_tbl(1, len(cls.HEADERS), sum(cls.WIDTHS))
+        for grid_col, width in zip(table.tblGrid.gridCol_lst, cls.WIDTHS):
+            grid_col.w = width
+
+        header = table.tr_lst[0]
+        for tc, width, text in zip(header.tc_lst, cls.WIDTHS, cls.HEADERS):
+            tc.width = width
+            _Cell(tc, None).text = text
+
+        return table, copy.deepcopy(header)
+
+    @classmethod
+    def get_prototype(cls) -> tuple:
+        if cls._prototype is None:
+            with cls._lock:
+                if cls._prototype is None:
+                    cls._prototype = cls.build_prototype()
+        return cls._prototype
+
+    @classmethod
+    def build(cls, rows):
+        """ rows - [(сумма, дата оплаты)], номер строки проставляется сам """
+
+        table_prototype, row_prototype = cls.get_prototype()
+        table = copy.deepcopy(table_prototype)
+
+        for index, (pay_sum, pay_date) in enumerate(rows, start=1):
+            row = copy.deepcopy(row_prototype)
+            for text, value in zip(row.iter(qn('w:t')), (index, pay_sum, pay_date)):
+                text.text = '' if value is None else str(value)
+            table.append(row)
+
+        return table
+
+    @classmethod
+    def insert(cls, slot, rows) -> None:
+        """
+            Таблица на месте абзаца с плейсхолдером (slot из CompiledDocxTemplate.render).
+            Если таблица оказалась последней в ячейке, после нее добавляется пустой абзац: Word требует абзац в конце w:tc.
+        """
+
+        paragraph = slot.paragraph._p
+        table = cls.build(rows)
+        paragraph.addnext(table)
+
+        parent = paragraph.getparent()
+        parent.remove(paragraph)
+
+        if parent.tag == qn('w:tc') and table.getnext() is None:
+            empty_paragraph = OxmlElement('w:p')
+            properties = paragraph.find(qn('w:pPr'))
+            if properties is not None:
+                empty_paragraph.append(copy.deepcopy(properties))
+            table.addnext(empty_paragraph)
@@ -0,0 +1,304 @@
+import logging
+import time
+from contextlib import contextmanager
+from io import BytesIO
+
+from django.core.cache import cache
+
+from .models import ContractMS
+from .services_converter import convert_docx_to_pdf
+from .services_docx import ContractDocumentValues, DocxTemplateCache, picture_callback
+from .services_documents import ContractDocumentStore
+from .services_pay_table import PayTableBuilder
+from .services_render_cache import ContractRenderCache
+from .services_schedule import ContractScheduleService
+from .services_stamp import ContractPdfStamper, ContractStampError
+from .services_templates import ContractTemplateRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class ContractRenderTimings:
+    """
+        Время этапов рендера договора.
+        Время вложенного этапа не входит во внешний: обработчики таблиц и QR-кодов вызываются внутри заполнения шаблона.
+        Итог пишется в лог одной строкой и накапливается в Redis (число замеров и сумма мс по этапу).
+    """
+
+    STAGES = ('resolve', 'template', 'fill', 'tables', 'qr', 'convert', 'persist')
+
+    COUNT_KEY = 'contract_render_stage:{}:count'
+    TIME_KEY = 'contract_render_stage:{}:ms'
+
+    def __init__(self) -> None:
+        self.timings = {}
+        self._nested = 0.0
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        nested = self._nested
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.timings[name] = self.timings.get(name, 0) + elapsed - (self._nested - nested)
+            self._nested = nested + elapsed
+
+    def wrap(self, name, callback):
+        """ Обработчик плейсхолдера, время которого считается в этап name """
+
+        def wrapped(*args, **kwargs):
+            with self.stage(name):
+                return callback(*args, **kwargs)
+        return wrapped
+
+    @staticmethod
+    def incr(key, delta) -> None:
+        try:
+            cache.add(key, 0, timeout=None)
+            cache.incr(key, delta)
+        except Exception as e:
+            logger.warning(f'Render stage metric {key} not updated: {e}')
+
+    def report(self, label, total) -> None:
+        stages = ', '.join(
+            f'{name} {self.timings[name] * 1000:.0f}ms' for name in self.STAGES if name in self.timings
+        )
+        logger.info(f'Contract render {label}: {stages}; total {total * 1000:.0f}ms')
+
+        for name, elapsed in self.timings.items():
+            self.incr(self.COUNT_KEY.format(name), 1)
+            self.incr(self.TIME_KEY.format(name), int(elapsed * 1000))
+
+    @classmethod
+    def stats(cls) -> dict:
+        """ {этап: {'count': число замеров, 'avg_ms': среднее время}} """
+
+        keys = [key.format(name) for name in cls.STAGES for key in (cls.COUNT_KEY, cls.TIME_KEY)]
+        values = cache.get_many(keys)
+
+        stats = {}
+        for name in cls.STAGES:
+            count = values.get(cls.COUNT_KEY.format(name)) or 0
+            total = values.get(cls.TIME_KEY.format(name)) or 0
+            stats[name] = {'count': count, 'avg_ms': round(total / count, 1) if count else 0}
+        return stats
+
+
+class ContractRenderPipeline:
+    """
+        Единый рендер PDF договора для скачивания и подписания. Этапы:
+        resolve - ученик, родитель, график оплаты и значения плейсхолдеров (скидки считаются один раз);
+        template - выбор шаблона по школе/оплате/учебному году и скомпилированный шаблон;
+        fill - подстановка значений; tables - таблицы графика платежей; qr - картинки QR или штамп на готовую основу;
+        convert - PDF из render_cache или конвертация LibreOffice; persist - новая версия в ContractDocumentStore.
+        Кэши этапов: график - ContractScheduleService (Redis), шаблон - DocxTemplateCache, таблицы - прототип
+        PayTableBuilder, QR - основа ContractPdfStamper, convert - render_cache (None - всегда конвертировать).
+        Время этапов пишется в лог и в счетчики ContractRenderTimings.
+    """
+
+    # Плейсхолдеры картинок, уникальных для каждого рендера: документ с ними в render_cache не пишется
+    UNCACHED_IMAGES = {'QRCodeDataSigned'}
+
+    def __init__(self, contract, is_dop_contract=False, kind=ContractTemplateRegistry.UNSIGNED, template_path=None,
+                 student=None, parent=None, render_cache=ContractRenderCache, whole_amount=True) -> None:
+        self.contract = contract
+        self.is_dop_contract = is_dop_contract
+        self.kind = kind
+        self.whole_amount = whole_amount
+        self.template_path = template_path
+        self.render_cache = render_cache
+        self.timings = ContractRenderTimings()
+        self.started = time.perf_counter()
+
+        self._student = student
+        self._parent = parent
+        self._data = None
+
+    @staticmethod
+    def get_schedule(contract, is_dop_contract, whole_amount=True) -> dict:
+        """
+            График для таблиц документа.
+            В доп. соглашении месячный платеж считается от суммы самого соглашения без скидок.
+            whole_amount - месячный платеж от целой части суммы со скидкой, как в договорах для скачивания
+            и с QR-кодами; договор, формируемый при подписании, делит сумму с копейками.
+        """
+
+        schedule = dict(ContractScheduleService().get_schedule(contract))
+        if whole_amount:
+            schedule['document_month_sum'] = ContractScheduleService.round_up_month_sum(
+                schedule['amount_with_discount'], whole_amount=True
+            )
+
+        if is_dop_contract:
+            dop_contract = ContractMS.objects.using('ms_sql').filter(ContractNum=contract.ContractNum).first()
+            contract_amount = abs(int(float(dop_contract.ContractAmount))) if dop_contract else 0
+            schedule['document_month_sum'] = ContractScheduleService.round_up_month_sum(contract_amount)
+
+        return schedule
+
+    @staticmethod
+    def get_values(contract, student, parent, schedule) -> ContractDocumentValues:
+        contract_dop = ContractMS.objects.using('ms_sql').filter(ContractNum=contract.ContractNum).first()
+        contract_dop_amount = contract_dop.ContractAmount if contract_dop is not None else 0
+
+        return ContractDocumentValues(contract, student, parent, schedule['amount_with_discount'], contract_dop_amount)
+
+    @staticmethod
+    def get_month_pay_rows(schedule) -> list:
+        """ Строки таблицы помесячной оплаты: [(сумма, дата оплаты)] """
+
+        sum_for_month = schedule['document_month_sum']
+        return [(f"{sum_for_month:,}".replace(',', ' '), month['PayDateM']) for month in schedule['months']]
+
+    @staticmethod
+    def get_quarter_pay_rows(schedule) -> list:
+        if not schedule['quarters']:
+            raise AttributeError('Contract has no quarter pays')
+
+        sum_for_month = schedule['document_month_sum']
+        return [
+            (str(round(sum_for_month * quarter['MonthCount'], 2)), quarter['PayDateM'])
+            for quarter in schedule['quarters']
+        ]
+
+    def resolve(self) -> dict:
+        """ {'student', 'parent', 'schedule', 'values'} - считается один раз на конвейер """
+
+        if self._data is None:
+            from .services import ContractDownloadService
+
+            with self.timings.stage('resolve'):
+                student = self._student or ContractDownloadService.check_exist_student(self.contract)
+                parent = self._parent or ContractDownloadService(self.contract).check_exists_parent(self.contract)
+                schedule = self.get_schedule(self.contract, self.is_dop_contract, self.whole_amount)
+
+                self._data = {
+                    'student': student,
+                    'parent': parent,
+                    'schedule': schedule,
+                    'values': self.get_values(self.contract, student, parent, schedule),
+                }
+        return self._data
+
+    def get_template_path(self):
+        if self.template_path is None:
+            self.template_path = ContractTemplateRegistry.resolve(self.contract, self.is_dop_contract, self.kind)
+        return self.template_path
+
+    def get_template(self):
+        with self.timings.stage('template'):
+            if self.get_template_path() is None:
+                raise ValueError('Шаблон договора не найден!')
+            return DocxTemplateCache.get(self.template_path)
+
+    def get_table_callbacks(self, schedule) -> dict:
+        def pay_table(get_rows):
+            def callback(slot):
+                try:
+                    rows = get_rows(schedule)
+                except AttributeError as e:
+                    logger.warning(f'Pay table of {self.contract.ContractNum} skipped: {e}')
+                    return
+                PayTableBuilder.insert(slot, rows)
+            return self.timings.wrap('tables', callback)
+
+        return {
+            'customtable_monthpay': pay_table(self.get_month_pay_rows),
+            'customtable_quarterpay': pay_table(self.get_quarter_pay_rows),
+        }
+
+    def render_pdf(self, images=None, callbacks=None, variant=None) -> bytes:
+        """
+            PDF договора: переменные, таблицы оплаты и картинки
+            (images - {плейсхолдер: (байты или функция, возвращающая байты, размер в дюймах)}).
+            callbacks - дополнительные обработчики плейсхолдеров, variant - вид документа для ключа render_cache.
+            Картинки и значения считаются только для плейсхолдеров, которые есть в шаблоне.
+        """
+
+        data = self.resolve()
+        template = self.get_template()
+        placeholders = template.placeholders
+
+        callbacks = {**self.get_table_callbacks(data['schedule']), **(callbacks or {})}
+        callbacks = {name: callback for name, callback in callbacks.items() if name in placeholders}
+
+        with self.timings.stage('qr'):
+            images = {
+                name: (image() if callable(image) else image, size)
+                for name, (image, size) in (images or {}).items() if name in placeholders
+            }
+
+        with self.timings.stage('fill'):
+            text_values = {
+                name: data['values'].get(name) for name in sorted(placeholders - set(images) - set(callbacks))
+            }
+
+        # QR с данными подписанного договора содержит время подписания, такой PDF из кэша не будет взят
+        cacheable = self.render_cache is not None and not self.UNCACHED_IMAGES & set(images)
+
+        key = None
+        if cacheable:
+            with self.timings.stage('convert'):
+                key = self.render_cache.make_key(self.template_path, text_values, images, data['schedule'], variant)
+                pdf_content = self.render_cache.get(key)
+            if pdf_content is not None:
+                return pdf_content
+
+        callbacks.update({
+            name: self.timings.wrap('qr', picture_callback(image, size)) for name, (image, size) in images.items()
+        })
+
+        with self.timings.stage('fill'):
+            document = template.render(text_values, callbacks)
+
+        with self.timings.stage('convert'):
+            buffer = BytesIO()
+            document.save(buffer)
+            pdf_content = convert_docx_to_pdf(buffer.getvalue())
+
+            if cacheable:
+                try:
+                    self.render_cache.set(key, pdf_content)
+                except OSError as e:
+                    logger.warning(f'Render cache write failed: {e}')
+
+        return pdf_content
+
+    def render_stamped_pdf(self, images) -> bytes:
+        """ PDF с QR-кодами, наложенными на готовую основу (ContractPdfStamper). Если основа не подходит - полный рендер """
+
+        def render_base(callbacks, variant):
+            callbacks = {name: self.timings.wrap('qr', callback) for name, callback in callbacks.items()}
+            return self.render_pdf(callbacks=callbacks, variant=variant)
+
+        if self.get_template_path() is None:
+            raise ValueError('Шаблон договора не найден!')
+
+        try:
+            with self.timings.stage('qr'):
+                return ContractPdfStamper.render(self.template_path, images, render_base)
+        except ContractStampError as e:
+            logger.warning(f'QR stamp not applied to {self.contract.ContractNum}, full render: {e}')
+            return self.render_pdf(images)
+
+    def persist(self, user, contract_num, pdf_content, file_name=None):
+        with self.timings.stage('persist'):
+            return ContractDocumentStore.save(user, contract_num, pdf_content, self.is_dop_contract, file_name)
+
+    def report(self) -> None:
+        """ Время этапов с момента создания конвейера (или начала run) в лог и метрики """
+
+        label = f'{self.contract.ContractNum} {self.kind}' + (' dop' if self.is_dop_contract else '')
+        self.timings.report(label, time.perf_counter() - self.started)
+
+    def run(self, user, contract_num, images=None, stamp=False, file_name=None):
+        """ Все этапы: PDF (stamp - QR-коды штампом на основу) и новая версия документа. Возвращает ContractDocument """
+
+        self.started = time.perf_counter()
+        try:
+            pdf_content = self.render_stamped_pdf(images or {}) if stamp else self.render_pdf(images)
+            return self.persist(user, contract_num, pdf_content, file_name)
+        finally:
+            self.report()
@@ -0,0 +1,101 @@
+import logging
+import time
+
+from .models import ContractDocument, ContractMS
+
+logger = logging.getLogger(__name__)
+
+
+class ContractPregenerationService:
+    """
+        Массовая генерация PDF договоров на обучение перед началом учебного года.
+        Выбираются договоры учебного года (и школы), у которых еще нет документа (ContractDocument),
+        поэтому повторный запуск после прерывания продолжает с оставшихся договоров.
+        Скачивание в кабинете после этого - чтение готового файла.
+    """
+
+    CHUNK_SIZE = 2000
+
+    @classmethod
+    def get_pending(cls, edu_year_id, school_id=None) -> list:
+        """ [(id, номер договора)] договоров без сгенерированного PDF, в порядке id """
+
+        contracts = ContractMS.objects.using('ms_sql').filter(EduYearID=edu_year_id).exclude(ContractNum=None)
+        if school_id is not None:
+            contracts = contracts.filter(SchoolID=school_id)
+
+        rows = list(contracts.order_by('id').values_list('id', 'ContractNum'))
+
+        existing = set()
+        for start in range(0, len(rows), cls.CHUNK_SIZE):
+            contract_nums = [contract_num for contract_id, contract_num in rows[start:start + cls.CHUNK_SIZE]]
+            existing.update(
+                ContractDocument.objects.filter(
+                    kind=ContractDocument.CONTRACT, is_current=True, contract_num__in=contract_nums
+                ).values_list('contract_num', flat=True)
+            )
+
+        return [(contract_id, contract_num) for contract_id, contract_num in rows if contract_num not in existing]
+
+    @staticmethod
+    def render(contract_id) -> dict:
+        """ Генерация PDF одного договора, ошибки не пробрасываются """
+
+        from .services import ContractDownloadService
+
+        started = time.perf_counter()
+        contract = ContractMS.objects.using('ms_sql').select_related('SchoolID', 'PaymentTypeID') \
+            .filter(id=contract_id).first()
+        contract_num = contract.ContractNum if contract else None
+
+        try:
+            if contract is None:
+                raise ValueError('Договор не найден!')
+            ContractDownloadService(contract).render_contract_file(None, contract_num, False)
+            error = None
+        except Exception as e:
+            logger.warning(f'Pregeneration of contract {contract_num} ({contract_id}) failed: {e}')
+            error = str(e)
+
+        return {
+            'contract_id': contract_id,
+            'contract_num': contract_num,
+            'error': error,
+            'elapsed': round(time.perf_counter() - started, 3),
+        }
+
+    @classmethod
+    def render_batch(cls, contract_ids) -> dict:
+        results = [cls.render(contract_id) for contract_id in contract_ids]
+        failed = {result['contract_num'] or result['contract_id']: result['error'] for result in results if result['error']}
+
+        return {
+            'rendered': len(results) - len(failed),
+            'failed': failed,
+        }
+
+    @classmethod
+    def get_batches(cls, edu_year_id, school_id=None, batch_size=50) -> list:
+        contract_ids = [contract_id for contract_id, contract_num in cls.get_pending(edu_year_id, school_id)]
+        return [contract_ids[start:start + batch_size] for start in range(0, len(contract_ids), batch_size)]
+
+    @staticmethod
+    def summarize(results, started_at=None) -> dict:
+        """ Итог по результатам render_batch, started_at - time.time() запуска """
+
+        failed = {}
+        for result in results:
+            failed.update(result['failed'])
+
+        summary = {
+            'rendered': sum(result['rendered'] for result in results),
+            'failed': len(failed),
+            'errors': failed,
+        }
+
+        if started_at is not None:
+            elapsed = max(time.time() - started_at, 0.001)
+            summary['elapsed'] = round(elapsed, 1)
+            summary['per_second'] = round((summary['rendered'] + summary['failed']) / elapsed, 2)
+
+        return summary
@@ -0,0 +1,221 @@
+import html
+import logging
+import os
+import threading
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from docx.oxml.ns import qn
+
+from .services_docx import DocxTemplateCache, PLACEHOLDER_PATTERN
+from .services_pipeline import ContractRenderPipeline
+from .services_render_cache import ContractRenderCache
+
+logger = logging.getLogger(__name__)
+
+
+class DocxHtmlTemplate:
+    """
+        HTML-версия скомпилированного шаблона DOCX: абзацы, таблицы, жирный/курсив/подчеркивание, выравнивание.
+        Строится один раз на шаблон, плейсхолдеры остаются в тексте и подставляются строковой заменой.
+        Абзац, состоящий только из блочного плейсхолдера (таблица оплаты), заменяется блоком целиком.
+    """
+
+    ALIGNMENTS = {
+        'center': 'center',
+        'right': 'right',
+        'end': 'right',
+        'both': 'justify',
+        'distribute': 'justify',
+    }
+
+    BLOCK_PLACEHOLDERS = ('customtable_monthpay', 'customtable_quarterpay')
+
+    def __init__(self, document) -> None:
+        self.html = self.convert_body(document.element.body)
+
+    @classmethod
+    def convert_body(cls, element) -> str:
+        parts = []
+        for child in element.iterchildren():
+            if child.tag == qn('w:p'):
+                parts.append(cls.convert_paragraph(child))
+            elif child.tag == qn('w:tbl'):
+                parts.append(cls.convert_table(child))
+        return '\n'.join(parts)
+
+    @staticmethod
+    def is_on(properties, tag) -> bool:
+        element = properties.find(qn(tag))
+        return element is not None and element.get(qn('w:val')) not in ('0', 'false', 'none')
+
+    @classmethod
+    def convert_run(cls, run) -> str:
+        text = html.escape(run.text or '').replace('\n', '<br/>').replace('\t', '&nbsp;' * 4)
+        if not text:
+            return ''
+
+        properties = run.find(qn('w:rPr'))
+        if properties is not None:
+            if cls.is_on(properties, 'w:b'):
+                text = f'<b>{text}</b>'
+            if cls.is_on(properties, 'w:i'):
+                text = f'<i>{text}</i>'
+            if cls.is_on(properties, 'w:u'):
+                text = f'<u>{text}</u>'
+        return text
+
+    @classmethod
+    def convert_paragraph(cls, paragraph) -> str:
+        runs = [run for run in paragraph.iter(qn('w:r'))]
+
+        text = ''.join(run.text or '' for run in runs).strip()
+        for name in cls.BLOCK_PLACEHOLDERS:
+            if text == f'{{{name}}}':
+                return text
+
+        alignment = paragraph.find(f'{qn("w:pPr")}/{qn("w:jc")}')
+        alignment = cls.ALIGNMENTS.get(alignment.get(qn('w:val'))) if alignment is not None else None
+        attributes = f' style="text-align: {alignment}"' if alignment else ''
+
+        return f'<p{attributes}>{"".join(cls.convert_run(run) for run in runs) or "&nbsp;"}</p>'
+
+    @classmethod
+    def convert_table(cls, table) -> str:
+        rows = []
+        for row in table.iterchildren(qn('w:tr')):
+            cells = []
+            for cell in row.iterchildren(qn('w:tc')):
+                span = cell.find(f'{qn("w:tcPr")}/{qn("w:gridSpan")}')
+                colspan = f' colspan="{span.get(qn("w:val"))}"' if span is not None else ''
+                cells.append(f'<td{colspan}>{cls.convert_body(cell)}</td>')
+            rows.append(f'<tr>{"".join(cells)}</tr>')
+        return f'<table>{"".join(rows)}</table>'
+
+    def render(self, values, blocks=None) -> str:
+        """ values - {плейсхолдер: значение}, blocks - {плейсхолдер: готовый HTML} """
+
+        blocks = blocks or {}
+
+        def replace(match):
+            name = match.group('name') or match.group('bare')
+            if name in blocks:
+                return blocks[name]
+            value = values.get(name)
+            return '' if value is None else html.escape(str(value))
+
+        return PLACEHOLDER_PATTERN.sub(replace, self.html)
+
+
+class ContractPreviewService:
+    """
+        Предпросмотр неподписанного договора без python-docx рендера и LibreOffice.
+        Те же значения ContractDocumentValues и таблицы оплаты подставляются в HTML-версию шаблона,
+        PDF при необходимости строится xhtml2pdf в процессе.
+        HTML кэшируется в Redis, PDF - в ContractRenderCache; ключ - версия данных договора (как у полного рендера).
+        Юридически значимый подписанный договор по-прежнему формируется через LibreOffice.
+    """
+
+    HTML_KEY = 'contract_preview_html:{}'
+    HTML_TIMEOUT = 24 * 60 * 60
+
+    HTML_VARIANT = 'preview_html'
+    PDF_VARIANT = 'preview_pdf'
+
+    _templates = {}
+    _lock = threading.Lock()
+
+    def __init__(self, contract, is_dop_contract=False) -> None:
+        self.contract = contract
+        self.is_dop_contract = is_dop_contract
+
+    @classmethod
+    def get_html_template(cls, path) -> DocxHtmlTemplate:
+        key = (os.path.abspath(path), DocxTemplateCache.get_digest(path))
+        template = cls._templates.get(key)
+        if template is None:
+            with cls._lock:
+                template = cls._templates.get(key)
+                if template is None:
+                    template = DocxHtmlTemplate(DocxTemplateCache.get(path).document)
+                    cls._templates[key] = template
+        return template
+
+    @staticmethod
+    def get_font_path():
+        font_path = settings.CONTRACT_PREVIEW_FONT
+        return font_path if font_path and os.path.exists(font_path) else None
+
+    @staticmethod
+    def pay_table_html(rows) -> str:
+        body = ''.join(
+            f'<tr><td>{index}</td><td>{html.escape(str(pay_sum))}</td><td>{html.escape(str(pay_date))}</td></tr>'
+            for index, (pay_sum, pay_date) in enumerate(rows, start=1)
+        )
+        return f'<table class="pay-table"><tr><td>№</td><td>Сумма</td><td>Дата оплаты</td></tr>{body}</table>'
+
+    def get_blocks(self, schedule) -> dict:
+        blocks = {'customtable_monthpay': self.pay_table_html(ContractRenderPipeline.get_month_pay_rows(schedule))}
+        try:
+            blocks['customtable_quarterpay'] = self.pay_table_html(ContractRenderPipeline.get_quarter_pay_rows(schedule))
+        except AttributeError:
+            blocks['customtable_quarterpay'] = ''
+        return blocks
+
+    def prepare(self) -> tuple:
+        """ (путь шаблона, значения плейсхолдеров шаблона, график) """
+
+        pipeline = ContractRenderPipeline(self.contract, self.is_dop_contract)
+        placeholders = pipeline.get_template().placeholders - set(DocxHtmlTemplate.BLOCK_PLACEHOLDERS)
+        data = pipeline.resolve()
+
+        return pipeline.template_path, {name: data['values'].get(name) for name in sorted(placeholders)}, data['schedule']
+
+    def render_html(self, path, values, schedule) -> str:
+        body = self.get_html_template(path).render(values, self.get_blocks(schedule))
+        return render_to_string('contract/preview.html', {
+            'body': body,
+            'contract_num': self.contract.ContractNum,
+            'font_path': self.get_font_path(),
+        })
+
+    def get_html(self, prepared=None) -> str:
+        started = time.perf_counter()
+        path, values, schedule = prepared or self.prepare()
+
+        key = self.HTML_KEY.format(
+            ContractRenderCache.make_key(path, values, schedule=schedule, variant=self.HTML_VARIANT)
+        )
+        document = cache.get(key)
+        if document is None:
+            document = self.render_html(path, values, schedule)
+            cache.set(key, document, timeout=self.HTML_TIMEOUT)
+
+        logger.info(f'Contract preview HTML {self.contract.ContractNum}: {(time.perf_counter() - started) * 1000:.0f}ms')
+        return document
+
+    def get_pdf(self) -> bytes:
+        from xhtml2pdf import pisa
+
+        started = time.perf_counter()
+        prepared = path, values, schedule = self.prepare()
+
+        key = ContractRenderCache.make_key(path, values, schedule=schedule, variant=self.PDF_VARIANT)
+        pdf_content = ContractRenderCache.get(key)
+        if pdf_content is None:
+            output = BytesIO()
+            result = pisa.CreatePDF(self.get_html(prepared), dest=output, encoding='utf-8')
+            if result.err:
+                raise ValueError('Ошибка формирования предпросмотра договора!')
+
+            pdf_content = output.getvalue()
+            try:
+                ContractRenderCache.set(key, pdf_content)
+            except OSError as e:
+                logger.warning(f'Render cache write failed: {e}')
+
+        logger.info(f'Contract preview PDF {self.contract.ContractNum}: {(time.perf_counter() - started) * 1000:.0f}ms')
+        return pdf_content
@@ -0,0 +1,148 @@
+import threading
+import time
+
+from django.core.cache import cache
+
+from .models import ContractStatusMS, PaymentTypeMS, DiscountMS, DiscountTypeMS, EduYearMS, CompanyMS, BankMS, \
+    ClassMS
+
+
+class ReferenceDataCache:
+    """
+        Кэш справочников MS SQL (spr_*).
+        Два уровня: память процесса (LOCAL_TIMEOUT) и Redis (REDIS_TIMEOUT).
+        Поиск по id и по названию идет по словарям в памяти.
+        Сброс: ReferenceDataCache.invalidate() или команда invalidate_reference_cache.
+        Другие процессы увидят сброс не позже чем через LOCAL_TIMEOUT.
+    """
+
+    STATUS = 'status'
+    PAYMENT_TYPE = 'payment_type'
+    DISCOUNT = 'discount'
+    DISCOUNT_TYPE = 'discount_type'
+    EDU_YEAR = 'edu_year'
+    COMPANY = 'company'
+    BANK = 'bank'
+    CLASS = 'class'
+
+    # Справочник: (модель, поле названия для поиска по имени)
+    TABLES = {
+        STATUS: (ContractStatusMS, 'sStatusName'),
+        PAYMENT_TYPE: (PaymentTypeMS, 'sPaymentType'),
+        DISCOUNT: (DiscountMS, 'sDiscountName'),
+        DISCOUNT_TYPE: (DiscountTypeMS, 'sDiscountType'),
+        EDU_YEAR: (EduYearMS, 'sEduYear'),
+        COMPANY: (CompanyMS, 'name'),
+        BANK: (BankMS, 'name'),
+        CLASS: (ClassMS, None),
+    }
+
+    # Связанные справочники, которые подгружаются вместе с таблицей
+    RELATED = {
+        DISCOUNT: ('iDiscountType',),
+        CLASS: ('school_id',),
+    }
+
+    CACHE_PREFIX = 'reference_data'
+    LOCAL_TIMEOUT = 60
+    REDIS_TIMEOUT = 60 * 60
+
+    _local = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_cache_key(cls, table) -> str:
+        return f'{cls.CACHE_PREFIX}_{table}'
+
+    @classmethod
+    def load_table(cls, table) -> list:
+        model, name_field = cls.TABLES[table]
+        queryset = model.objects.using('ms_sql').order_by('id')
+        if table in cls.RELATED:
+            queryset = queryset.select_related(*cls.RELATED[table])
+
+        return list(queryset)
+
+    @classmethod
+    def get_table(cls, table) -> dict:
+        """ Справочник в памяти: {'by_id': {...}, 'by_name': {...}} """
+
+        entry = cls._local.get(table)
+        if entry is not None and entry['expires_at'] > time.monotonic():
+            return entry
+
+        with cls._lock:
+            entry = cls._local.get(table)
+            if entry is not None and entry['expires_at'] > time.monotonic():
+                return entry
+
+            rows = cache.get(cls.get_cache_key(table))
+            if rows is None:
+                rows = cls.load_table(table)
+                cache.set(cls.get_cache_key(table), rows, timeout=cls.REDIS_TIMEOUT)
+
+            model, name_field = cls.TABLES[table]
+            by_name = {}
+            if name_field:
+                for row in rows:
+                    # Как и .get() по названию берем первую запись с таким именем
+                    by_name.setdefault(getattr(row, name_field), row)
+
+            entry = {
+                'expires_at': time.monotonic() + cls.LOCAL_TIMEOUT,
+                'by_id': {row.id: row for row in rows},
+                'by_name': by_name,
+            }
+            cls._local[table] = entry
+
+        return entry
+
+    @classmethod
+    def all(cls, table) -> list:
+        return list(cls.get_table(table)['by_id'].values())
+
+    @classmethod
+    def get(cls, table, pk):
+        """ Запись справочника по id или None """
+
+        if pk is None:
+            return None
+        return cls.get_table(table)['by_id'].get(pk)
+
+    @classmethod
+    def get_by_name(cls, table, name):
+        """ Запись справочника по названию. Если записи нет - model.DoesNotExist, как у .get() """
+
+        row = cls.get_table(table)['by_name'].get(name)
+        if row is None:
+            model, name_field = cls.TABLES[table]
+            raise model.DoesNotExist(f'{model.__name__} with {name_field}={name!r} does not exist')
+
+        return row
+
+    @classmethod
+    def attach(cls, objects, field, table) -> None:
+        """ Подставляет объекты справочника в FK-поле, чтобы обращение obj.<field> не шло в БД """
+
+        for obj in objects:
+            pk = getattr(obj, f'{field}_id')
+            row = cls.get(table, pk)
+            if row is not None:
+                setattr(obj, field, row)
+
+    @classmethod
+    def attach_many(cls, objects, fields) -> None:
+        """ attach для нескольких полей: fields - {FK-поле: справочник} """
+
+        objects = list(objects)
+        for field, table in fields.items():
+            cls.attach(objects, field, table)
+
+    @classmethod
+    def invalidate(cls, *tables) -> None:
+        tables = tables or tuple(cls.TABLES.keys())
+
+        with cls._lock:
+            for table in tables:
+                cls._local.pop(table, None)
+        cache.delete_many([cls.get_cache_key(table) for table in tables])
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .services_docx import DocxTemplateCache
+
+logger = logging.getLogger(__name__)
+
+
+class ContractRenderCache:
+    """
+        Кэш готовых PDF договоров, адресуемый по содержимому.
+        Ключ - sha256 от шаблона (имя и хэш байтов файла), значений всех плейсхолдеров шаблона,
+        графика оплаты (сумма со скидками, месяцы, кварталы) и QR-кодов.
+        При попадании PDF отдается с диска без python-docx и LibreOffice.
+        Размер каталога ограничен CONTRACT_RENDER_CACHE_MAX_SIZE, вытесняются давно не читавшиеся файлы (LRU по mtime).
+        Размер ведется счетчиком в Redis (SIZE_KEY), каталог обходится только при превышении лимита,
+        после вытеснения счетчик сверяется с диском.
+    """
+
+    # Увеличить при изменении кода заполнения шаблонов, чтобы старые PDF не отдавались
+    VERSION = 4
+
+    HITS_KEY = 'contract_render_cache:hits'
+    MISSES_KEY = 'contract_render_cache:misses'
+    SIZE_KEY = 'contract_render_cache:size'
+    EVICT_LOCK_KEY = 'contract_render_cache:evict_lock'
+    EVICT_LOCK_TIMEOUT = 10 * 60
+
+    @staticmethod
+    def get_directory() -> str:
+        return str(settings.CONTRACT_RENDER_CACHE_DIR)
+
+    @classmethod
+    def get_path(cls, key) -> str:
+        return os.path.join(cls.get_directory(), key[:2], f'{key}.pdf')
+
+    @staticmethod
+    def digest(data) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @classmethod
+    def make_key(cls, template_path, values, images=None, schedule=None, variant=None) -> str:
+        """
+            values - {плейсхолдер: значение}, images - {плейсхолдер: (байты картинки, размер)}.
+            Незаполненные картинки (пустые байты) в ключ попадают как пустые - документ без них отличается.
+            variant - вид документа, если обработчики плейсхолдеров отличаются (например, основа для штампа QR).
+        """
+
+        payload = {
+            'version': cls.VERSION,
+            'variant': variant,
+            'template': os.path.basename(template_path),
+            'template_digest': DocxTemplateCache.get_digest(template_path),
+            'values': values,
+            'images': {
+                name: [cls.digest(image) if image else None, size] for name, (image, size) in (images or {}).items()
+            },
+            'schedule': schedule,
+        }
+
+        data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return cls.digest(data.encode())
+
+    @staticmethod
+    def incr(key) -> None:
+        try:
+            cache.add(key, 0, timeout=None)
+            cache.incr(key)
+        except Exception as e:
+            logger.warning(f'Render cache metric {key} not updated: {e}')
+
+    @classmethod
+    def get(cls, key):
+        path = cls.get_path(key)
+        try:
+            with open(path, 'rb') as pdf_file:
+                pdf_content = pdf_file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            cls.incr(cls.MISSES_KEY)
+            return None
+
+        cls.incr(cls.HITS_KEY)
+        return pdf_content
+
+    @classmethod
+    def set(cls, key, pdf_content) -> None:
+        path = cls.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        try:
+            replaced_size = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced_size = 0
+
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as pdf_file:
+            pdf_file.write(pdf_content)
+        os.replace(tmp_path, path)
+
+        if cls.add_size(len(pdf_content) - replaced_size) > settings.CONTRACT_RENDER_CACHE_MAX_SIZE:
+            cls.evict()
+
+    @classmethod
+    def add_size(cls, delta) -> int:
+        """ Изменение счетчика размера кэша. Без счетчика (Redis очищен или недоступен) размер считается по диску """
+
+        try:
+            return cache.incr(cls.SIZE_KEY, delta)
+        except ValueError:
+            pass
+        except Exception as e:
+            logger.warning(f'Render cache size counter not updated: {e}')
+
+        total_size = sum(size for mtime, size, path in cls.get_entries())
+        cls.set_size(total_size)
+        return total_size
+
+    @classmethod
+    def set_size(cls, total_size) -> None:
+        try:
+            cache.set(cls.SIZE_KEY, total_size, timeout=None)
+        except Exception as e:
+            logger.warning(f'Render cache size counter not updated: {e}')
+
+    @classmethod
+    def get_entries(cls) -> list:
+        """ [(mtime, размер, путь)] всех PDF кэша """
+
+        entries = []
+        for root, dirs, files in os.walk(cls.get_directory()):
+            for name in files:
+                if not name.endswith('.pdf'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    @classmethod
+    def evict(cls, max_size=None) -> int:
+        """
+            Удаление давно не читавшихся PDF, пока кэш больше max_size байт. Возвращает число удаленных файлов.
+            Обход каталога выполняет один процесс: пока вытеснение идет, другие записи в кэш его не запускают.
+        """
+
+        max_size = settings.CONTRACT_RENDER_CACHE_MAX_SIZE if max_size is None else max_size
+
+        if not cache.add(cls.EVICT_LOCK_KEY, True, timeout=cls.EVICT_LOCK_TIMEOUT):
+            return 0
+
+        try:
+            entries = cls.get_entries()
+            total_size = sum(size for mtime, size, path in entries)
+
+            removed = 0
+            for mtime, size, path in sorted(entries):
+                if total_size <= max_size:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_size -= size
+                removed += 1
+
+            cls.set_size(total_size)
+        finally:
+            cache.delete(cls.EVICT_LOCK_KEY)
+
+        if removed:
+            logger.info(f'Render cache evicted {removed} files, size {total_size} bytes')
+        return removed
+
+    @classmethod
+    def clear(cls) -> int:
+        return cls.evict(max_size=0)
+
+    @classmethod
+    def stats(cls) -> dict:
+        hits = cache.get(cls.HITS_KEY) or 0
+        misses = cache.get(cls.MISSES_KEY) or 0
+        entries = cls.get_entries()
+
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0,
+            'entries': len(entries),
+            'size': sum(size for mtime, size, path in entries),
+            'max_size': settings.CONTRACT_RENDER_CACHE_MAX_SIZE,
+        }
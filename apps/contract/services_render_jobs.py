@@ -0,0 +1,230 @@
+import base64
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import ContractRenderJob
+
+logger = logging.getLogger(__name__)
+
+
+class ContractRenderJobService:
+    """
+        Фоновая генерация PDF договоров через Celery (задача render_contract_job).
+        HTTP-запрос только ставит задачу и сразу отвечает 202 с id задачи,
+        готовый PDF записывается новой версией документа договора (ContractDocumentStore).
+        Для синхронных клиентов есть ожидание результата (?wait=<сек.>, не больше CONTRACT_RENDER_MAX_WAIT).
+    """
+
+    POLL_INTERVAL = 0.25
+
+    @staticmethod
+    def encode_bytes(value) -> str:
+        return base64.b64encode(value or b'').decode()
+
+    @staticmethod
+    def decode_bytes(value) -> bytes:
+        return base64.b64decode(value or '')
+
+    @staticmethod
+    def get_wait(request) -> float:
+        """ Время ожидания результата из параметра wait запроса (0 - ответить сразу) """
+
+        value = request.query_params.get('wait')
+        if value is None and hasattr(request.data, 'get'):
+            value = request.data.get('wait')
+
+        try:
+            wait = float(value or 0)
+        except (TypeError, ValueError):
+            return 0
+
+        return min(max(wait, 0), settings.CONTRACT_RENDER_MAX_WAIT)
+
+    @staticmethod
+    def get_active(contract_num, variant, is_dop_contract):
+        return ContractRenderJob.objects.filter(
+            contract_num=contract_num,
+            variant=variant,
+            is_dop_contract=is_dop_contract,
+            status__in=ContractRenderJob.ACTIVE_STATUSES,
+        ).first()
+
+    @staticmethod
+    def expire(job) -> None:
+        """ Задача, не завершившаяся за CONTRACT_RENDER_JOB_TIMEOUT, считается потерянной (например, упал воркер) """
+
+        job.status = ContractRenderJob.FAILURE
+        job.error = 'Превышено время генерации договора'
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        logger.warning(f'Render job {job.id} for {job.contract_num} expired')
+
+    @staticmethod
+    def add_waiter(job, user):
+        if job is not None and getattr(user, 'is_authenticated', False):
+            job.waiters.add(user)
+        return job
+
+    @classmethod
+    def enqueue(cls, contract_num, variant, is_dop_contract=False, user=None, params=None) -> ContractRenderJob:
+        """
+            Постановка задачи в очередь. Если по договору и варианту уже есть незавершенная задача - возвращается она,
+            а пользователь добавляется к ее ожидающим (waiters), чтобы видеть статус и результат.
+        """
+
+        job = cls.get_active(contract_num, variant, is_dop_contract)
+        if job is not None:
+            timeout = timedelta(seconds=settings.CONTRACT_RENDER_JOB_TIMEOUT)
+            if job.created_at >= timezone.now() - timeout:
+                return cls.add_waiter(job, user)
+            cls.expire(job)
+
+        try:
+            with transaction.atomic():
+                job = ContractRenderJob.objects.create(
+                    contract_num=contract_num,
+                    variant=variant,
+                    is_dop_contract=is_dop_contract,
+                    user=user if getattr(user, 'is_authenticated', False) else None,
+                    params=params or {},
+                )
+        except IntegrityError:
+            # Параллельный запрос успел поставить такую же задачу
+            return cls.add_waiter(cls.get_active(contract_num, variant, is_dop_contract), user)
+
+        cls.add_waiter(job, user)
+
+        from .tasks import render_contract_job
+
+        job_id = str(job.id)
+        transaction.on_commit(lambda: render_contract_job.delay(job_id))
+        logger.info(f'Render job {job_id} queued: {contract_num} {variant}')
+
+        return job
+
+    @classmethod
+    def wait(cls, job, timeout) -> ContractRenderJob:
+        """ Ожидание завершения задачи не дольше timeout секунд """
+
+        deadline = time.monotonic() + (timeout or 0)
+        while not job.is_finished and time.monotonic() < deadline:
+            time.sleep(cls.POLL_INTERVAL)
+            job.refresh_from_db()
+        return job
+
+    @staticmethod
+    def serialize(job) -> dict:
+        return {
+            'job_id': str(job.id),
+            'contract_num': job.contract_num,
+            'variant': job.variant,
+            'is_dop_contract': job.is_dop_contract,
+            'status': job.status,
+            'error': job.error,
+            'result': job.result,
+            'status_url': reverse('contract-render-job', args=[job.id]),
+            'created_at': job.created_at,
+            'finished_at': job.finished_at,
+        }
+
+    @staticmethod
+    def file_result(contract_file) -> dict:
+        return {
+            'file_id': contract_file.id,
+            'file_url': contract_file.file.url,
+        }
+
+    def render_unsigned(self, job) -> dict:
+        from .services import ContractDownloadService
+        from .services_locator import ContractLocator
+
+        contract = ContractLocator.get_contract(job.contract_num)
+        if contract is None:
+            raise ValueError('Договор не найден!')
+
+        contract_file = ContractDownloadService(contract).render_contract_file(
+            job.user, job.contract_num, job.is_dop_contract
+        )
+
+        # Договор скоро будут подписывать: основа для штампа QR-кодов готовится заранее
+        from .tasks import prepare_contract_stamp_base
+
+        prepare_contract_stamp_base.delay(job.contract_num, job.is_dop_contract)
+
+        return self.file_result(contract_file)
+
+    def render_qr_signed(self, job) -> dict:
+        from .services import ContractDownloadService
+        from .services_locator import ContractLocator
+
+        contract = ContractLocator.get_contract(job.contract_num)
+        if contract is None:
+            raise ValueError('Договор не найден!')
+
+        contract_file = ContractDownloadService(contract).render_contract_with_qr_code(
+            job.user,
+            job.contract_num,
+            qr_code=self.decode_bytes(job.params.get('qr_code')),
+            qr_code_director_omarov=self.decode_bytes(job.params.get('qr_code_director_omarov')),
+            qr_code_director_serikov=self.decode_bytes(job.params.get('qr_code_director_serikov')),
+            is_dop_contract=job.is_dop_contract,
+        )
+
+        # Договор считается подписанным только когда PDF с QR-кодами готов: при ошибке рендера его можно подписать снова
+        from apps.contract.services_eds import SignContractWithEDSService
+
+        SignContractWithEDSService.mark_signed(job.contract_num, job.is_dop_contract)
+
+        return self.file_result(contract_file)
+
+    def render_signature(self, job) -> dict:
+        from .contract_signature_service import ContractSignatureService
+
+        return ContractSignatureService().complete_signature(
+            contract_num=job.contract_num,
+            cms_signature=job.params['cms_signature'],
+            signed_data=job.params['signed_data'],
+            user=job.user,
+            is_dop_contract=job.is_dop_contract,
+            verification_result=job.params['verification_result'],
+        )
+
+    def run(self, job_id) -> str:
+        """ Выполнение задачи в воркере Celery """
+
+        job = ContractRenderJob.objects.select_related('user').filter(id=job_id).first()
+        if job is None or job.is_finished:
+            return job.status if job else None
+
+        handlers = {
+            ContractRenderJob.UNSIGNED: self.render_unsigned,
+            ContractRenderJob.QR_SIGNED: self.render_qr_signed,
+            ContractRenderJob.SIGNATURE: self.render_signature,
+        }
+
+        job.status = ContractRenderJob.RUNNING
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+
+        started = time.perf_counter()
+        try:
+            job.result = handlers[job.variant](job) or {}
+            job.status = ContractRenderJob.SUCCESS
+        except Exception as e:
+            logger.exception(f'Render job {job.id} for {job.contract_num} failed')
+            job.status = ContractRenderJob.FAILURE
+            job.error = str(e)
+
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'result', 'error', 'finished_at'])
+
+        logger.info(f'Render job {job.id} {job.variant} for {job.contract_num}: {job.status} '
+                    f'in {(time.perf_counter() - started) * 1000:.0f}ms')
+
+        return job.status
@@ -0,0 +1,118 @@
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class ContractRenderBusy(Exception):
+    """ Договор формирует другой воркер, результат не дождались за CONTRACT_RENDER_LOCK_WAIT """
+
+
+class ContractRenderLock:
+    """
+        Один рендер договора на все воркеры (singleflight) по ключу номер договора + вид документа.
+        Первый запрос ставит блокировку в Redis (cache.add) и формирует документ,
+        параллельные запросы ждут его результат, а не запускают LibreOffice и не пишут свою версию документа.
+        Блокировка живет не дольше CONTRACT_RENDER_LOCK_TIMEOUT: упавший воркер не блокирует договор навсегда,
+        после истечения следующий запрос формирует документ сам.
+        Результат (или текст ошибки) хранится RESULT_TIMEOUT секунд под id рендера, значение должно сериализоваться pickle.
+    """
+
+    LOCK_KEY = 'contract_render_lock:{}:{}'
+    RESULT_KEY = 'contract_render_result:{}'
+    RESULT_TIMEOUT = 60
+
+    POLL_INTERVAL = 0.25
+
+    # Атомарное снятие блокировки: ключ удаляется, только если в нем id этого рендера
+    RELEASE_SCRIPT = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
+    @classmethod
+    def get_lock_key(cls, contract_num, variant) -> str:
+        return cls.LOCK_KEY.format(variant, contract_num)
+
+    @classmethod
+    def release(cls, lock_key, flight_id) -> bool:
+        """
+            Снятие своей блокировки (compare-and-delete скриптом Lua в Redis).
+            Если блокировка истекла, ключ уже может принадлежать другому рендеру и остается на месте.
+        """
+
+        client = cache.client.get_client(write=True)
+        released = client.eval(cls.RELEASE_SCRIPT, 1, cache.make_key(lock_key), cache.client.encode(flight_id))
+        return bool(released)
+
+    @classmethod
+    def lead(cls, lock_key, flight_id, func):
+        try:
+            result = func()
+        except Exception as e:
+            cache.set(cls.RESULT_KEY.format(flight_id), ('error', str(e)), timeout=cls.RESULT_TIMEOUT)
+            raise
+        else:
+            cache.set(cls.RESULT_KEY.format(flight_id), ('success', result), timeout=cls.RESULT_TIMEOUT)
+            return result
+        finally:
+            try:
+                if not cls.release(lock_key, flight_id):
+                    logger.warning(f'Contract render lock {lock_key} expired before the render finished')
+            except Exception as e:
+                logger.warning(f'Contract render lock {lock_key} not released, it expires by timeout: {e}')
+
+    @classmethod
+    def follow(cls, lock_key, flight_id, deadline):
+        """ Ожидание результата рендера flight_id. None - рендер пропал без результата (блокировка истекла) """
+
+        result_key = cls.RESULT_KEY.format(flight_id)
+        while time.monotonic() < deadline:
+            outcome = cache.get(result_key)
+            if outcome is not None:
+                return outcome
+            if cache.get(lock_key) != flight_id:
+                return cache.get(result_key)
+            time.sleep(cls.POLL_INTERVAL)
+
+        raise ContractRenderBusy('Договор уже формируется, повторите запрос позже')
+
+    @classmethod
+    def run(cls, contract_num, variant, func, wait=None):
+        """
+            Результат func() для договора contract_num и вида variant.
+            Если такой же рендер уже идет - ожидание его результата не дольше wait секунд
+            (по умолчанию CONTRACT_RENDER_LOCK_WAIT), ошибка рендера передается всем ожидающим как ValueError.
+        """
+
+        lock_key = cls.get_lock_key(contract_num, variant)
+        deadline = time.monotonic() + (settings.CONTRACT_RENDER_LOCK_WAIT if wait is None else wait)
+
+        while True:
+            flight_id = uuid.uuid4().hex
+            if cache.add(lock_key, flight_id, timeout=settings.CONTRACT_RENDER_LOCK_TIMEOUT):
+                return cls.lead(lock_key, flight_id, func)
+
+            leader_id = cache.get(lock_key)
+            if leader_id is None:
+                continue
+
+            started = time.perf_counter()
+            outcome = cls.follow(lock_key, leader_id, deadline)
+            if outcome is None:
+                logger.warning(f'Contract render lock {lock_key} expired without result')
+                continue
+
+            logger.info(f'Contract {contract_num} {variant} shared render result '
+                        f'after {(time.perf_counter() - started) * 1000:.0f}ms')
+
+            state, value = outcome
+            if state == 'error':
+                raise ValueError(value)
+            return value
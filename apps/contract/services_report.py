@@ -1,6 +1,8 @@
 from rest_framework.pagination import LimitOffsetPagination
 
 from apps.contract.models import ContractFileUser
+from apps.contract.services_arrears import ContractArrearsLedgerService
+from apps.contract.services_reference import ReferenceDataCache
 
 
 class ContractSearchParameterService:
@@ -82,6 +84,14 @@ class ContractSearchParameterService:
 class ContractReportService:
     """ Сервис для работы отчета по договорам """
 
+    reference_fields = {
+        'ContractStatusID': ReferenceDataCache.STATUS,
+        'PaymentTypeID': ReferenceDataCache.PAYMENT_TYPE,
+        'EduYearID': ReferenceDataCache.EDU_YEAR,
+        'ClassID': ReferenceDataCache.CLASS,
+        'DiscountID': ReferenceDataCache.DISCOUNT,
+    }
+
     def __init__(self, model, serializer):
         self.model = model
         self.serializer = serializer
@@ -130,7 +140,11 @@ class ContractReportService:
         if contract_date:
             queryset = query_param_service.get_contract_by_contract_date(queryset, contract_date)
 
-        queryset = pagination.paginate_queryset(queryset, request)
-        serializer = self.serializer(queryset, many=True)
+        queryset = pagination.paginate_queryset(queryset.select_related('StudentID__parent_id', 'SchoolID'), request)
+        ReferenceDataCache.attach_many(queryset, self.reference_fields)
+        arrears_totals = ContractArrearsLedgerService(ContractArrearsLedgerService.STUDY).get_totals(
+            [contract.id for contract in queryset]
+        )
+        serializer = self.serializer(queryset, many=True, context={'arrears_totals': arrears_totals})
 
         return pagination.get_paginated_response(serializer.data)
@@ -0,0 +1,161 @@
+import hashlib
+import math
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db.models import Sum
+
+from .models import ContractDiscountMS, ContractDopMS, ContractMonthPayMS
+
+
+class ContractScheduleService:
+    """
+        Расчет графика платежей договора на обучение (помесячно и поквартально).
+        Один расчет используется и в API (DetailContract), и в таблицах DOCX.
+        Результат хранится в Redis по версии договора - хэшу его финансовых полей, набора скидок
+        и суммы доп. соглашений. Скидки и доп. соглашения читаются при каждом запросе,
+        строки графика платежей - только при промахе кэша.
+    """
+
+    COUNT_MONTH = 9
+    CACHE_PREFIX = 'contract_schedule'
+    CACHE_TIMEOUT = 10 * 60
+
+    # MS SQL ограничивает количество параметров в запросе (2100)
+    CHUNK_SIZE = 2000
+
+    @staticmethod
+    def apply_discounts(contract_amount, discount_percents) -> float:
+        """ Скидки применяются последовательно, каждая к уже уменьшенной сумме """
+
+        contract_amount = float(contract_amount or 0)
+        for percent in discount_percents:
+            contract_amount -= contract_amount * percent / 100
+
+        return float(round(contract_amount, 2))
+
+    @classmethod
+    def round_up_month_sum(cls, contract_amount, whole_amount=False) -> int:
+        """
+            Сумма месячного платежа для документа: округление вверх до тенге.
+            whole_amount - делится только целая часть суммы (договоры ChangeDocumentContentService)
+        """
+
+        contract_amount = int(contract_amount) if whole_amount else float(contract_amount)
+        return math.ceil(contract_amount / cls.COUNT_MONTH)
+
+    @classmethod
+    def calculate_schedule(cls, contract_amount, discount_percents, dop_sum, month_pays) -> dict:
+        """
+            Чистый расчет графика без обращений к БД.
+            month_pays - строки графика (PayDateM, QuarterDig) в порядке id.
+        """
+
+        amount_with_discount = cls.apply_discounts(contract_amount, discount_percents)
+        month_sum = (amount_with_discount + float(dop_sum or 0)) / cls.COUNT_MONTH
+        document_month_sum = cls.round_up_month_sum(amount_with_discount)
+
+        quarters = {}
+        for pay_date, quarter_dig in month_pays:
+            quarter = quarters.setdefault(quarter_dig, {'QuarterDig': quarter_dig, 'PayDateM': pay_date, 'MonthCount': 0})
+            quarter['MonthCount'] += 1
+            if pay_date is not None and (quarter['PayDateM'] is None or pay_date < quarter['PayDateM']):
+                quarter['PayDateM'] = pay_date
+
+        quarter_rows = sorted(quarters.values(), key=lambda quarter: (quarter['PayDateM'] is None, quarter['PayDateM']))
+        for quarter in quarter_rows:
+            quarter['QuarterSum'] = round(document_month_sum * quarter['MonthCount'], 2)
+
+        return {
+            'amount_with_discount': amount_with_discount,
+            'dop_sum': float(dop_sum or 0),
+            'month_sum': month_sum,
+            'document_month_sum': document_month_sum,
+            'months': [{'PayDateM': pay_date, 'QuarterDig': quarter_dig} for pay_date, quarter_dig in month_pays],
+            'quarters': quarter_rows,
+        }
+
+    @classmethod
+    def get_cache_key(cls, contract, discounts, dop_sum) -> str:
+        """ Версия договора: финансовые поля, набор скидок [(id скидки, процент)] и сумма доп. соглашений """
+
+        version = (
+            f'{contract.ContractAmount}:{contract.ContractSum}:{contract.DiscountID_id}:{contract.PaymentTypeID_id}:'
+            f'{sorted(discounts)}:{dop_sum}'
+        )
+        version_hash = hashlib.sha1(version.encode()).hexdigest()[:16]
+        return f'{cls.CACHE_PREFIX}_{contract.id}_{version_hash}'
+
+    def _chunks(self, contract_ids):
+        contract_ids = list(dict.fromkeys(contract_ids))
+        for i in range(0, len(contract_ids), self.CHUNK_SIZE):
+            yield contract_ids[i:i + self.CHUNK_SIZE]
+
+    def load_versions(self, contract_ids) -> tuple:
+        """
+            Скидки [(id скидки, процент)] в порядке применения и сумма доп. соглашений для набора договоров -
+            по одному запросу на таблицу. Входят в ключ кэша: новая скидка или доп. соглашение дают новый график
+        """
+
+        discounts = defaultdict(list)
+        dop_sums = {}
+
+        for chunk in self._chunks(contract_ids):
+            contract_discounts = ContractDiscountMS.objects.using('ms_sql') \
+                .filter(ContractID__in=chunk, DiscountID__isnull=False) \
+                .order_by('id').values_list('ContractID', 'DiscountID', 'DiscountID__iDiscountPercent')
+            for contract_id, discount_id, percent in contract_discounts:
+                discounts[contract_id].append((discount_id, int(percent or 0)))
+
+            contract_dops = ContractDopMS.objects.using('ms_sql').filter(agreement_id__in=chunk) \
+                .values('agreement_id').annotate(total=Sum('amount'))
+            for row in contract_dops:
+                dop_sums[row['agreement_id']] = row['total'] or 0
+
+        return discounts, dop_sums
+
+    def load_month_pays(self, contract_ids) -> dict:
+        """ Строки графика (PayDateM, QuarterDig) в порядке id для набора договоров """
+
+        month_pays = defaultdict(list)
+        for chunk in self._chunks(contract_ids):
+            contract_month_pays = ContractMonthPayMS.objects.using('ms_sql').filter(ContractID__in=chunk) \
+                .order_by('id').values_list('ContractID', 'PayDateM', 'QuarterDig')
+            for contract_id, pay_date, quarter_dig in contract_month_pays:
+                month_pays[contract_id].append((pay_date, quarter_dig))
+
+        return month_pays
+
+    def get_schedules(self, contracts) -> dict:
+        """ Графики для набора договоров: {id договора: график}. Отсутствующие в кэше считаются пакетно """
+
+        contracts = list(contracts)
+        discounts, dop_sums = self.load_versions([contract.id for contract in contracts])
+        cache_keys = {
+            self.get_cache_key(contract, discounts.get(contract.id, []), dop_sums.get(contract.id, 0)): contract
+            for contract in contracts
+        }
+        cached = cache.get_many(list(cache_keys.keys()))
+
+        schedules = {cache_keys[key].id: schedule for key, schedule in cached.items()}
+        missing = {key: contract for key, contract in cache_keys.items() if key not in cached}
+
+        if missing:
+            month_pays = self.load_month_pays([contract.id for contract in missing.values()])
+            calculated = {}
+            for key, contract in missing.items():
+                schedule = self.calculate_schedule(
+                    contract.ContractAmount,
+                    [percent for discount_id, percent in discounts.get(contract.id, [])],
+                    dop_sums.get(contract.id, 0),
+                    month_pays.get(contract.id, []),
+                )
+                schedules[contract.id] = schedule
+                calculated[key] = schedule
+
+            cache.set_many(calculated, timeout=self.CACHE_TIMEOUT)
+
+        return schedules
+
+    def get_schedule(self, contract) -> dict:
+        return self.get_schedules([contract])[contract.id]
@@ -0,0 +1,219 @@
+import logging
+import time
+from io import BytesIO
+
+from django.core.cache import cache
+from docx.shared import Inches
+
+from .services_docx import DocxTemplateCache
+
+logger = logging.getLogger(__name__)
+
+
+class ContractStampError(Exception):
+    """ Основа для штампа не подходит (не найдены якоря QR-кодов) - нужен полный рендер """
+
+
+class ContractPdfStamper:
+    """
+        QR-коды подписей накладываются на готовый PDF вместо повторного рендера DOCX через LibreOffice.
+        Основа - подписанный шаблон договора, отрендеренный один раз: на месте каждой картинки
+        белая заглушка того же размера, вставленная так же, как QR-код при полном рендере (верстка страниц совпадает).
+        Заглушки разных плейсхолдеров отличаются размером в пикселях, по нему в PDF находятся
+        их координаты (якоря) - в тексте документа ничего лишнего не остается.
+        Основа хранится в ContractRenderCache, якоря - в кэше Django по хэшу PDF основы.
+        При подписании остается наложить картинки (reportlab) на страницы основы (pypdf).
+    """
+
+    VARIANT = 'stamp_base'
+
+    # Заглушка плейсхолдера с номером i - (i + 2) x 3 пикселя
+    SPACER_HEIGHT = 3
+
+    ANCHORS_KEY = 'contract_stamp_anchors:{}'
+    ANCHORS_TIMEOUT = 30 * 24 * 60 * 60
+
+    IDENTITY = (1, 0, 0, 1, 0, 0)
+
+    _spacers = {}
+
+    @classmethod
+    def get_spacer_size(cls, index) -> tuple:
+        return index + 2, cls.SPACER_HEIGHT
+
+    @classmethod
+    def get_spacer(cls, index) -> bytes:
+        """ Белый PNG размера get_spacer_size(index), растягивается до размера QR-кода """
+
+        if index not in cls._spacers:
+            from PIL import Image
+
+            buffer = BytesIO()
+            Image.new('RGB', cls.get_spacer_size(index), (255, 255, 255)).save(buffer, format='PNG')
+            cls._spacers[index] = buffer.getvalue()
+        return cls._spacers[index]
+
+    @classmethod
+    def anchor_callback(cls, index, size):
+        """ Обработчик плейсхолдера картинки для основы: заглушка size x size дюймов на месте QR-кода """
+
+        def callback(slot):
+            slot.run.add_picture(BytesIO(cls.get_spacer(index)), width=Inches(size), height=Inches(size))
+        return callback
+
+    @staticmethod
+    def multiply(m1, m2) -> tuple:
+        """ Произведение матриц преобразования PDF [a b c d e f] """
+
+        return (
+            m1[0] * m2[0] + m1[1] * m2[2],
+            m1[0] * m2[1] + m1[1] * m2[3],
+            m1[2] * m2[0] + m1[3] * m2[2],
+            m1[2] * m2[1] + m1[3] * m2[3],
+            m1[4] * m2[0] + m1[5] * m2[2] + m2[4],
+            m1[4] * m2[1] + m1[5] * m2[3] + m2[5],
+        )
+
+    @classmethod
+    def find_images(cls, reader, contents, resources, ctm, found) -> None:
+        """ Картинки потока страницы (и вложенных форм): found - [((ширина, высота) в пикселях, матрица)] """
+
+        from pypdf.generic import ContentStream
+
+        xobjects = resources.get('/XObject')
+        xobjects = xobjects.get_object() if xobjects is not None else {}
+
+        stack = []
+        for operands, operator in ContentStream(contents, reader).operations:
+            if operator == b'q':
+                stack.append(ctm)
+            elif operator == b'Q':
+                ctm = stack.pop() if stack else cls.IDENTITY
+            elif operator == b'cm':
+                ctm = cls.multiply([float(value) for value in operands], ctm)
+            elif operator == b'Do' and operands[0] in xobjects:
+                xobject = xobjects[operands[0]].get_object()
+                if xobject.get('/Subtype') == '/Image':
+                    found.append(((int(xobject['/Width']), int(xobject['/Height'])), ctm))
+                elif xobject.get('/Subtype') == '/Form':
+                    matrix = [float(value) for value in xobject.get('/Matrix', cls.IDENTITY)]
+                    form_resources = xobject.get('/Resources')
+                    cls.find_images(
+                        reader, xobject,
+                        form_resources.get_object() if form_resources is not None else resources,
+                        cls.multiply(matrix, ctm), found,
+                    )
+
+    @classmethod
+    def find_anchors(cls, pdf_content, names) -> dict:
+        """
+            {плейсхолдер: [(страница, x, y, ширина, высота)]} - прямоугольник заглушки в пунктах PDF.
+            names - плейсхолдеры в порядке номеров заглушек.
+        """
+
+        from pypdf import PdfReader
+
+        names_by_size = {cls.get_spacer_size(index): name for index, name in enumerate(names)}
+
+        anchors = {}
+        reader = PdfReader(BytesIO(pdf_content))
+
+        for page_index, page in enumerate(reader.pages):
+            contents = page.get_contents()
+            if contents is None:
+                continue
+
+            found = []
+            cls.find_images(reader, contents, page.get('/Resources', {}), cls.IDENTITY, found)
+            for size, (a, b, c, d, e, f) in found:
+                if size in names_by_size:
+                    anchors.setdefault(names_by_size[size], []).append(
+                        (page_index, round(e, 2), round(f, 2), round(a, 2), round(d, 2))
+                    )
+
+        return anchors
+
+    @classmethod
+    def get_anchors(cls, pdf_content, names) -> dict:
+        from .services_render_cache import ContractRenderCache
+
+        key = cls.ANCHORS_KEY.format(ContractRenderCache.digest(pdf_content))
+        anchors = cache.get(key)
+        if anchors is None:
+            anchors = cls.find_anchors(pdf_content, names)
+            cache.set(key, anchors, timeout=cls.ANCHORS_TIMEOUT)
+        return anchors
+
+    @classmethod
+    def build_overlay(cls, page, items):
+        """ Страница PDF размера page с картинками items [(байты, x, y, ширина, высота в пунктах)] """
+
+        from pypdf import PdfReader
+        from reportlab.lib.utils import ImageReader
+        from reportlab.pdfgen import canvas
+
+        buffer = BytesIO()
+        overlay = canvas.Canvas(buffer, pagesize=(float(page.mediabox.width), float(page.mediabox.height)))
+        for image, x, y, width, height in items:
+            overlay.drawImage(ImageReader(BytesIO(image)), x, y, width=width, height=height, mask='auto')
+        overlay.save()
+
+        buffer.seek(0)
+        return PdfReader(buffer).pages[0]
+
+    @classmethod
+    def stamp(cls, pdf_content, anchors, images) -> bytes:
+        """
+            images - {плейсхолдер: (байты или функция, возвращающая байты, размер в дюймах)},
+            картинка занимает прямоугольник заглушки из anchors
+        """
+
+        from pypdf import PdfReader, PdfWriter
+
+        by_page = {}
+        for name, (image, size) in images.items():
+            image = image() if callable(image) else image
+            if not image:
+                continue
+            for page_index, x, y, width, height in anchors.get(name, []):
+                by_page.setdefault(page_index, []).append((image, x, y, width, height))
+
+        reader = PdfReader(BytesIO(pdf_content))
+        writer = PdfWriter()
+        for page_index, page in enumerate(reader.pages):
+            if page_index in by_page:
+                page.merge_page(cls.build_overlay(page, by_page[page_index]))
+            writer.add_page(page)
+
+        output = BytesIO()
+        writer.write(output)
+        return output.getvalue()
+
+    @classmethod
+    def render(cls, template_path, images, render_base) -> bytes:
+        """
+            PDF подписанного договора штампом по основе.
+            render_base(callbacks, variant) - рендер шаблона с дополнительными обработчиками плейсхолдеров
+            (тот же, что и для полного документа, чтобы значения и таблицы совпадали).
+            ContractStampError - якоря не найдены, вызывающий делает полный рендер.
+        """
+
+        expected = sorted(DocxTemplateCache.get(template_path).placeholders & set(images))
+        callbacks = {name: cls.anchor_callback(index, images[name][1]) for index, name in enumerate(expected)}
+
+        base = render_base(callbacks, cls.VARIANT)
+
+        started = time.perf_counter()
+        try:
+            anchors = cls.get_anchors(base, expected)
+        except Exception as e:
+            raise ContractStampError(f'Stamp anchors not read: {e}')
+
+        missing = set(expected) - set(anchors)
+        if missing:
+            raise ContractStampError(f'Stamp anchors not found: {", ".join(sorted(missing))}')
+
+        pdf_content = cls.stamp(base, anchors, {name: images[name] for name in expected})
+        logger.info(f'Contract stamped {len(expected)} images in {(time.perf_counter() - started) * 1000:.0f}ms')
+
+        return pdf_content
@@ -0,0 +1,136 @@
+import logging
+import os
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+
+from . import ContractVariable
+from .models import CompiledContractTemplate, MarkedUpContractTemplate, RawContractTemplate
+from .services_converter import convert_doc_to_docx
+from .services_docx import CompiledDocxTemplate
+
+logger = logging.getLogger(__name__)
+
+
+class ContractTemplateCompiler:
+    """
+        Компиляция загруженных шаблонов договоров (RawContractTemplate, MarkedUpContractTemplate).
+        При загрузке файл синхронно проверяется, затем задача compile_contract_template один раз
+        конвертирует .doc в .docx, собирает разбитые Word плейсхолдеры в один run и сохраняет
+        нормализованный DOCX (compiled_file) и список переменных (placeholders, unknown_placeholders).
+        Артефакт служит проверке и разметке шаблона: договоры рендерятся по шаблонам ContractTemplateRegistry.
+    """
+
+    MODELS = {
+        RawContractTemplate._meta.model_name: RawContractTemplate,
+        MarkedUpContractTemplate._meta.model_name: MarkedUpContractTemplate,
+    }
+
+    DOC_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+    DOCX_SIGNATURE = b'PK\x03\x04'
+
+    # Плейсхолдеры, которые заполняются сервисами, а не переменными договора (QR-коды подписей)
+    SERVICE_PLACEHOLDERS = (
+        'QRCode', 'QRCodeSignature', 'QRcodeDirector', 'QRCodeDirector2', 'QRCodeDirectorOmarov',
+        'QRCodeDirectorSerikov', 'QRCodeDataSigned', 'QRCodeTextRus', 'QRCodeTextKaz',
+    )
+
+    @staticmethod
+    def get_variables() -> dict:
+        """ {имя плейсхолдера: описание} из ContractVariable """
+
+        return {value.strip('{}'): label for value, label in ContractVariable.choices}
+
+    @staticmethod
+    def read(file) -> bytes:
+        file.open('rb')
+        file.seek(0)
+        data = file.read()
+        file.seek(0)
+        return data
+
+    @classmethod
+    def to_docx(cls, data) -> bytes:
+        if data.startswith(cls.DOCX_SIGNATURE):
+            return data
+        if data.startswith(cls.DOC_SIGNATURE):
+            return convert_doc_to_docx(data)
+        raise ValueError('Файл не является документом Word (.doc, .docx)')
+
+    @classmethod
+    def get_unknown(cls, placeholders) -> list:
+        known = set(cls.get_variables()) | set(cls.SERVICE_PLACEHOLDERS)
+        return sorted(name for name in placeholders if name not in known)
+
+    @classmethod
+    def validate(cls, file) -> list:
+        """
+            Синхронная проверка загружаемого файла. Для .docx - разбор и список найденных переменных,
+            .doc проверяется только по сигнатуре (конвертация - в фоновой задаче).
+        """
+
+        data = cls.read(file)
+        if data.startswith(cls.DOC_SIGNATURE):
+            return []
+        if not data.startswith(cls.DOCX_SIGNATURE):
+            raise ValueError('Файл не является документом Word (.doc, .docx)')
+
+        try:
+            template = CompiledDocxTemplate(data)
+        except Exception as e:
+            raise ValueError(f'Не удалось прочитать документ: {e}')
+
+        return sorted(template.placeholders)
+
+    @classmethod
+    def compile(cls, instance) -> CompiledContractTemplate:
+        previous = instance.compiled_file.name if instance.compiled_file else None
+
+        try:
+            template = CompiledDocxTemplate(cls.to_docx(cls.read(instance.file)))
+
+            name = f'{os.path.splitext(os.path.basename(instance.file.name))[0]}.docx'
+            instance.compiled_file.save(name, ContentFile(template.to_bytes()), save=False)
+            instance.placeholders = sorted(template.placeholders)
+            instance.unknown_placeholders = cls.get_unknown(template.placeholders)
+            instance.compile_status = CompiledContractTemplate.SUCCESS
+            instance.compile_error = None
+        except Exception as e:
+            logger.exception(f'Contract template {instance._meta.model_name} {instance.pk} not compiled')
+            instance.compile_status = CompiledContractTemplate.FAILURE
+            instance.compile_error = str(e)
+
+        instance.compiled_at = timezone.now()
+        instance.save(update_fields=[
+            'compiled_file', 'placeholders', 'unknown_placeholders',
+            'compile_status', 'compile_error', 'compiled_at',
+        ])
+
+        if previous and previous != instance.compiled_file.name:
+            instance.compiled_file.storage.delete(previous)
+
+        if instance.unknown_placeholders:
+            logger.warning(f'Contract template {instance._meta.model_name} {instance.pk} has unknown placeholders: '
+                           f'{", ".join(instance.unknown_placeholders)}')
+
+        return instance
+
+    @classmethod
+    def compile_by_id(cls, model_name, template_id) -> str:
+        instance = cls.MODELS[model_name].objects.filter(pk=template_id).first()
+        if instance is None:
+            return None
+        return cls.compile(instance).compile_status
+
+    @classmethod
+    def enqueue(cls, instance) -> None:
+        """ Компиляция в фоне после фиксации транзакции сохранения шаблона """
+
+        from .tasks import compile_contract_template
+
+        type(instance).objects.filter(pk=instance.pk).update(compile_status=CompiledContractTemplate.PENDING)
+        instance.compile_status = CompiledContractTemplate.PENDING
+
+        model_name, template_id = instance._meta.model_name, instance.pk
+        transaction.on_commit(lambda: compile_contract_template.delay(model_name, template_id))
@@ -0,0 +1,177 @@
+import logging
+import threading
+from pathlib import Path
+
+from .services_docx import DocxTemplateCache
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_DIR = Path(__file__).resolve().parent / 'templates' / 'contract'
+
+
+class ContractTemplateRegistry:
+    """
+        Реестр шаблонов договоров на обучение.
+        Ключ: (вариант, отделение, направление, доп. соглашение) -> {тип оплаты: файл шаблона}.
+        Вариант UNSIGNED - договор для скачивания до подписания, SIGNED - договор с QR-кодами подписей.
+        Пути не зависят от текущего каталога процесса, байты шаблонов загружаются в память один раз (preload).
+    """
+
+    UNSIGNED = 'unsigned'
+    SIGNED = 'signed'
+
+    KAZ = 'kaz'
+    RUS = 'rus'
+
+    MONTH = 'month'
+    QUARTER = 'quarter'
+    YEAR = 'year'
+
+    # Направление не влияет на выбор шаблона
+    ANY = '*'
+
+    CAMBRIDGE = 'Кембридж'
+    LINGVO = 'Лингвинистический'
+    PHYSMATH = 'Физико-математический'
+    AP = 'Американская школа Advanced Placement'
+    IT = 'IT-школа на Кекилбайулы'
+
+    DIRECT_ALIASES = {
+        'Физико-Математическая': PHYSMATH,
+    }
+
+    PAYMENT_TYPES = {
+        'Оплата по месячно': MONTH,
+        'Оплата по квартально': QUARTER,
+    }
+
+    @staticmethod
+    def by_payment(name, month='_по_месячно', quarter='_по_квартально', year='_за_год') -> dict:
+        return {
+            ContractTemplateRegistry.MONTH: f'{name}{month}.docx',
+            ContractTemplateRegistry.QUARTER: f'{name}{quarter}.docx',
+            ContractTemplateRegistry.YEAR: f'{name}{year}.docx',
+        }
+
+    @classmethod
+    def get_templates(cls) -> dict:
+        by_payment = cls.by_payment
+        school_payment = {'month': '_оплата_по_месячно', 'quarter': '_оплата_по_квартально', 'year': '_оплата_за_год'}
+
+        return {
+            # Договоры до подписания
+            (cls.UNSIGNED, cls.KAZ, cls.ANY, True): by_payment(
+                'Шаблон_Договор_оказания_дополнительных_образовательных_услуг_КАЗ_ОТД'),
+            (cls.UNSIGNED, cls.KAZ, cls.ANY, False): by_payment(
+                'Шаблон_Договор_оказания_образовательных_услуг_КАЗ_ОТД_ТОО'),
+            (cls.UNSIGNED, cls.RUS, cls.CAMBRIDGE, False): by_payment(
+                'Шаблон_Договор_оказания_образовательных_услуг_Кэмбридж_2023_2024'),
+            (cls.UNSIGNED, cls.RUS, cls.LINGVO, True): by_payment(
+                'Шаблон_Договор_оказания_дополнительных_образовательных_услуг_Лингво_2023'),
+            (cls.UNSIGNED, cls.RUS, cls.PHYSMATH, True): by_payment(
+                'Шаблон_Договор_оказания_дополнительных_образовательных_услуг_Физмат'),
+            (cls.UNSIGNED, cls.RUS, cls.AP, True): by_payment(
+                'Шаблон_Договор_оказания_дополнительных_образовательных_услуг_AP_2023_2024'),
+            (cls.UNSIGNED, cls.RUS, cls.IT, True): by_payment(
+                'Шаблон_Договор_оказания_дополнительных_образовательных_услуг_IT_отделение'),
+            (cls.UNSIGNED, cls.RUS, cls.ANY, False): by_payment(
+                'Шаблон_Договор_оказания_образовательных_услуг_Школа_2023_2024', **school_payment),
+
+            # Договоры с QR-кодами подписей
+            (cls.SIGNED, cls.KAZ, cls.ANY, True): by_payment(
+                'Договор_оказания_дополнительных_образовательных_услуг_КАЗ_ОТД_ТОО'),
+            (cls.SIGNED, cls.KAZ, cls.ANY, False): by_payment(
+                'Договор_оказания_образовательных_услуг_КАЗ_ОТД_ТОО'),
+            (cls.SIGNED, cls.RUS, cls.CAMBRIDGE, False): {
+                cls.MONTH: 'Договор оказания образовательных услуг Кэмбридж 2025-2026 УО_по_месячно.docx',
+                cls.QUARTER: 'Договор_оказания_образовательных_услуг_Кэмбридж_2023_2024_оплата_по_квартально.docx',
+                cls.YEAR: 'Договор_оказания_образовательных_услуг_Кэмбридж_2023_2024_оплата_за_год.docx',
+            },
+            (cls.SIGNED, cls.RUS, cls.LINGVO, True): by_payment(
+                'Договор_оказания_дополнительных_образовательных_услуг_Лингво_2023'),
+            (cls.SIGNED, cls.RUS, cls.PHYSMATH, True): by_payment(
+                'Договор_оказания_дополнительных_образовательных_услуг_Физмат_Нур'),
+            (cls.SIGNED, cls.RUS, cls.AP, True): by_payment(
+                'Договор_оказания_дополнительных_образовательных_услуг_AP_2023_2024'),
+            (cls.SIGNED, cls.RUS, cls.IT, True): by_payment(
+                'Договор_оказания_дополнительных_образовательных_услуг_IT_отделение'),
+            (cls.SIGNED, cls.RUS, cls.ANY, False): by_payment(
+                'Договор_оказания_образовательных_услуг_Школа_2023_2024', **school_payment),
+        }
+
+    _templates = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def templates(cls) -> dict:
+        if cls._templates is None:
+            cls._templates = cls.get_templates()
+        return cls._templates
+
+    @classmethod
+    def get_key(cls, variant, school_language, school_direct, is_dop_contract) -> tuple:
+        """ Измерения договора -> ключ реестра """
+
+        if school_language == 'Казахское отделение':
+            return variant, cls.KAZ, cls.ANY, bool(is_dop_contract)
+
+        school_direct = cls.DIRECT_ALIASES.get(school_direct, school_direct)
+        if school_direct == cls.CAMBRIDGE:
+            # Для Кембриджа доп. соглашение использует шаблон основного договора
+            return variant, cls.RUS, cls.CAMBRIDGE, False
+        if is_dop_contract:
+            return variant, cls.RUS, school_direct, True
+
+        return variant, cls.RUS, cls.ANY, False
+
+    @classmethod
+    def resolve(cls, contract, is_dop_contract, variant=UNSIGNED):
+        """ Абсолютный путь к шаблону договора или None, если шаблона для такого договора нет """
+
+        school = contract.SchoolID
+        key = cls.get_key(
+            variant, getattr(school, 'sSchool_language', None), getattr(school, 'sSchool_direct', None),
+            is_dop_contract
+        )
+        payment_type = getattr(contract.PaymentTypeID, 'sPaymentType', None)
+
+        templates = cls.templates().get(key)
+        if templates is None:
+            return None
+
+        return str(TEMPLATES_DIR / templates[cls.PAYMENT_TYPES.get(payment_type, cls.YEAR)])
+
+    @classmethod
+    def get_template(cls, contract, is_dop_contract, variant=UNSIGNED):
+        """ Скомпилированный шаблон договора или None """
+
+        path = cls.resolve(contract, is_dop_contract, variant)
+        if path is None:
+            return None
+
+        return DocxTemplateCache.get(path)
+
+    @classmethod
+    def get_paths(cls) -> list:
+        return sorted({
+            str(TEMPLATES_DIR / name) for templates in cls.templates().values() for name in templates.values()
+        })
+
+    @classmethod
+    def preload(cls, compile_templates=True) -> int:
+        """ Загрузка всех шаблонов реестра в память процесса. Вызывается при старте воркеров """
+
+        loaded = 0
+        with cls._lock:
+            for path in cls.get_paths():
+                try:
+                    if compile_templates:
+                        DocxTemplateCache.get(path)
+                    else:
+                        DocxTemplateCache.load_bytes(path)
+                    loaded += 1
+                except FileNotFoundError:
+                    logger.error(f'Contract template not found: {path}')
+
+        logger.info(f'Contract templates preloaded: {loaded}')
+        return loaded
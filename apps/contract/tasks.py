@@ -0,0 +1,106 @@
+import logging
+import time
+
+from celery import chord, shared_task
+
+from .services_arrears import ContractArrearsLedgerService
+from .services_locator import ContractLocator
+from .services_pregeneration import ContractPregenerationService
+from .services_render_jobs import ContractRenderJobService
+from .services_template_compile import ContractTemplateCompiler
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def sync_arrears_ledger(full=False):
+    """
+        Синхронизация витрины задолженности по всем типам договоров.
+        Расписание задается в django_celery_beat (периодичность должна быть меньше ARREARS_LEDGER_MAX_AGE),
+        полный пересчет (full=True) - отдельной ночной задачей.
+    """
+
+    return {
+        contract_type: ContractArrearsLedgerService(contract_type).sync(full=full)
+        for contract_type in (
+            ContractArrearsLedgerService.STUDY,
+            ContractArrearsLedgerService.FOOD,
+            ContractArrearsLedgerService.DRIVER,
+        )
+    }
+
+
+@shared_task
+def sync_contract_index():
+    """ Полная синхронизация индекса номеров договоров (ContractLocator) с MS SQL """
+
+    return ContractLocator.sync()
+
+
+@shared_task
+def render_contract_job(job_id):
+    """ Генерация PDF договора по задаче ContractRenderJob """
+
+    return ContractRenderJobService().run(job_id)
+
+
+@shared_task
+def prepare_contract_stamp_base(contract_num, is_dop_contract=False):
+    """ Основа подписанного договора для штампа QR-кодов (ставится после генерации неподписанного PDF) """
+
+    from .contract_signature_service import ContractSignatureService
+
+    contract = ContractLocator.get_contract(contract_num)
+    if contract is None:
+        return False
+
+    return ContractSignatureService().prepare_stamp_base(contract, is_dop_contract)
+
+
+@shared_task
+def pregenerate_contracts(edu_year_id, school_id=None, batch_size=50, queue=None):
+    """
+        Массовая генерация PDF договоров учебного года: chord из пачек render_contract_batch
+        и итог pregenerate_contracts_report. Параллельность ограничивается числом процессов воркеров,
+        обслуживающих очередь queue (например, отдельный воркер с --concurrency).
+        Повторный запуск берет только договоры без готового файла.
+    """
+
+    batches = ContractPregenerationService.get_batches(edu_year_id, school_id, batch_size)
+    if not batches:
+        return {'batches': 0, 'contracts': 0}
+
+    options = {'queue': queue} if queue else {}
+    header = [render_contract_batch.s(batch).set(**options) for batch in batches]
+    callback = pregenerate_contracts_report.s(edu_year_id, school_id, time.time()).set(**options)
+    chord(header)(callback)
+
+    contracts = sum(len(batch) for batch in batches)
+    logger.info(f'Contract pregeneration queued: edu year {edu_year_id}, school {school_id}, '
+                f'{contracts} contracts in {len(batches)} batches')
+
+    return {'batches': len(batches), 'contracts': contracts}
+
+
+@shared_task
+def render_contract_batch(contract_ids):
+    """ Генерация PDF пачки договоров (часть chord pregenerate_contracts) """
+
+    return ContractPregenerationService.render_batch(contract_ids)
+
+
+@shared_task
+def pregenerate_contracts_report(results, edu_year_id, school_id=None, started_at=None):
+    summary = ContractPregenerationService.summarize(results, started_at)
+
+    logger.info(f'Contract pregeneration finished: edu year {edu_year_id}, school {school_id}, '
+                f'rendered {summary["rendered"]}, failed {summary["failed"]}, {summary.get("per_second")}/s')
+
+    return summary
+
+
+@shared_task
+def compile_contract_template(model_name, template_id):
+    """ Компиляция загруженного шаблона договора (RawContractTemplate / MarkedUpContractTemplate) """
+
+    return ContractTemplateCompiler.compile_by_id(model_name, template_id)
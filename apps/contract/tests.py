@@ -1,3 +1,163 @@
-from django.test import TestCase
+import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.db.models import Q
+from django.test import SimpleTestCase
+
+from apps.contract.services_arrears import ContractArrearsService
+from apps.contract.services_pipeline import ContractRenderPipeline
+from apps.contract.services_schedule import ContractScheduleService
+
+
+def month_pays(quarters):
+    """ Строки графика (PayDateM, QuarterDig): quarters - число месяцев в каждом квартале, с сентября """
+
+    rows = []
+    pay_date = datetime.date(2024, 9, 10)
+    for quarter_dig, count in enumerate(quarters, start=1):
+        for _ in range(count):
+            rows.append((pay_date, quarter_dig))
+            pay_date = (pay_date.replace(day=1) + datetime.timedelta(days=32)).replace(day=10)
+    return rows
+
+
+class ContractScheduleTest(SimpleTestCase):
+    def test_discounts_and_month_sum(self):
+        schedule = ContractScheduleService.calculate_schedule(100000, [10, 5], 4500, month_pays([3, 2, 3, 1]))
+
+        # Скидки последовательно: 100000 - 10% = 90000, затем - 5% = 85500
+        self.assertEqual(schedule['amount_with_discount'], 85500.0)
+        # В API месячный платеж - с доп. соглашениями и без округления
+        self.assertEqual(schedule['month_sum'], 10000.0)
+        # В документе - без доп. соглашений, вверх до тенге
+        self.assertEqual(schedule['document_month_sum'], 9500)
+        self.assertEqual(len(schedule['months']), 9)
+        self.assertEqual(
+            [(quarter['QuarterDig'], quarter['MonthCount'], quarter['QuarterSum']) for quarter in schedule['quarters']],
+            [(1, 3, 28500), (2, 2, 19000), (3, 3, 28500), (4, 1, 9500)],
+        )
+        self.assertEqual(schedule['quarters'][1]['PayDateM'], datetime.date(2024, 12, 10))
+
+    def test_round_up_month_sum(self):
+        # Сумма с копейками делится целиком, whole_amount - только целая часть
+        self.assertEqual(ContractScheduleService.round_up_month_sum(90000.5), 10001)
+        self.assertEqual(ContractScheduleService.round_up_month_sum(90000.5, whole_amount=True), 10000)
+        self.assertEqual(ContractScheduleService.round_up_month_sum(90001), 10001)
+        self.assertEqual(ContractScheduleService.round_up_month_sum(90001, whole_amount=True), 10001)
+
+    def get_document_schedule(self, is_dop_contract, whole_amount, dop_amount='-45000.70'):
+        schedule = ContractScheduleService.calculate_schedule(
+            Decimal('100000.50'), [10], 0, month_pays([3, 3, 3])
+        )
+        dop_contract = SimpleNamespace(ContractAmount=dop_amount)
+        contract_ms = SimpleNamespace(objects=mock.MagicMock())
+        contract_ms.objects.using.return_value.filter.return_value.first.return_value = dop_contract
+
+        with mock.patch.object(ContractScheduleService, 'get_schedule', return_value=schedule), \
+                mock.patch('apps.contract.services_pipeline.ContractMS', contract_ms):
+            return ContractRenderPipeline.get_schedule(
+                SimpleNamespace(ContractNum='Д-1'), is_dop_contract, whole_amount
+            )
+
+    def test_document_month_sum(self):
+        # 100000.50 - 10% = 90000.45
+        self.assertEqual(self.get_document_schedule(False, whole_amount=False)['document_month_sum'], 10001)
+        self.assertEqual(self.get_document_schedule(False, whole_amount=True)['document_month_sum'], 10000)
+
+    def test_dop_contract_month_sum(self):
+        # Доп. соглашение: модуль целой части его суммы без скидок, независимо от whole_amount
+        for whole_amount in (True, False):
+            with self.subTest(whole_amount=whole_amount):
+                schedule = self.get_document_schedule(True, whole_amount)
+                self.assertEqual(schedule['document_month_sum'], 5000)
+                self.assertEqual(schedule['amount_with_discount'], 90000.45)
+
+
+class FakeQuerySet:
+    """ Сгруппированный запрос MS SQL: возвращает rows, аргументы annotate запоминаются """
+
+    def __init__(self, rows) -> None:
+        self.rows = rows
+        self.aggregates = None
+        self.objects = self
+
+    def using(self, alias):
+        return self
+
+    def filter(self, **kwargs):
+        return self
+
+    def values(self, *fields):
+        return self
+
+    def annotate(self, **aggregates):
+        self.aggregates = aggregates
+        return self.rows
+
+
+class ContractArrearsTest(SimpleTestCase):
+    def test_calculate(self):
+        for planned, paid, arrears in (
+            (90000, 89000.25, 1000),
+            (90000, 89999.5, 0),
+            (90000, 89999, 1),
+            (90000, 95000, 0),
+            (100.004, 0, 100),
+            (100.006, 0, 101),
+            (0, 0, 0),
+            (0, 5000, 0),
+        ):
+            with self.subTest(planned=planned, paid=paid):
+                self.assertEqual(ContractArrearsService.calculate(planned, paid), arrears)
+
+    def get_totals(self, contract_type, transaction_rows, month_pay_rows, contract_ids):
+        service = ContractArrearsService(contract_type)
+        transactions = FakeQuerySet(transaction_rows)
+        service.source = {
+            **service.source,
+            'transaction_model': transactions,
+            'month_pay_model': FakeQuerySet(month_pay_rows),
+        }
+        return service.get_totals(contract_ids), transactions.aggregates
+
+    def test_study_contributions_not_paid(self):
+        totals, aggregates = self.get_totals(
+            ContractArrearsService.STUDY,
+            [
+                {'agreement_id': 1, 'count': 3, 'paid': Decimal('80000.00'), 'contribution': Decimal('5000.00')},
+                {'agreement_id': 2, 'count': 1, 'paid': Decimal('90000.00'), 'contribution': None},
+            ],
+            [
+                {'ContractID': 1, 'total': Decimal('90000.00')},
+                {'ContractID': 2, 'total': Decimal('90000.00')},
+                {'ContractID': 3, 'total': Decimal('45000.00')},
+            ],
+            [1, 2, 3],
+        )
+
+        self.assertEqual(aggregates['paid'].filter, Q(contribution=False))
+        self.assertEqual(aggregates['contribution'].filter, Q(contribution=True))
+        self.assertEqual(totals[1], {
+            'planned': 90000.0, 'paid': 80000.0, 'contribution': 5000.0, 'count': 3, 'arrears': 10000,
+        })
+        self.assertEqual(totals[2]['contribution'], 0.0)
+        self.assertEqual(totals[2]['arrears'], 0)
+        # Без транзакций: задолженность - весь план
+        self.assertEqual(totals[3], {
+            'planned': 45000.0, 'paid': 0.0, 'contribution': 0.0, 'count': 0, 'arrears': 45000,
+        })
+
+    def test_food_without_contributions(self):
+        totals, aggregates = self.get_totals(
+            ContractArrearsService.FOOD,
+            [{'contract_id': 5, 'count': 2, 'paid': Decimal('1200.40')}],
+            [{'ContractID': 5, 'total': Decimal('3000.00')}],
+            [5],
+        )
+
+        self.assertNotIn('contribution', aggregates)
+        self.assertIsNone(aggregates['paid'].filter)
+        self.assertEqual(totals[5]['contribution'], 0.0)
+        self.assertEqual(totals[5]['arrears'], 1800)
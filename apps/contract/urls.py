@@ -5,6 +5,7 @@ from .views import (
     Contract,
     ContractFood,
     ContractDriver,
+    FamilyDashboard,
     SignContractWithEDS,
     ContractDownload,
     RawContractTemplateView,
@@ -16,13 +17,16 @@ from .views import (
     ContractSignaturesView,
     SignatureValidityView,
     ContractSigningDataView,
-    ContractSigningWebView
+    ContractSigningWebView,
+    ContractRenderJobView,
+    ContractRenderCacheView
 )
 
 router = DefaultRouter()
 router.register("study", Contract, basename="study")
 router.register("food", ContractFood, basename="food")
 router.register("driver", ContractDriver, basename="driver")
+router.register("family", FamilyDashboard, basename="family")
 router.register("download", ContractDownload, basename="download")
 router.register("sign", SignContractWithEDS, basename="sign")
 router.register("raw-template", RawContractTemplateView, basename="raw contract template")
@@ -45,6 +49,12 @@ contract_signature_patterns = [
     path('contracts/<str:contract_num>/sign-web/', ContractSigningWebView.as_view(), name='contract-sign-web'),
 
     path('signature-verification/<str:signature_uid>/', SignatureVerificationView.as_view(), name='signature-verification'),
+
+    # Статус фоновой генерации договора
+    path('render-jobs/<uuid:job_id>/', ContractRenderJobView.as_view(), name='contract-render-job'),
+
+    # Статистика кэша готовых PDF
+    path('render-cache/', ContractRenderCacheView.as_view(), name='contract-render-cache'),
 ]
 
 urlpatterns = router.urls
@@ -0,0 +1,80 @@
+"""
+    Мост UNO для пула конвертации (services_converter.SofficeListener).
+    Запускается системным python3 из пакета python3-uno (DOCUMENT_CONVERTER_UNO_PYTHON): интерпретатор приложения
+    из образа python:3.10 модуль uno импортировать не может. Только стандартная библиотека и uno, без Django.
+
+    python3 uno_bridge.py <порт soffice> <таймаут подключения, сек.>
+    После подключения к soffice пишет в stdout {"ok": true} и читает задания из stdin по одному JSON в строке:
+    {"input": путь, "output": путь, "filter": фильтр экспорта} -> {"ok": true} или {"error": текст}.
+"""
+import json
+import sys
+import time
+
+import uno
+from com.sun.star.beans import PropertyValue
+
+
+def properties(**kwargs):
+    values = []
+    for name, value in kwargs.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        values.append(prop)
+    return tuple(values)
+
+
+def connect(port, timeout):
+    local_context = uno.getComponentContext()
+    resolver = local_context.ServiceManager.createInstanceWithContext(
+        'com.sun.star.bridge.UnoUrlResolver', local_context
+    )
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            context = resolver.resolve(f'uno:socket,host=127.0.0.1,port={port};urp;StarOffice.ComponentContext')
+            return context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.25)
+
+
+def convert(desktop, job):
+    document = desktop.loadComponentFromURL(
+        uno.systemPathToFileUrl(job['input']), '_blank', 0, properties(Hidden=True, ReadOnly=True)
+    )
+    try:
+        document.storeToURL(uno.systemPathToFileUrl(job['output']), properties(FilterName=job['filter']))
+    finally:
+        document.close(True)
+
+
+def reply(message):
+    sys.stdout.write(json.dumps(message) + '\n')
+    sys.stdout.flush()
+
+
+def main():
+    port, timeout = int(sys.argv[1]), float(sys.argv[2])
+    try:
+        desktop = connect(port, timeout)
+    except Exception as e:
+        reply({'error': f'UNO connection to port {port} failed: {e}'})
+        return 1
+
+    reply({'ok': True})
+    for line in sys.stdin:
+        try:
+            convert(desktop, json.loads(line))
+        except Exception as e:
+            reply({'error': str(e)})
+        else:
+            reply({'ok': True})
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,14 +11,14 @@ from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 
 from .contract_signature_service import ContractSignatureService
 from .models import ContractMS, ContractDopMS, ContractFoodMS, ContractDriverMS, RawContractTemplate, \
-    MarkedUpContractTemplate, ContractSignature, ContractFileUser
+    MarkedUpContractTemplate, ContractSignature, ContractFileUser, ContractRenderJob
 from .serializers.contract import ContractSerializer, ContractDopMSSerializer
 from .serializers.contract_driver import ContractDriverSerializer
 from .serializers.contract_food import ContractFoodSerializer
@@ -33,6 +33,13 @@ from .serializers.contract_templates import (
 
 from .services import ContractService, ContractDownloadService, ContractFoodService, ContractDriverService
 from .services_eds import SignContractWithEDSService
+from .services_family import FamilyDashboardService
+from .services_locator import ContractLocator
+from .services_pipeline import ContractRenderTimings
+from .services_preview import ContractPreviewService
+from .services_render_cache import ContractRenderCache
+from .services_render_jobs import ContractRenderJobService
+from .services_template_compile import ContractTemplateCompiler
 from .services_report import ContractReportService
 
 from rest_framework import permissions
@@ -89,7 +96,10 @@ class Contract(ModelViewSet):
         #     return Response({'error': 'Скачать договор можно только на текущий год'}, status=status.HTTP_403_FORBIDDEN)
 
         contract_download_service = ContractDownloadService(contract_dop)
-        contract_dop = contract_download_service.contract_download(request, contract_num=contract_dop.ContractNum, is_dop_contract=True)
+        contract_dop = contract_download_service.contract_download(
+            request, contract_num=contract_dop.ContractNum, is_dop_contract=True,
+            wait=ContractRenderJobService.get_wait(request)
+        )
 
         return contract_dop
 
@@ -169,6 +179,21 @@ class ContractDriver(ModelViewSet):
         return contract_student
 
 
+class FamilyDashboard(viewsets.ViewSet):
+    """
+        API сводки по семье: все договоры (обучение, питание, развозка) всех детей родителя
+        с задолженностью и ближайшим платежом одним запросом.
+    """
+
+    permission_classes = [IsAuthenticated]
+    family_dashboard_service = FamilyDashboardService()
+
+    def list(self, request, *args, **kwargs):
+        """ Сводка по договорам детей текущего пользователя """
+
+        return self.family_dashboard_service.get_family_dashboard(request.user)
+
+
 class ContractDownload(ModelViewSet):
     """
         API для скачивания договоров студентов.
@@ -187,31 +212,7 @@ class ContractDownload(ModelViewSet):
             contract_num = parts[0] + '/' + parts[1]
             is_dop_contract = True
 
-        if 'Д' in contract_num:
-            try:
-                contracts = ContractMS.objects.using('ms_sql').all()
-                contract = ContractMS.objects.using('ms_sql').get(ContractNum=contract_num)
-            except ContractMS.DoesNotExist:
-                contract = None
-        elif 'П' in contract_num:
-            try:
-                contract = ContractFoodMS.objects.using('ms_sql').get(ContractNum=contract_num)
-            except ContractFoodMS.DoesNotExist:
-                contract = None
-        elif 'Р' in contract_num:
-            try:
-                contract = ContractDriverMS.objects.using('ms_sql').get(ContractNum=contract_num)
-            except ContractDriverMS.DoesNotExist:
-                contract = None
-        else:
-            try:
-                contract = ContractMS.objects.using('ms_sql').get(ContractNum=contract_num)
-            except ContractMS.DoesNotExist:
-                contract = ContractFoodMS.objects.using('ms_sql').get(ContractNum=contract_num)
-            except ContractFoodMS.DoesNotExist:
-                contract = ContractDriverMS.objects.using('ms_sql').get(ContractNum=contract_num)
-            except ContractDriverMS.DoesNotExist:
-                contract = None
+        contract = ContractLocator.get_contract(contract_num)
 
         self.contract_download_service = ContractDownloadService(contract)
 
@@ -219,18 +220,43 @@ class ContractDownload(ModelViewSet):
 
     @action(methods=['get'], detail=True)
     def contract_download(self, request, *args, **kwargs):
-        """ Скачивание договора по номеру договора """
+        """
+            Скачивание договора по номеру договора.
+            Если PDF еще не сформирован - 202 с id задачи генерации (?wait=<сек.> - дождаться файла)
+        """
 
         try:
             selected_contract, is_dop_contract = self.get_object()
             contract_num = self.contract_download_service.contract_download(
-                request, contract_num=selected_contract.ContractNum, is_dop_contract=is_dop_contract
+                request, contract_num=selected_contract.ContractNum, is_dop_contract=is_dop_contract,
+                wait=ContractRenderJobService.get_wait(request)
             )
         except ValueError as e:
             return JsonResponse({'error': e}, status=status.HTTP_403_FORBIDDEN)
 
         return contract_num
 
+    @action(methods=['get'], detail=True)
+    def contract_preview(self, request, *args, **kwargs):
+        """
+            Предпросмотр неподписанного договора без LibreOffice: HTML (по умолчанию) или PDF (?output=pdf)
+        """
+
+        selected_contract, is_dop_contract = self.get_object()
+        if selected_contract is None:
+            return Response({'error': 'Договор не найден!'}, status=status.HTTP_403_FORBIDDEN)
+
+        preview_service = ContractPreviewService(selected_contract, is_dop_contract)
+        try:
+            if request.query_params.get('output') == 'pdf':
+                response = HttpResponse(preview_service.get_pdf(), content_type='application/pdf')
+                response['Content-Disposition'] = f'inline; filename="{selected_contract.ContractNum}.pdf"'
+                return response
+
+            return HttpResponse(preview_service.get_html(), content_type='text/html; charset=utf-8')
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_403_FORBIDDEN)
+
 
 class SignContractWithEDS(ModelViewSet):
     """
@@ -242,35 +268,9 @@ class SignContractWithEDS(ModelViewSet):
     serializer_class = SignContractWithEDSSerializer
     http_method_names = ['get', 'post']
 
-    def get_contract_ms(self):
-        pk = self.kwargs.get('pk')
-        return ContractMS.objects.using('ms_sql').get(ContractNum=pk)
-
-    def get_contract_food_ms(self):
-        pk = self.kwargs.get('pk')
-        return ContractFoodMS.objects.using('ms_sql').get(ContractNum=pk)
-
-    def get_contract_driver_ms(self):
-        pk = self.kwargs.get('pk')
-        return ContractDriverMS.objects.using('ms_sql').get(ContractNum=pk)
-
     def get_object(self):
         contract_num = str(self.kwargs.get('pk'))
-        if 'Д' in contract_num:
-            contract = self.get_contract_ms()
-        elif 'П' in contract_num:
-            contract = self.get_contract_food_ms()
-        elif 'Р' in contract_num:
-            contract = self.get_contract_driver_ms()
-        else:
-            try:
-                contract = ContractMS.objects.using('ms_sql').get(ContractNum=contract_num)
-            except ContractMS.DoesNotExist:
-                contract = ContractFoodMS.objects.using('ms_sql').get(ContractNum=contract_num)
-            except ContractFoodMS.DoesNotExist:
-                contract = ContractDriverMS.objects.using('ms_sql').get(ContractNum=contract_num)
-            except ContractDriverMS.DoesNotExist:
-                contract = None
+        contract = ContractLocator.get_contract_or_raise(contract_num)
 
         self.sign_contract_with_eds_service = SignContractWithEDSService(contract)
 
@@ -319,6 +319,14 @@ class RawContractTemplateView(ModelViewSet):
     serializer_class = RawContractTemplateSerializer
     queryset = RawContractTemplate.objects.all()
 
+    def perform_create(self, serializer):
+        ContractTemplateCompiler.enqueue(serializer.save())
+
+    def perform_update(self, serializer):
+        instance = serializer.save()
+        if 'file' in serializer.validated_data:
+            ContractTemplateCompiler.enqueue(instance)
+
     @action(
         methods=['get'],
         detail=True,
@@ -338,6 +346,14 @@ class MarkedUpContractTemplateView(ModelViewSet):
     serializer_class = MarkedUpContractTemplateSerializer
     queryset = MarkedUpContractTemplate.objects.all()
 
+    def perform_create(self, serializer):
+        ContractTemplateCompiler.enqueue(serializer.save())
+
+    def perform_update(self, serializer):
+        instance = serializer.save()
+        if 'file' in serializer.validated_data:
+            ContractTemplateCompiler.enqueue(instance)
+
 
 class ContractListReportView(ModelViewSet):
     """ API для работы с отчетами """
@@ -446,9 +462,26 @@ class ContractSigningView(APIView):
                 cms_signature=cms_signature,
                 signed_data=signed_data,
                 user=request.user,
-                is_dop_contract=is_dop_contract
+                is_dop_contract=is_dop_contract,
+                background=True
             )
 
+            # Подпись верифицирована, PDF формируется в фоне: 202, либо результат, если дождались (?wait=)
+            if result['success'] and 'job_id' in result:
+                job = ContractRenderJob.objects.get(id=result['job_id'])
+                job = ContractRenderJobService.wait(job, ContractRenderJobService.get_wait(request))
+
+                if not job.is_finished:
+                    return Response({**result, **ContractRenderJobService.serialize(job)}, status=status.HTTP_202_ACCEPTED)
+                if job.status == ContractRenderJob.FAILURE:
+                    result = {
+                        'success': False,
+                        'error': f'Ошибка при обработке подписи: {job.error}',
+                        'error_code': 'PROCESSING_ERROR'
+                    }
+                else:
+                    result = job.result
+
             if result['success']:
                 # Дополнительная проверка ИИН если нужно
                 user_iin = getattr(request.user.user_info, 'iin', None)  # Предполагаем что у User есть поле iin
@@ -1046,4 +1079,26 @@ class ContractSigningWebView(View):
             return JsonResponse({
                 'success': False,
                 'error': str(e)
-            }, status=500)
\ No newline at end of file
+            }, status=500)
+
+class ContractRenderJobView(APIView):
+    """API для получения статуса фоновой генерации договора"""
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = get_object_or_404(ContractRenderJob, id=job_id)
+
+        if not job.is_available_to(request.user):
+            return Response({'error': 'Задача не найдена'}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response(ContractRenderJobService.serialize(job), status=status.HTTP_200_OK)
+
+
+class ContractRenderCacheView(APIView):
+    """API статистики кэша готовых PDF договоров: попадания, промахи, размер и среднее время этапов рендера"""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({**ContractRenderCache.stats(), 'stages': ContractRenderTimings.stats()}, status=status.HTTP_200_OK)
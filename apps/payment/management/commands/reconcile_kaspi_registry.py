@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.payment.services_registry import KaspiRegistryReconciliationService
+
+
+class Command(BaseCommand):
+    help = 'Сверка дневного реестра Kaspi (CSV) с t_Transaction / kaspi_transactions. Расхождения пишутся в отчет CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('registry', help='Путь к реестру Kaspi (CSV)')
+        parser.add_argument('report', help='Путь к отчету о расхождениях (CSV)')
+        parser.add_argument('--chunk-size', type=int, default=KaspiRegistryReconciliationService.CHUNK_SIZE)
+        parser.add_argument('--delimiter', default=';')
+
+    def handle(self, *args, **options):
+        service = KaspiRegistryReconciliationService(chunk_size=options['chunk_size'], delimiter=options['delimiter'])
+        try:
+            stats = service.reconcile_path(options['registry'], options['report'])
+        except FileNotFoundError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Kaspi registry reconciled: {", ".join(f"{key}={value}" for key, value in sorted(stats.items()))}'
+        ))
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KaspiPayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('txn_id', models.CharField(max_length=64, unique=True, verbose_name='ID транзакции Kaspi')),
+                ('contract_num', models.CharField(max_length=255, verbose_name='Номер договора')),
+                ('contract_id', models.IntegerField(verbose_name='ID договора в MS SQL')),
+                ('transaction_id', models.IntegerField(blank=True, null=True, verbose_name='ID транзакции в MS SQL')),
+                ('sum', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Сумма')),
+                ('txn_date', models.CharField(blank=True, max_length=14, null=True, verbose_name='Дата транзакции Kaspi')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+            ],
+            options={
+                'verbose_name': 'Платеж Kaspi',
+                'verbose_name_plural': 'Платежи Kaspi',
+                'db_table': 'kaspi_payment',
+            },
+        ),
+    ]
@@ -16,3 +16,23 @@ class KaspiTransactionMS(models.Model):
         verbose_name_plural = 'Kaspi Transactions'
         db_table = 'kaspi_transactions'
         managed = False
+
+
+class KaspiPayment(models.Model):
+    """ Зеркало kaspi_transactions в Postgres: уникальный txn_id для быстрой проверки повторов Kaspi """
+
+    txn_id = models.CharField(max_length=64, unique=True, verbose_name='ID транзакции Kaspi')
+    contract_num = models.CharField(max_length=255, verbose_name='Номер договора')
+    contract_id = models.IntegerField(verbose_name='ID договора в MS SQL')
+    transaction_id = models.IntegerField(null=True, blank=True, verbose_name='ID транзакции в MS SQL')
+    sum = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Сумма')
+    txn_date = models.CharField(max_length=14, null=True, blank=True, verbose_name='Дата транзакции Kaspi')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    def __str__(self):
+        return f'{self.txn_id} - {self.contract_num}'
+
+    class Meta:
+        verbose_name = 'Платеж Kaspi'
+        verbose_name_plural = 'Платежи Kaspi'
+        db_table = 'kaspi_payment'
@@ -0,0 +1,272 @@
+import datetime
+import logging
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+
+from apps.contract.models import ContractMS, TransactionMS
+from apps.contract.services_arrears import ContractArrearsLedgerService
+from apps.contract.services_locator import ContractLocator
+from apps.contract.services_reference import ReferenceDataCache
+from apps.payment.models import KaspiTransactionMS, KaspiPayment
+from apps.user.models import UserMS
+
+logger = logging.getLogger(__name__)
+
+
+class KaspiContractContext:
+    """ Договор, найденный по номеру счета Kaspi, со всеми данными для ответа на check """
+
+    def __init__(self, account, location=None, contract=None, arrears=None) -> None:
+        self.account = account
+        self.location = location
+        self.contract = contract
+        self.arrears = arrears
+
+    @property
+    def status_name(self):
+        try:
+            return self.contract.ContractStatusID.sStatusName
+        except AttributeError:
+            return None
+
+
+class KaspiCheckService:
+    """
+        Обработка команды check от Kaspi.
+        Договор ищется один раз: номер -> ContractLocator, затем один запрос
+        с select_related (ученик, класс, школа, статус) и один расчет задолженности.
+        Время обработки пишется в лог и сравнивается с KASPI_CHECK_LATENCY_BUDGET.
+    """
+
+    RESULT_OK = 0
+    RESULT_NOT_FOUND = 1
+
+    # Статус договора: (код результата, комментарий)
+    STATUS_RESULTS = {
+        'Сформирован': (2, 'Контракт еще не доступен!'),
+        'Отменен': (3, 'Контракт имеет статус "Отменен"'),
+        'Расторгнут': (4, 'Контракт имеет статус "Расторгнут"'),
+        'Завершен': (5, 'Контракт имеет статус "Завершен"'),
+    }
+
+    related_fields = ('StudentID', 'ClassID', 'SchoolID', 'ContractStatusID')
+
+    def resolve(self, account) -> KaspiContractContext:
+        location = ContractLocator.locate(account)
+        if location is None:
+            return KaspiContractContext(account)
+
+        contract = location.model.objects.using('ms_sql') \
+            .select_related(*self.related_fields) \
+            .filter(id=location.contract_id).first()
+        if contract is None:
+            return KaspiContractContext(account, location)
+
+        arrears = ContractArrearsLedgerService(location.contract_type) \
+            .get_arrears([location.contract_id]).get(location.contract_id)
+
+        return KaspiContractContext(account, location, contract, arrears)
+
+    def build_response(self, txn_id, context) -> dict:
+        if context.status_name in self.STATUS_RESULTS:
+            result_code, comment = self.STATUS_RESULTS[context.status_name]
+            return {
+                "txn_id": txn_id,
+                "result": result_code,
+                "comment": comment,
+            }
+
+        contract = context.contract
+        try:
+            return {
+                "txn_id": txn_id,
+                "result": self.RESULT_OK,
+                "comment": "",
+                "fields": {
+                    "Номер договора": {
+                        "value": context.account
+                    },
+                    "BIN школы": {
+                        "value": contract.SchoolID.sBin if contract.SchoolID else None
+                    },
+                    "ФИО ребенка": {
+                        "value": contract.StudentID.full_name
+                    },
+                    "Класс/группа": {
+                        "value": f'{contract.ClassID.class_num}{contract.ClassID.class_liter}'
+                    },
+                    "Вид оплаты": {
+                        "value": "Оплата по договору"
+                    },
+                    "Задолженность по договору": {
+                        "value": context.arrears or 0
+                    }
+                }
+            }
+        except AttributeError:
+            return {
+                "txn_id": txn_id,
+                "result": self.RESULT_NOT_FOUND,
+                "comment": "",
+            }
+
+    def check(self, txn_id, account) -> dict:
+        started = time.perf_counter()
+
+        context = self.resolve(account)
+        resolved = time.perf_counter()
+
+        response_data = self.build_response(txn_id, context)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        message = (f'Kaspi check txn_id={txn_id} account={account} result={response_data["result"]} '
+                   f'resolve={(resolved - started) * 1000:.1f}ms total={elapsed_ms:.1f}ms')
+        if elapsed_ms > settings.KASPI_CHECK_LATENCY_BUDGET:
+            logger.warning(f'{message} exceeds budget {settings.KASPI_CHECK_LATENCY_BUDGET}ms')
+        else:
+            logger.info(message)
+
+        return response_data
+
+
+class KaspiPayService:
+    """
+        Обработка команды pay от Kaspi без повторных проводок.
+        Повтор txn_id находится по уникальному индексу KaspiPayment в Postgres и отвечает
+        исходным prv_txn_id. Новый платеж создает TransactionMS и KaspiTransactionMS
+        в одной транзакции MS SQL, пока строка KaspiPayment удерживает txn_id:
+        параллельный повтор ждет на уникальном индексе и получает уже готовый ответ.
+    """
+
+    RESULT_OK = 0
+    RESULT_NOT_FOUND = 1
+
+    # kaspi_transactions.txn_id и sum - int в MS SQL
+    MAX_TXN_ID = 2 ** 31 - 1
+    SUM_QUANT = Decimal('0.01')
+
+    @classmethod
+    def parse_txn_id(cls, txn_id):
+        if not txn_id or not str(txn_id).isdigit() or int(txn_id) > cls.MAX_TXN_ID:
+            return None
+        return str(txn_id)
+
+    @staticmethod
+    def parse_sum(sum_amount):
+        """ Сумма платежа в целых тенге: дробная сумма не помещается в kaspi_transactions.sum и отклоняется """
+
+        try:
+            amount = Decimal(str(sum_amount))
+        except (InvalidOperation, TypeError):
+            return None
+        if not amount.is_finite() or amount <= 0 or amount != amount.to_integral_value():
+            return None
+        return amount
+
+    @classmethod
+    def build_response(cls, txn_id, payment) -> dict:
+        # Сумма всегда с двумя знаками: первый ответ и повтор (сумма из DecimalField) совпадают
+        return {
+            "txn_id": txn_id,
+            "prv_txn_id": payment.transaction_id,
+            "result": cls.RESULT_OK,
+            "sum": str(Decimal(payment.sum).quantize(cls.SUM_QUANT)),
+            "comment": "OK"
+        }
+
+    @staticmethod
+    def build_error(txn_id, comment='') -> dict:
+        return {
+            "txn_id": txn_id,
+            "result": KaspiPayService.RESULT_NOT_FOUND,
+            "comment": comment,
+        }
+
+    def create_ms_transaction(self, payment, user_login) -> int:
+        """ Проводка в MS SQL. Если txn_id уже есть в kaspi_transactions - возвращается его транзакция """
+
+        transaction_id = KaspiTransactionMS.objects.using('ms_sql').filter(txn_id=int(payment.txn_id)) \
+            .values_list('transaction_id', flat=True).first()
+        if transaction_id is not None:
+            return transaction_id
+
+        payment_type_id = ContractMS.objects.using('ms_sql').filter(id=payment.contract_id) \
+            .values_list('PaymentTypeID', flat=True).first()
+        user = UserMS.objects.using('ms_sql').filter(login=user_login).first() if user_login else None
+
+        with transaction.atomic(using='ms_sql'):
+            transaction_ms = TransactionMS.objects.using('ms_sql').create(
+                agreement_id_id=payment.contract_id,
+                amount=payment.sum,
+                description=f'Kaspi {payment.txn_id}',
+                is_increase=True,
+                payment_type_id=payment_type_id,
+                user_id=user,
+                name='От родителей',
+                contribution=0,
+                trans_date=datetime.datetime.now(),
+                bank_id=ReferenceDataCache.get_by_name(ReferenceDataCache.BANK, 'KASPI'),
+                is_dop_contr=False,
+                dop_contr_date=None
+            )
+            KaspiTransactionMS.objects.using('ms_sql').create(
+                clazz=ContractLocator.STUDY,
+                contract_id_id=payment.contract_id,
+                transaction_id=transaction_ms.id,
+                txn_id=int(payment.txn_id),
+                # Сумма целая (parse_sum), в t_Transaction и kaspi_transactions записывается одно значение
+                sum=int(payment.sum),
+            )
+
+        return transaction_ms.id
+
+    @staticmethod
+    def refresh_arrears(contract_id) -> None:
+        """ Пересчет задолженности договора в витрине, чтобы check сразу показывал долг с учетом платежа """
+
+        try:
+            ContractArrearsLedgerService(ContractArrearsLedgerService.STUDY).refresh([contract_id])
+        except Exception as e:
+            logger.warning(f'Arrears ledger of contract {contract_id} not refreshed after Kaspi pay: {e}')
+
+    def pay(self, txn_id, account, sum_amount, txn_date=None, user_login=None) -> dict:
+        parsed_txn_id = self.parse_txn_id(txn_id)
+        amount = self.parse_sum(sum_amount)
+        if parsed_txn_id is None or amount is None:
+            return self.build_error(txn_id)
+        txn_id = parsed_txn_id
+
+        payment = KaspiPayment.objects.filter(txn_id=txn_id).first()
+        if payment is not None and payment.transaction_id is not None:
+            logger.info(f'Kaspi pay txn_id={txn_id} is a retry, prv_txn_id={payment.transaction_id}')
+            return self.build_response(txn_id, payment)
+
+        location = ContractLocator.locate(account)
+        # Проводки Kaspi пишутся в t_Transaction, поэтому оплата принимается только по договорам на обучение
+        if location is None or location.contract_type != ContractLocator.STUDY:
+            return self.build_error(txn_id)
+
+        with transaction.atomic():
+            payment, created = KaspiPayment.objects.get_or_create(
+                txn_id=txn_id,
+                defaults={
+                    'contract_num': location.contract_num,
+                    'contract_id': location.contract_id,
+                    'sum': amount,
+                    'txn_date': txn_date,
+                }
+            )
+            if payment.transaction_id is None:
+                payment.transaction_id = self.create_ms_transaction(payment, user_login)
+                payment.save(update_fields=['transaction_id'])
+
+                contract_id = payment.contract_id
+                transaction.on_commit(lambda: self.refresh_arrears(contract_id))
+
+        logger.info(f'Kaspi pay txn_id={txn_id} account={account} sum={amount} '
+                    f'prv_txn_id={payment.transaction_id} created={created}')
+
+        return self.build_response(txn_id, payment)
@@ -0,0 +1,250 @@
+import csv
+import datetime
+import logging
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from apps.contract.models import TransactionMS
+from apps.contract.services_reference import ReferenceDataCache
+from apps.payment.models import KaspiTransactionMS
+
+logger = logging.getLogger(__name__)
+
+
+class KaspiRegistryRow:
+    """ Строка реестра Kaspi """
+
+    def __init__(self, line_num, txn_id, account, amount, date) -> None:
+        self.line_num = line_num
+        self.txn_id = txn_id
+        self.account = account
+        self.amount = amount
+        self.date = date
+
+
+class KaspiRegistryReconciliationService:
+    """
+        Сверка дневного реестра Kaspi (CSV) с t_Transaction / kaspi_transactions.
+        Реестр читается потоком пачками по chunk_size строк. Для каждой пачки системные строки
+        за ее интервал дат загружаются одним запросом на таблицу и сопоставляются через словари:
+        по txn_id, а для платежей без записи в kaspi_transactions - по номеру договора и сумме.
+        В отчет пишутся только расхождения, в памяти держится только текущая пачка и множество txn_id.
+    """
+
+    # MS SQL ограничивает количество параметров в запросе (2100)
+    CHUNK_SIZE = 2000
+    # Дата в реестре и дата проводки могут отличаться на сутки (только для сопоставления строк реестра)
+    DATE_TOLERANCE = datetime.timedelta(days=1)
+    DATE_FORMATS = ('%Y%m%d%H%M%S', '%Y-%m-%d %H:%M:%S', '%d.%m.%Y %H:%M:%S', '%Y-%m-%d', '%d.%m.%Y')
+
+    # Колонки реестра: поле -> заголовок в файле
+    COLUMNS = {
+        'txn_id': 'txn_id',
+        'account': 'account',
+        'amount': 'sum',
+        'date': 'date',
+    }
+
+    MISSING_IN_SYSTEM = 'missing_in_system'
+    MISSING_IN_REGISTRY = 'missing_in_registry'
+    MISSING_TRANSACTION = 'missing_transaction'
+    ACCOUNT_MISMATCH = 'account_mismatch'
+    AMOUNT_MISMATCH = 'amount_mismatch'
+    INVALID_ROW = 'invalid_row'
+
+    REPORT_HEADER = ('status', 'line', 'txn_id', 'account', 'registry_sum', 'system_account', 'system_sum',
+                     'transaction_id')
+
+    def __init__(self, chunk_size=CHUNK_SIZE, delimiter=';', columns=None) -> None:
+        self.chunk_size = min(chunk_size, self.CHUNK_SIZE)
+        self.delimiter = delimiter
+        self.columns = {**self.COLUMNS, **(columns or {})}
+        self.stats = defaultdict(int)
+        self.seen_txn_ids = set()
+        self.matched_transaction_ids = set()
+        self.date_from = None
+        self.date_to = None
+
+    @classmethod
+    def parse_date(cls, value):
+        value = (value or '').strip()
+        for date_format in cls.DATE_FORMATS:
+            try:
+                return datetime.datetime.strptime(value, date_format)
+            except ValueError:
+                continue
+        return None
+
+    def parse_row(self, line_num, row):
+        """ Строка CSV -> KaspiRegistryRow или None, если строка не разбирается """
+
+        try:
+            txn_id = int(row[self.columns['txn_id']])
+            amount = Decimal(row[self.columns['amount']].replace(',', '.').replace(' ', ''))
+        except (KeyError, ValueError, InvalidOperation, AttributeError):
+            return None
+
+        date = self.parse_date(row.get(self.columns['date']))
+        if date is None:
+            return None
+
+        return KaspiRegistryRow(line_num, txn_id, (row.get(self.columns['account']) or '').strip(), amount, date)
+
+    def read_chunks(self, file):
+        reader = csv.DictReader(file, delimiter=self.delimiter)
+        rows = enumerate(reader, start=2)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    @staticmethod
+    def load_kaspi_transactions(txn_ids) -> dict:
+        """ kaspi_transactions + t_Transaction для набора txn_id одним запросом: {txn_id: строка} """
+
+        rows = KaspiTransactionMS.objects.using('ms_sql').filter(txn_id__in=txn_ids) \
+            .values('txn_id', 'transaction_id', 'sum', 'contract_id__ContractNum')
+        kaspi_transactions = {row['txn_id']: row for row in rows}
+
+        transaction_ids = [row['transaction_id'] for row in kaspi_transactions.values()]
+        amounts = dict(
+            TransactionMS.objects.using('ms_sql').filter(id__in=transaction_ids).values_list('id', 'amount')
+        )
+        for row in kaspi_transactions.values():
+            row['amount'] = amounts.get(row['transaction_id'])
+
+        return kaspi_transactions
+
+    def load_bank_transactions(self, accounts, date_from, date_to) -> dict:
+        """ Проводки Kaspi без записи в kaspi_transactions: {(номер договора, сумма): [id проводки]} """
+
+        bank = ReferenceDataCache.get_by_name(ReferenceDataCache.BANK, 'KASPI')
+        rows = TransactionMS.objects.using('ms_sql').filter(
+            bank_id=bank,
+            agreement_id__ContractNum__in=accounts,
+            trans_date__range=(date_from - self.DATE_TOLERANCE, date_to + self.DATE_TOLERANCE),
+        ).order_by('id').values_list('id', 'agreement_id__ContractNum', 'amount')
+
+        transactions = defaultdict(list)
+        for transaction_id, account, amount in rows:
+            if transaction_id in self.matched_transaction_ids:
+                continue
+            transactions[(account, Decimal(amount or 0))].append(transaction_id)
+
+        return transactions
+
+    def write(self, writer, status, row=None, system=None, line_num=None) -> None:
+        self.stats[status] += 1
+        system = system or {}
+        writer.writerow((
+            status,
+            row.line_num if row else line_num,
+            row.txn_id if row else system.get('txn_id'),
+            row.account if row else None,
+            row.amount if row else None,
+            system.get('contract_id__ContractNum'),
+            system.get('amount', system.get('sum')),
+            system.get('transaction_id'),
+        ))
+
+    def reconcile_chunk(self, chunk, writer) -> None:
+        rows = []
+        for line_num, raw_row in chunk:
+            row = self.parse_row(line_num, raw_row)
+            if row is None:
+                self.write(writer, self.INVALID_ROW, line_num=line_num)
+                continue
+            rows.append(row)
+
+        if not rows:
+            return
+
+        date_from = min(row.date for row in rows)
+        date_to = max(row.date for row in rows)
+        self.date_from = min(self.date_from or date_from, date_from)
+        self.date_to = max(self.date_to or date_to, date_to)
+
+        kaspi_transactions = self.load_kaspi_transactions([row.txn_id for row in rows])
+
+        unmatched = []
+        for row in rows:
+            self.seen_txn_ids.add(row.txn_id)
+            system = kaspi_transactions.get(row.txn_id)
+            if system is None:
+                unmatched.append(row)
+                continue
+
+            self.matched_transaction_ids.add(system['transaction_id'])
+            if system['amount'] is None:
+                self.write(writer, self.MISSING_TRANSACTION, row, system)
+            elif system['contract_id__ContractNum'] != row.account:
+                self.write(writer, self.ACCOUNT_MISMATCH, row, system)
+            elif Decimal(system['amount']) != row.amount:
+                self.write(writer, self.AMOUNT_MISMATCH, row, system)
+            else:
+                self.stats['matched'] += 1
+
+        if not unmatched:
+            return
+
+        bank_transactions = self.load_bank_transactions(
+            {row.account for row in unmatched}, date_from, date_to
+        )
+        for row in unmatched:
+            transaction_ids = bank_transactions.get((row.account, row.amount))
+            if transaction_ids:
+                self.matched_transaction_ids.add(transaction_ids.pop(0))
+                self.stats['matched_by_account'] += 1
+            else:
+                self.write(writer, self.MISSING_IN_SYSTEM, row)
+
+    def get_registry_window(self) -> tuple:
+        """ Сутки, которые покрывает реестр: [начало первого дня, конец последнего дня] без допуска DATE_TOLERANCE """
+
+        return (
+            datetime.datetime.combine(self.date_from.date(), datetime.time.min),
+            datetime.datetime.combine(self.date_to.date(), datetime.time.max),
+        )
+
+    @staticmethod
+    def load_registry_transactions(date_from, date_to):
+        """ Платежи kaspi_transactions за интервал реестра (итератор) """
+
+        return KaspiTransactionMS.objects.using('ms_sql').filter(date__range=(date_from, date_to)) \
+            .values('txn_id', 'transaction_id', 'sum', 'contract_id__ContractNum').iterator()
+
+    def reconcile_missing_in_registry(self, writer) -> None:
+        """
+            Платежи Kaspi в системе за дни реестра, которых нет в самом реестре.
+            Соседние сутки не берутся: их платежи относятся к реестрам за другие дни.
+        """
+
+        if self.date_from is None:
+            return
+
+        for system in self.load_registry_transactions(*self.get_registry_window()):
+            if system['txn_id'] not in self.seen_txn_ids:
+                self.write(writer, self.MISSING_IN_REGISTRY, system=system)
+
+    def reconcile(self, registry_file, report_file) -> dict:
+        """ Сверка реестра (файловый объект CSV) с записью расхождений в report_file. Возвращает статистику """
+
+        writer = csv.writer(report_file, delimiter=self.delimiter)
+        writer.writerow(self.REPORT_HEADER)
+
+        for chunk in self.read_chunks(registry_file):
+            self.reconcile_chunk(chunk, writer)
+            self.stats['rows'] += len(chunk)
+
+        self.reconcile_missing_in_registry(writer)
+
+        logger.info(f'Kaspi registry reconciled: {dict(self.stats)}')
+
+        return dict(self.stats)
+
+    def reconcile_path(self, registry_path, report_path) -> dict:
+        with open(registry_path, newline='', encoding='utf-8-sig') as registry_file, \
+                open(report_path, 'w', newline='', encoding='utf-8') as report_file:
+            return self.reconcile(registry_file, report_file)
@@ -0,0 +1,10 @@
+from celery import shared_task
+
+from .services_registry import KaspiRegistryReconciliationService
+
+
+@shared_task
+def reconcile_kaspi_registry(registry_path, report_path, delimiter=';'):
+    """ Сверка дневного реестра Kaspi с MS SQL. Отчет о расхождениях пишется в report_path """
+
+    return KaspiRegistryReconciliationService(delimiter=delimiter).reconcile_path(registry_path, report_path)
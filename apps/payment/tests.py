@@ -1,3 +1,223 @@
-from django.test import TestCase
+import contextlib
+import csv
+import datetime
+import io
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from apps.contract.services_locator import ContractLocation, ContractLocator
+from apps.payment.services import KaspiPayService
+from apps.payment.services_registry import KaspiRegistryReconciliationService
+
+
+def generate_registry(rows, delimiter=';'):
+    """ Реестр Kaspi в формате CSV: rows - [(txn_id, номер договора, сумма, дата)] """
+
+    registry = io.StringIO()
+    writer = csv.writer(registry, delimiter=delimiter)
+    writer.writerow(('txn_id', 'account', 'sum', 'date'))
+    for txn_id, account, amount, date in rows:
+        writer.writerow((txn_id, account, amount, date.strftime('%Y%m%d%H%M%S') if date else ''))
+    registry.seek(0)
+    return registry
+
+
+class FakeSystem:
+    """ Платежи MS SQL для сверки: kaspi_transactions и проводки Kaspi без записи в kaspi_transactions """
+
+    def __init__(self, kaspi_transactions=(), bank_transactions=()) -> None:
+        self.kaspi_transactions = {row['txn_id']: row for row in kaspi_transactions}
+        self.bank_transactions = list(bank_transactions)
+        self.windows = []
+        self.kaspi_queries = 0
+
+    def load_kaspi_transactions(self, txn_ids):
+        self.kaspi_queries += 1
+        return {
+            txn_id: {**self.kaspi_transactions[txn_id], 'amount': self.kaspi_transactions[txn_id]['sum']}
+            for txn_id in txn_ids if txn_id in self.kaspi_transactions
+        }
+
+    def load_bank_transactions(self, accounts, date_from, date_to):
+        transactions = {}
+        for transaction_id, account, amount in self.bank_transactions:
+            if account in accounts:
+                transactions.setdefault((account, Decimal(amount)), []).append(transaction_id)
+        return transactions
+
+    def load_registry_transactions(self, date_from, date_to):
+        self.windows.append((date_from, date_to))
+        return iter([
+            {key: value for key, value in row.items() if key != 'date'}
+            for row in self.kaspi_transactions.values() if date_from <= row['date'] <= date_to
+        ])
+
+    def patch(self, service):
+        return mock.patch.multiple(
+            service,
+            load_kaspi_transactions=self.load_kaspi_transactions,
+            load_bank_transactions=self.load_bank_transactions,
+            load_registry_transactions=self.load_registry_transactions,
+        )
+
+
+def kaspi_transaction(txn_id, account, amount, date):
+    return {
+        'txn_id': txn_id,
+        'transaction_id': txn_id + 500000,
+        'sum': amount,
+        'contract_id__ContractNum': account,
+        'date': date,
+    }
+
+
+class KaspiRegistryReconciliationTest(SimpleTestCase):
+    day = datetime.datetime(2024, 9, 2)
+
+    def reconcile(self, registry, system, **kwargs):
+        service = KaspiRegistryReconciliationService(**kwargs)
+        report = io.StringIO()
+        with system.patch(service):
+            stats = service.reconcile(registry, report)
+        report.seek(0)
+        return stats, list(csv.DictReader(report, delimiter=';'))
+
+    def test_matched_and_missing(self):
+        registry = generate_registry([
+            (1001, 'Д-1', 15000, self.day.replace(hour=9)),
+            (1002, 'Д-2', 20000, self.day.replace(hour=12)),
+            (1003, 'Д-3', 5000, self.day.replace(hour=18)),
+            (1005, 'Д-5', 7000, self.day.replace(hour=20)),
+            ('', 'Д-6', 1000, self.day),
+        ])
+        system = FakeSystem(
+            kaspi_transactions=[
+                kaspi_transaction(1001, 'Д-1', 15000, self.day.replace(hour=9)),
+                kaspi_transaction(1005, 'Д-5', 7500, self.day.replace(hour=20)),
+                kaspi_transaction(1004, 'Д-4', 3000, self.day.replace(hour=23, minute=59)),
+                # Платежи соседних суток относятся к другим реестрам
+                kaspi_transaction(1000, 'Д-0', 3000, self.day - datetime.timedelta(hours=1)),
+                kaspi_transaction(1006, 'Д-7', 3000, self.day + datetime.timedelta(days=1, hours=1)),
+            ],
+            bank_transactions=[(700002, 'Д-2', 20000)],
+        )
+
+        stats, report = self.reconcile(registry, system)
+
+        self.assertEqual(stats['rows'], 5)
+        self.assertEqual(stats['matched'], 1)
+        self.assertEqual(stats['matched_by_account'], 1)
+        self.assertEqual(
+            sorted((row['status'], row['txn_id']) for row in report),
+            [
+                ('amount_mismatch', '1005'),
+                ('invalid_row', ''),
+                ('missing_in_registry', '1004'),
+                ('missing_in_system', '1003'),
+            ],
+        )
+        day_end = self.day.replace(hour=23, minute=59, second=59, microsecond=999999)
+        self.assertEqual(system.windows, [(self.day, day_end)])
+
+    def test_generated_registry_in_chunks(self):
+        rows = [
+            (txn_id, f'Д-{txn_id}', 1000 + txn_id % 7, self.day + datetime.timedelta(seconds=txn_id))
+            for txn_id in range(1, 10001)
+        ]
+        system = FakeSystem(kaspi_transactions=[kaspi_transaction(*row) for row in rows if row[0] % 100])
+
+        stats, report = self.reconcile(generate_registry(rows), system, chunk_size=500)
+
+        self.assertEqual(system.kaspi_queries, 20)
+        self.assertEqual(stats['rows'], 10000)
+        self.assertEqual(stats['matched'], 9900)
+        self.assertEqual(stats['missing_in_system'], 100)
+        self.assertEqual({row['status'] for row in report}, {'missing_in_system'})
+
+
+class FakePayment(SimpleNamespace):
+    def save(self, update_fields=None):
+        pass
+
+
+class FakeKaspiPayments:
+    """ Таблица kaspi_payment: при чтении сумма возвращается как из DecimalField(decimal_places=2) """
+
+    def __init__(self) -> None:
+        self.rows = {}
+
+    def load(self, txn_id):
+        row = self.rows.get(txn_id)
+        return FakePayment(**{**vars(row), 'sum': row.sum.quantize(Decimal('0.01'))}) if row else None
+
+    def filter(self, txn_id):
+        return SimpleNamespace(first=lambda: self.load(txn_id))
+
+    def get_or_create(self, txn_id, defaults):
+        if txn_id in self.rows:
+            return self.load(txn_id), False
+        self.rows[txn_id] = FakePayment(txn_id=txn_id, transaction_id=None, **defaults)
+        return self.rows[txn_id], True
+
+
+class KaspiPayServiceTest(SimpleTestCase):
+    locations = {
+        'Д-1': ContractLocation('Д-1', ContractLocator.STUDY, 11),
+        'П-1': ContractLocation('П-1', ContractLocator.FOOD, 12),
+    }
+
+    def setUp(self):
+        self.payments = FakeKaspiPayments()
+        self.ms_transactions = []
+        self.refreshed = []
+
+        def create_ms_transaction(payment, user_login):
+            self.ms_transactions.append(payment.txn_id)
+            return 700000 + len(self.ms_transactions)
+
+        fake_transaction = SimpleNamespace(atomic=contextlib.nullcontext, on_commit=lambda func: func())
+        patches = [
+            mock.patch('apps.payment.services.KaspiPayment', SimpleNamespace(objects=self.payments)),
+            mock.patch('apps.payment.services.transaction', fake_transaction),
+            mock.patch.object(ContractLocator, 'locate', side_effect=self.locations.get),
+            mock.patch.object(KaspiPayService, 'create_ms_transaction', side_effect=create_ms_transaction),
+            mock.patch.object(KaspiPayService, 'refresh_arrears', side_effect=self.refreshed.append),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_retry_returns_same_payment(self):
+        service = KaspiPayService()
+
+        first = service.pay('1001', 'Д-1', '15000')
+        retry = service.pay('1001', 'Д-1', '15000')
+
+        self.assertEqual(first['result'], KaspiPayService.RESULT_OK)
+        self.assertEqual(first, retry)
+        self.assertEqual(first['prv_txn_id'], 700001)
+        self.assertEqual(first['sum'], '15000.00')
+        self.assertEqual(self.ms_transactions, ['1001'])
+        self.assertEqual(self.refreshed, [11])
+
+    def test_rejected_payments(self):
+        service = KaspiPayService()
+
+        for txn_id, account, amount in (
+            ('1002', 'П-1', '1000'),
+            ('1003', 'Д-404', '1000'),
+            (str(KaspiPayService.MAX_TXN_ID + 1), 'Д-1', '1000'),
+            ('1004', 'Д-1', '1000.50'),
+            ('1005', 'Д-1', '0'),
+            ('abc', 'Д-1', '1000'),
+        ):
+            with self.subTest(txn_id=txn_id, account=account, amount=amount):
+                response = service.pay(txn_id, account, amount)
+                self.assertEqual(response['result'], KaspiPayService.RESULT_NOT_FOUND)
+                self.assertEqual(response['txn_id'], txn_id)
+
+        self.assertEqual(self.ms_transactions, [])
+        self.assertEqual(self.payments.rows, {})
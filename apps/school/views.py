@@ -15,7 +15,7 @@ from .serializers.stud_class import ClassSerializer, UpdateStudentClasses, Creat
 
 from .services import ClassCreateService
 from ..contract.models import ContractMS, ContractFoodMS, ContractDriverMS, StudentMS
-from ..contract.services import ContractService
+from ..contract.services_arrears import ContractArrearsLedgerService
 from ..statement.models import Statement
 from ..student.models import Student
 from ..user.models import User, UserInfo
@@ -203,9 +203,13 @@ class SchoolView(ModelViewSet):
         sum_arrears_driver_contracts = 0
 
         contract_list = ContractMS.objects.using('ms_sql').filter(SchoolID=school.id).filter(ContractDate__year=2023)
-        for contract in contract_list:
-            arrears = ContractService(contract_list).get_value_of_arrears_with_contract_num(contract.ContractNum)
-            sum_arrears_study_contracts += arrears['Arrears']
+        contracts = list(contract_list.values_list('id', 'ContractSum'))
+        arrears_totals = ContractArrearsLedgerService(ContractArrearsLedgerService.STUDY).get_totals(
+            [contract_id for contract_id, contract_sum in contracts]
+        )
+        for contract_id, contract_sum in contracts:
+            totals = arrears_totals[contract_id]
+            sum_arrears_study_contracts += contract_sum - (Decimal(totals['planned']) + Decimal(totals['paid']))
 
         # for contract in ContractFoodMS.objects.using('ms_sql').all():
         #     arrears = ContractService(ContractFoodMS.objects.using('ms_sql').filter(SchoolID=school.id)).get_value_of_arrears(contract.ContractNum)
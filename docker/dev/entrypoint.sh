@@ -4,6 +4,10 @@
 echo "Waiting for database to be ready..."
 sleep 5
 
+# Проверяем, что пул LibreOffice сможет подключиться по UNO
+echo "Checking document converter..."
+python manage.py check --deploy --tag converter || exit 1
+
 # Выполняем миграции
 echo "Running migrations..."
 python manage.py migrate
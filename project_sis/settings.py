@@ -276,6 +276,48 @@ CELERY_BEAT_SCHEDULE = env('CELERY_BEAT_SCHEDULE')
 
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024 # 10 Mb limit
 
+# Витрина задолженности: максимальный возраст синхронизации (сек.),
+# после которого задолженность считается напрямую по MS SQL
+ARREARS_LEDGER_MAX_AGE = 15 * 60
+
+# Пул процессов LibreOffice (soffice) для конвертации DOCX -> PDF
+DOCUMENT_CONVERTER_BINARY = env('DOCUMENT_CONVERTER_BINARY', default='soffice')
+DOCUMENT_CONVERTER_POOL_SIZE = env.int('DOCUMENT_CONVERTER_POOL_SIZE', default=2)
+DOCUMENT_CONVERTER_BASE_PORT = env.int('DOCUMENT_CONVERTER_BASE_PORT', default=2002)
+DOCUMENT_CONVERTER_TIMEOUT = env.int('DOCUMENT_CONVERTER_TIMEOUT', default=60)
+DOCUMENT_CONVERTER_START_TIMEOUT = env.int('DOCUMENT_CONVERTER_START_TIMEOUT', default=30)
+DOCUMENT_CONVERTER_PROFILE_DIR = env('DOCUMENT_CONVERTER_PROFILE_DIR', default=None)
+# Системный python3 с пакетом python3-uno: через него мост UNO подключается к процессам soffice
+DOCUMENT_CONVERTER_UNO_PYTHON = env('DOCUMENT_CONVERTER_UNO_PYTHON', default='/usr/bin/python3')
+# Без uno конвертировать холодным soffice --convert-to (только для локальной разработки)
+DOCUMENT_CONVERTER_CLI_FALLBACK = env.bool('DOCUMENT_CONVERTER_CLI_FALLBACK', default=False)
+
+# Возраст строки индекса номеров договоров (сек.), после которого статус и БИН школы перечитываются из MS SQL
+CONTRACT_INDEX_TTL = env.int('CONTRACT_INDEX_TTL', default=60 * 60)
+
+# Фоновая генерация договоров: максимальное ожидание по ?wait= (сек.)
+# и возраст незавершенной задачи (сек.), после которого она считается зависшей
+CONTRACT_RENDER_MAX_WAIT = 30
+CONTRACT_RENDER_JOB_TIMEOUT = 10 * 60
+
+# Один рендер договора на все воркеры: время жизни блокировки (сек.) - дольше самого медленного рендера,
+# и сколько параллельный запрос ждет готовый результат (сек.)
+CONTRACT_RENDER_LOCK_TIMEOUT = 5 * 60
+CONTRACT_RENDER_LOCK_WAIT = 60
+
+# Сколько версий PDF договора хранить (вместе с текущей), старые удаляются при записи новой
+CONTRACT_DOCUMENT_KEEP_VERSIONS = env.int('CONTRACT_DOCUMENT_KEEP_VERSIONS', default=3)
+
+# Кэш готовых PDF договоров (ключ - хэш всех данных документа): каталог и бюджет размера (байт)
+CONTRACT_RENDER_CACHE_DIR = env('CONTRACT_RENDER_CACHE_DIR', default=os.path.join(BASE_DIR, 'contracts', 'render_cache'))
+CONTRACT_RENDER_CACHE_MAX_SIZE = env.int('CONTRACT_RENDER_CACHE_MAX_SIZE', default=1024 * 1024 * 1024)
+
+# Шрифт с кириллицей для PDF предпросмотра договора (xhtml2pdf)
+CONTRACT_PREVIEW_FONT = env('CONTRACT_PREVIEW_FONT', default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
+# Kaspi: бюджет времени ответа на команду check (мс), превышение пишется в лог
+KASPI_CHECK_LATENCY_BUDGET = 1000
+
 EDS_OMAROV_KEY = env('EDS_OMAROV_KEY')
 EDS_SERIKOV_KEY = env('EDS_SERIKOV_KEY')
 
@@ -308,5 +350,10 @@ LOGGING = {
             'level': 'INFO',
             'propagate': True,
         },
+        'apps.payment': {
+            'handlers': ['file', 'console'],
+            'level': 'INFO',
+            'propagate': True,
+        },
     },
 }
\ No newline at end of file